@@ -56,6 +56,10 @@ def create_plugin():
 
     eapm_plugin.addBlock(analysePELEBlock)
 
+    from Blocks.pele_msm import peleMSMBlock
+
+    eapm_plugin.addBlock(peleMSMBlock)
+
     from Blocks.conserved_residues import conservedResiduesMSABlock
 
     eapm_plugin.addBlock(conservedResiduesMSABlock)
@@ -104,6 +108,10 @@ def create_plugin():
 
     eapm_plugin.addBlock(AnalyseGBlock)
 
+    from Blocks.docking_index import queryDockingIndexBlock
+
+    eapm_plugin.addBlock(queryDockingIndexBlock)
+
     # from Blocks.Rbcavity import rbCavityBlock
 
     # eapm_plugin.addBlock(rbCavityBlock)
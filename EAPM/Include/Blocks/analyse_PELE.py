@@ -2,7 +2,7 @@
 Module containing the analyse PELE block for the EAPM plugin
 """
 
-from HorusAPI import PluginBlock, PluginVariable, VariableTypes
+from HorusAPI import PluginVariable, SlurmBlock, VariableTypes
 
 peleOutputFolderInput = PluginVariable(
     id="pele_folder",
@@ -12,13 +12,203 @@ peleOutputFolderInput = PluginVariable(
     defaultValue="pele",
 )
 
+distanceRulesInput = PluginVariable(
+    id="distance_rules",
+    name="Distance rules",
+    description="YAML file with the rules that group the distances into metrics. "
+    "If not given, the SER-L, SER-HIS and HIS-ASP catalytic rules are used.",
+    type=VariableTypes.FILE,
+    allowedValues=["yaml"],
+)
+
+fetchBestTrajectoriesVariable = PluginVariable(
+    id="fetch_best_trajectories",
+    name="Fetch best trajectories",
+    description="Number of best binding energy poses per protein and ligand whose "
+    "trajectories are downloaded from the remote, when the PELE block left them there.",
+    type=VariableTypes.INTEGER,
+    defaultValue=0,
+)
+
+landscapeModeVariable = PluginVariable(
+    id="landscape_mode",
+    name="Landscape mode",
+    description="How the binding energy landscapes are drawn. 'scatter' draws every step with "
+    "pele_analysis, 'binned' accumulates the steps into 2D histograms and only draws the best "
+    "steps.",
+    type=VariableTypes.STRING_LIST,
+    allowedValues=["scatter", "binned"],
+    defaultValue="scatter",
+)
+
+landscapeBinsVariable = PluginVariable(
+    id="landscape_bins",
+    name="Landscape bins",
+    description="Number of bins per axis of the binned landscapes",
+    type=VariableTypes.INTEGER,
+    defaultValue=100,
+)
+
+landscapeTopVariable = PluginVariable(
+    id="landscape_top",
+    name="Landscape top steps",
+    description="Number of best binding energy steps per protein and ligand drawn on the "
+    "binned landscapes",
+    type=VariableTypes.INTEGER,
+    defaultValue=10,
+)
+
+clusterPosesVariable = PluginVariable(
+    id="cluster_poses",
+    name="Cluster poses",
+    description="Cluster the ligand poses of each protein and ligand by ligand RMSD after the "
+    "receptor superposition and write the lowest binding energy pose of each cluster into "
+    "pele_clusters. Trajectories left on the remote are downloaded.",
+    type=VariableTypes.BOOLEAN,
+    defaultValue=False,
+)
+
+clusterThresholdVariable = PluginVariable(
+    id="cluster_threshold",
+    name="Clustering RMSD threshold",
+    description="Ligand heavy atom RMSD (Å) under which a pose joins a cluster",
+    type=VariableTypes.FLOAT,
+    defaultValue=2.0,
+)
+
+ligandSelectionVariable = PluginVariable(
+    id="ligand_selection",
+    name="Ligand selection",
+    description="MDTraj selection of the ligand atoms used for the clustering",
+    type=VariableTypes.STRING,
+    defaultValue="not protein and not water and not element H",
+)
+
+
+packTrajectoriesVariable = PluginVariable(
+    id="pack_trajectories",
+    name="Pack trajectories",
+    description="Pack the trajectories of each protein and ligand into compressed shards with "
+    "a frame index (.trajectory_store inside the PELE folder), so single poses load without "
+    "scanning the trajectory files. Trajectories left on the remote are downloaded.",
+    type=VariableTypes.BOOLEAN,
+    defaultValue=False,
+)
+
+energyByResidueVariable = PluginVariable(
+    id="energy_by_residue",
+    name="Energy by residue",
+    description="Aggregation of the energy by residue columns into one matrix per protein and "
+    "ligand. 'boltzmann' weights the steps by their binding energy, 'best_k' averages the "
+    "best binding energy steps.",
+    type=VariableTypes.STRING_LIST,
+    allowedValues=["none", "boltzmann", "best_k"],
+    defaultValue="none",
+)
+
+energyByResidueTypeVariable = PluginVariable(
+    id="energy_by_residue_type",
+    name="Energy by residue type",
+    description="Type of the energy by residue columns aggregated",
+    type=VariableTypes.STRING_LIST,
+    allowedValues=["all", "lennard_jones", "sgb", "electrostatic"],
+    defaultValue="all",
+)
+
+energyByResidueTopVariable = PluginVariable(
+    id="energy_by_residue_top",
+    name="Energy by residue best steps",
+    description="Number of best binding energy steps averaged in the best_k aggregation",
+    type=VariableTypes.INTEGER,
+    defaultValue=10,
+)
+
+temperatureVariable = PluginVariable(
+    id="temperature",
+    name="Temperature",
+    description="Temperature (K) of the Boltzmann weights",
+    type=VariableTypes.FLOAT,
+    defaultValue=298.15,
+)
+
+processesVariable = PluginVariable(
+    id="processes",
+    name="Processes",
+    description="Number of processes parsing the lines appended to the reports since the "
+    "last analysis. All the available CPUs if 0.",
+    type=VariableTypes.INTEGER,
+    defaultValue=0,
+)
+
+remoteAnalysisVariable = PluginVariable(
+    id="remote_analysis",
+    name="Remote analysis",
+    description="Analyse the reports on the remote where the PELE block left the data, as a "
+    "job, and only download the summary tables and plots.",
+    type=VariableTypes.BOOLEAN,
+    defaultValue=False,
+    category="Remote",
+)
+
+remotePeleFolderVariable = PluginVariable(
+    id="remote_pele_folder",
+    name="Remote PELE folder",
+    description="Path of the PELE folder on the remote. By default it is read from the "
+    "trajectory index written by the PELE block.",
+    type=VariableTypes.STRING,
+    category="Remote",
+)
+
+pythonExecutableVariable = PluginVariable(
+    id="python_executable",
+    name="Python executable",
+    description="Python used by the remote analysis job, it needs pele_analysis, numpy, "
+    "pandas, matplotlib and pyyaml",
+    type=VariableTypes.STRING,
+    defaultValue="python",
+    category="Remote",
+)
 
-def analyse_PELE(block: PluginBlock):
+
+def analysePELEAction(block: SlurmBlock):
+    """
+    Initial action of the Analyse PELE block. Runs the analysis locally or
+    submits it as a job on the remote that holds the PELE data.
+    """
+    if block.variables.get(remoteAnalysisVariable.id, False) and block.remote.name != "Local":
+        block.extraData["remoteAnalysis"] = True
+        launchRemoteAnalysis(block)
+    else:
+        block.extraData["remoteAnalysis"] = False
+        analyse_PELE(block)
+
+
+def analysePELEFinalAction(block: SlurmBlock):
+    """
+    Final action of the Analyse PELE block. Downloads the summaries of the
+    remote analysis.
+    """
+    # pylint: disable=import-outside-toplevel
+    from utils import downloadResultsAction, storeTableResults
+
+    # pylint: enable=import-outside-toplevel
+
+    if block.extraData.get("remoteAnalysis", False):
+        downloadResultsAction(block)
+        print("Remote analysis downloaded: pele_summary.csv and pele_best_steps.csv")
+        storeTableResults("pele_summary.csv", "PELE summary")
+        storeTableResults("pele_best_steps.csv", "PELE best steps")
+
+
+def analyse_PELE(block: SlurmBlock):
     """
     Analyze PELE data and calculates catalytic distances.
 
+    The data read by pele_analysis is stored in the report cache of the PELE
+    folder, which the summaries, clustering and packing read column by column.
+
     Args:
-        block (PluginBlock): The PluginBlock object representing the PELE block.
+        block (SlurmBlock): The SlurmBlock object representing the Analyse PELE block.
 
     Returns:
         None
@@ -27,67 +217,255 @@ def analyse_PELE(block: PluginBlock):
         None
     """
     # pylint: disable=import-outside-toplevel
-    import pele_analysis
+    from pele_utils import analysePELEFolder
+    from utils import storeTableResults
 
     # pylint: enable=import-outside-toplevel
 
     pele_folder = block.inputs.get(peleOutputFolderInput.id, "pele")
 
-    pele = pele_analysis.peleAnalysis(
+    report_cache = analysePELEFolder(
         pele_folder,
-        verbose=True,
-        separator="-",
-        trajectories=False,
-        data_folder_name="pele_data/",
-        read_equilibration=True,
+        rules_path=block.inputs.get(distanceRulesInput.id, None),
+        landscape_mode=block.variables.get(landscapeModeVariable.id, "scatter"),
+        landscape_bins=int(block.variables.get(landscapeBinsVariable.id, 100)),
+        landscape_top=int(block.variables.get(landscapeTopVariable.id, 10)),
+        processes=getProcesses(block),
+        **getEnergyByResidueOptions(block),
+    )
+
+    storeTableResults("pele_summary.csv", "PELE summary")
+    storeTableResults("pele_best_steps.csv", "PELE best steps")
+
+    fetch_best = block.variables.get(fetchBestTrajectoriesVariable.id, 0)
+    if fetch_best:
+        fetchBestTrajectories(block, report_cache, pele_folder, int(fetch_best))
+
+    if block.variables.get(clusterPosesVariable.id, False):
+        clusterPELEPoses(block, report_cache, pele_folder)
+
+    if block.variables.get(packTrajectoriesVariable.id, False):
+        packPELETrajectories(block, report_cache, pele_folder)
+
+
+def getEnergyByResidueOptions(block: SlurmBlock) -> dict:
+    """
+    Returns the energy by residue options of analysePELEFolder set in the block.
+    """
+    mode = block.variables.get(energyByResidueVariable.id, "none")
+    return {
+        "energy_by_residue": None if mode in (None, "none") else mode,
+        "energy_by_residue_type": block.variables.get(energyByResidueTypeVariable.id, "all"),
+        "energy_by_residue_top": int(block.variables.get(energyByResidueTopVariable.id, 10)),
+        "temperature": float(block.variables.get(temperatureVariable.id, 298.15)),
+    }
+
+
+def getProcesses(block: SlurmBlock):
+    """
+    Returns the number of processes parsing the reports set in the block, None for
+    all the available CPUs.
+    """
+    processes = int(block.variables.get(processesVariable.id, 0) or 0)
+    return processes if processes > 0 else None
+
+
+def launchRemoteAnalysis(block: SlurmBlock):
+    """
+    Submits the report analysis as a job on the remote. Only pele_utils and the
+    distance rules are uploaded, the job reads the PELE folder in place with
+    pele_analysis, and its data folder and report cache stay inside the remote PELE
+    folder for the next analysis.
+    """
+    # pylint: disable=import-outside-toplevel
+    import os
+    import shutil
+
+    import pele_utils
+    from utils import launchCalculationAction
+
+    # pylint: enable=import-outside-toplevel
+
+    pele_folder = block.inputs.get(peleOutputFolderInput.id, "pele")
+
+    remote_pele_folder = block.variables.get(remotePeleFolderVariable.id)
+    if not remote_pele_folder:
+        index = pele_utils.readTrajectoryIndex(pele_folder)
+        if index is None:
+            raise ValueError(
+                "The PELE data was downloaded, there is nothing to analyse on the remote. "
+                "Set the remote PELE folder or disable the remote analysis."
+            )
+        if index["host"] != block.remote.host:
+            raise ValueError(
+                f"The PELE data is stored on {index['remote']} ({index['host']}). "
+                "Select that remote to analyse it."
+            )
+        remote_pele_folder = index["remote_folder"]
+
+    if (
+        block.variables.get(fetchBestTrajectoriesVariable.id, 0)
+        or block.variables.get(clusterPosesVariable.id, False)
+        or block.variables.get(packTrajectoriesVariable.id, False)
+    ):
+        print("Fetching, clustering and packing trajectories are only done in local analyses")
+
+    # The job only needs the analysis module and the rules
+    scripts_folder = "pele_analysis_scripts"
+    if os.path.exists(scripts_folder):
+        shutil.rmtree(scripts_folder)
+    os.makedirs(scripts_folder)
+    shutil.copy(pele_utils.__file__, scripts_folder)
+    rules = block.inputs.get(distanceRulesInput.id, None) or pele_utils.DISTANCE_RULES_FILE
+    shutil.copy(rules, os.path.join(scripts_folder, "pele_distance_rules.yaml"))
+
+    python = block.variables.get(pythonExecutableVariable.id) or "python"
+    data_folder = os.path.join(remote_pele_folder, pele_utils.PELE_DATA_FOLDER)
+    command = (
+        f"{python} {scripts_folder}/pele_utils.py {remote_pele_folder}"
+        f" --output_folder . --data_folder {data_folder}"
+        f" --rules {scripts_folder}/pele_distance_rules.yaml"
+        f" --landscape_mode {block.variables.get(landscapeModeVariable.id, 'scatter')}"
+        f" --landscape_bins {int(block.variables.get(landscapeBinsVariable.id, 100))}"
+        f" --landscape_top {int(block.variables.get(landscapeTopVariable.id, 10))}"
+    )
+    if getProcesses(block) is not None:
+        command += f" --processes {getProcesses(block)}"
+    for option, value in getEnergyByResidueOptions(block).items():
+        if value is not None:
+            command += f" --{option} {value}"
+
+    launchCalculationAction(block, [command], program=None, uploadFolders=[scripts_folder])
+
+
+def fetchBestTrajectories(block: SlurmBlock, report_cache, pele_folder: str, n_poses: int):
+    """
+    Downloads the trajectories containing the best binding energy poses of each
+    protein and ligand.
+
+    Args:
+        block (SlurmBlock): The SlurmBlock object representing the Analyse PELE block.
+        report_cache (pele_utils.PELEReportCache): The report cache of the PELE folder.
+        pele_folder (str): Folder containing the PELE output.
+        n_poses (int): Number of poses to take per protein and ligand.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pele_utils import fetchTrajectories, getTrajectoryPaths, readTrajectoryIndex
+
+    # pylint: enable=import-outside-toplevel
+
+    if readTrajectoryIndex(pele_folder) is None:
+        print("All the trajectories are available locally, nothing to fetch")
+        return
+
+    best_poses = (
+        report_cache.getData(["Binding Energy"])
+        .sort_values("Binding Energy")
+        .groupby(level=["Protein", "Ligand"], sort=False, observed=True)
+        .head(n_poses)
     )
 
-    # Classify distances into common metrics --> the catalytic labels
-    catalytic_names = ["SER-L", "SER-HIS", "HIS-ASP"]
+    poses = set()
+    for index in best_poses.index:
+        protein, ligand, epoch, trajectory = index[:4]
+        poses.add((protein, ligand, epoch, trajectory))
 
-    catalytic_labels = {}
-    for cn in catalytic_names:
-        catalytic_labels[cn] = {}
-        for protein in pele.proteins:
-            if protein not in catalytic_labels[cn]:
-                catalytic_labels[cn][protein] = {}
-            for ligand in pele.ligands:
-                if ligand not in catalytic_labels[cn][protein]:
-                    catalytic_labels[cn][protein][ligand] = []
+    trajectories = getTrajectoryPaths(pele_folder, sorted(poses), separator="-")
+    fetchTrajectories(block, pele_folder, trajectories)
 
-    for protein in pele.proteins:
-        for ligand in pele.ligands:
-            distances = pele.getDistances(protein, ligand)
-            if distances is None:
-                continue
-            for d in distances:
-                at1 = d.replace("distance_", "").split("_")[0]
-                at2 = d.replace("distance_", "").split("_")[1]
-                if at1.endswith("OG") and at2.startswith("L"):
-                    catalytic_labels["SER-L"][protein][ligand].append(d)
+    print(f"Fetched {len(trajectories)} trajectories containing the best poses")
 
-                elif at1.endswith("OG") and at2.endswith("NE2"):
-                    catalytic_labels["SER-HIS"][protein][ligand].append(d)
 
-                elif at1.endswith("ND1") and (at2.endswith("OD1") or at2.endswith("OD2")):
-                    catalytic_labels["HIS-ASP"][protein][ligand].append(d)
+def clusterPELEPoses(block: SlurmBlock, report_cache, pele_folder: str):
+    """
+    Clusters the ligand poses of every protein and ligand, downloading first the
+    trajectories left on the remote.
 
-    print("catalytic_labels", catalytic_labels)
+    Args:
+        block (SlurmBlock): The SlurmBlock object representing the Analyse PELE block.
+        report_cache (pele_utils.PELEReportCache): The report cache of the PELE folder.
+        pele_folder (str): Folder containing the PELE output.
+    """
+    # pylint: disable=import-outside-toplevel
+    import os
+
+    import pandas as pd
+    from pele_utils import LIGAND_SELECTION, clusterLigandPoses, fetchMissingTrajectories
+
+    # pylint: enable=import-outside-toplevel
+
+    fetchMissingTrajectories(block, pele_folder)
+
+    threshold = float(block.variables.get(clusterThresholdVariable.id, 2.0))
+    ligand_selection = block.variables.get(ligandSelectionVariable.id) or LIGAND_SELECTION
+
+    clusters = []
+    for protein, ligand in report_cache.getPairRows():
+        pair_clusters = clusterLigandPoses(
+            report_cache,
+            protein,
+            ligand,
+            "pele_clusters",
+            threshold=threshold,
+            ligand_selection=ligand_selection,
+        )
+        if pair_clusters is not None:
+            print(f"{protein} {ligand}: {len(pair_clusters)} clusters")
+            clusters.append(pair_clusters)
+
+    if clusters:
+        pd.concat(clusters).to_csv(os.path.join("pele_clusters", "clusters.csv"), index=False)
+
+
+def packPELETrajectories(block: SlurmBlock, report_cache, pele_folder: str):
+    """
+    Packs the trajectories of every protein and ligand into the trajectory store
+    of the PELE folder, downloading first the trajectories left on the remote.
+
+    Args:
+        block (SlurmBlock): The SlurmBlock object representing the Analyse PELE block.
+        report_cache (pele_utils.PELEReportCache): The report cache of the PELE folder.
+        pele_folder (str): Folder containing the PELE output.
+    """
+    # pylint: disable=import-outside-toplevel
+    from pele_utils import PELETrajectoryStore, fetchMissingTrajectories
+
+    # pylint: enable=import-outside-toplevel
 
-    # Calculate the catalytic distances for each group of distances
-    pele.combineDistancesIntoMetrics(catalytic_labels, overwrite=True)
+    fetchMissingTrajectories(block, pele_folder)
 
-    print("Success combining distances into metrics")
+    store = PELETrajectoryStore(pele_folder, separator="-")
+    packed = store.pack(report_cache)
+    print(f"Packed {packed} frames into {store.store_folder}")
 
-    pele.bindingEnergyLandscape()
 
+from utils import BSC_JOB_VARIABLES
 
-analysePELEBlock = PluginBlock(
+analysePELEBlock = SlurmBlock(
     name="Analyse PELE",
     id="analyse_pele",
     description="Analyse PELE output",
-    action=analyse_PELE,
-    inputs=[peleOutputFolderInput],
-    variables=[],
+    initialAction=analysePELEAction,
+    finalAction=analysePELEFinalAction,
+    inputs=[peleOutputFolderInput, distanceRulesInput],
+    variables=BSC_JOB_VARIABLES
+    + [
+        fetchBestTrajectoriesVariable,
+        landscapeModeVariable,
+        landscapeBinsVariable,
+        landscapeTopVariable,
+        clusterPosesVariable,
+        clusterThresholdVariable,
+        ligandSelectionVariable,
+        packTrajectoriesVariable,
+        energyByResidueVariable,
+        energyByResidueTypeVariable,
+        energyByResidueTopVariable,
+        temperatureVariable,
+        processesVariable,
+        remoteAnalysisVariable,
+        remotePeleFolderVariable,
+        pythonExecutableVariable,
+    ],
     outputs=[],
 )
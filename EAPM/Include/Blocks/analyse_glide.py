@@ -121,6 +121,13 @@ separatorVar = PluginVariable(
     type=VariableTypes.STRING,
     defaultValue="@",
 )
+indexResultsVar = PluginVariable(
+    name="Add to docking index",
+    id="index_results",
+    description="Add the analysed poses to the docking index, to query them across dockings",
+    type=VariableTypes.BOOLEAN,
+    defaultValue=False,
+)
 
 
 def final_action(block: PluginBlock):
@@ -142,6 +149,14 @@ def final_action(block: PluginBlock):
     import pickle
 
     import prepare_proteins
+    from docking_utils import (
+        analyseDockingLocally,
+        combineDockingMetrics,
+        indexDockingResults,
+        readDockingDistances,
+        selectBestDockingPoses,
+    )
+    from structure_utils import ResidueIndex
 
     # pylint: enable=import-outside-toplevel
 
@@ -185,18 +200,14 @@ def final_action(block: PluginBlock):
             conserved_indexes_f[model] = [conserved_indexes]
         conserved_indexes = conserved_indexes_f
 
+    residue_index = ResidueIndex(model_folder, models)
     center_atom = {}  # Create dictionary to store the atom 3-element tuple for each model
     for model in models:  # Iterate the models inside the library
-        # Iterate the residues for each Bio.PDB.Structure object
-        for r in models.structures[model].get_residues():
-            # Check that the residue matches the defined index
-            # for cons_ind in conserved_indexes[model]:
-            if r.id[1] in conserved_indexes[model]:
-                # Assert that the residue has the correct residue identity
-                if r.resname == res_name_prot:
-                    # Store the corresponding tuple.
-                    center_atom[model] = (r.get_parent().id, r.id[1], atom_name_prot)
-                    break
+        # First residue of the structure with a conserved index and the protein residue name
+        residues = residue_index.findResidues(model, conserved_indexes[model], name=res_name_prot)
+        if residues:
+            chain, number, _ = residues[0]
+            center_atom[model] = (chain, number, atom_name_prot)
 
     atom_pairs = {}  # Define the dictionary containing the atom pairs for each model
     for model in models:
@@ -205,19 +216,18 @@ def final_action(block: PluginBlock):
             atom_pairs[model][ligand] = []
             atom_pairs[model][ligand].append((center_atom[model], atom_name_lig))
 
-    models.analyseDocking(folder_to_analyse, atom_pairs=atom_pairs, separator=separator)
+    # The distances are computed with NumPy from the pose files, without Schrodinger
+    analyseDockingLocally(models, folder_to_analyse, atom_pairs, separator=separator)
 
-    metric_distances = {}  # Define the global dictionary
-    metric_distances[metrics] = {}  # Define the metric nested dictionary
-    for model in models:
-        metric_distances[metrics][model] = {}  # Define the model nested dictionary
-        for ligand in models.docking_ligands[model]:
-            # Define the ligand nested dictionary with all the docking distances list
-            metric_distances[metrics][model][ligand] = models.getDockingDistances(model, ligand)
-
-    models.combineDockingDistancesIntoMetrics(metric_distances)
+    # Every distance of a model and ligand belongs to the metric
+    distances = readDockingDistances(
+        folder_to_analyse, models=list(models.models_names), long_form=True
+    )
+    metric_values = combineDockingMetrics(distances, [metrics])
+    models.docking_data = models.docking_data.drop(columns=metric_values.columns, errors="ignore")
+    models.docking_data = models.docking_data.join(metric_values)
 
-    best_poses = models.getBestDockingPosesIteratively(metric_distances)
+    best_poses = selectBestDockingPoses(models.docking_data, list(metric_values.columns))
 
     models.extractDockingPoses(
         best_poses,
@@ -227,6 +237,15 @@ def final_action(block: PluginBlock):
         remove_previous=remove_previous,
     )
 
+    # Keep the analysed poses in the docking index, to query them across campaigns
+    if block.variables.get(indexResultsVar.id, False):
+        indexDockingResults(
+            models.docking_data,
+            folder_to_analyse,
+            separator=separator,
+            poses_folder="best_docking_poses",
+        )
+
     block.setOutput(outputModelsVariable.id, "best_docking_poses")
 
     glide_output = {
@@ -246,7 +265,7 @@ AnalyseGBlock = PluginBlock(
     id="Analyse_Glide",
     description="To analyse Glide results",
     action=final_action,
-    variables=[metricsVar, removePreviousVar, separatorVar],
+    variables=[metricsVar, removePreviousVar, separatorVar, indexResultsVar],
     inputGroups=[atomGroup, stringGroup],
     outputs=[outputModelsVariable, analyseGlideOutputVariable],
 )
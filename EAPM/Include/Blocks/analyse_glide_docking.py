@@ -1,5 +1,4 @@
 from HorusAPI import (
-    Extensions,
     PluginBlock,
     PluginVariable,
     VariableGroup,
@@ -111,6 +110,23 @@ maxThresholdVariable = PluginVariable(
     defaultValue=5,
 )
 
+indexResultsVariable = PluginVariable(
+    id="index_results",
+    name="Add to docking index",
+    description="Add the analysed poses to the docking index, to query them across dockings",
+    type=VariableTypes.BOOLEAN,
+    defaultValue=False,
+)
+
+extractionProcessesVariable = PluginVariable(
+    id="extraction_processes",
+    name="Extraction processes",
+    description="Number of pose extraction chunks run in parallel on the remote, and of local "
+    "processes checking the extracted poses for covalent ligands",
+    type=VariableTypes.INTEGER,
+    defaultValue=4,
+)
+
 # Output variables
 outputPosesVariable = PluginVariable(
     id="output_poses",
@@ -203,6 +219,7 @@ def analyseDockingAction(block: PluginBlock):
             docking_data,
             block.extraData["final_path_folder_to_analyse"],
             output_poses,
+            processes=int(block.variables.get(extractionProcessesVariable.id, 4)),
         )
 
         block.setOutput("output_poses", output_poses)
@@ -275,44 +292,70 @@ def analyseDockingAction(block: PluginBlock):
 
     print("Docking analysis finished")
 
-    metric_distances = {}  # Define the global dictionary
-    for group in groups:
-        metric_distances[group] = {}  # Define the metric nested dictionary
-        for model in models:
-            metric_distances[group][model] = {}  # Define the model nested dictionary
-            for ligand in models.docking_ligands[model]:
-                # Define the ligand nested dictionary with all the docking distances list
-                metric_distances[group][model][ligand] = models.getDockingDistances(model, ligand)
+    from docking_utils import (
+        combineDockingMetrics,
+        indexDockingResults,
+        readDockingDistances,
+        selectBestDockingPoses,
+    )
+    from utils import storeTableResults
 
-    models.combineDockingDistancesIntoMetrics(metric_distances, overwrite=True)
+    # Every distance of a model and ligand belongs to every group
+    distances = readDockingDistances(
+        folder_to_analyse, models=list(models.models_names), long_form=True
+    )
+    metrics = combineDockingMetrics(distances, groups)
 
-    # Generate an HTML report containing the results
+    # Show the results as paged tables, the HTML of every pose is too large for the browser
     if models.docking_data is not None:
-        html = models.docking_data.to_html()
+        models.docking_data = models.docking_data.drop(columns=metrics.columns, errors="ignore")
+        models.docking_data = models.docking_data.join(metrics)
 
-        Extensions().storeExtensionResults(
-            "horus", "html_loader", data={"html": html}, title="Docking results"
+        storeTableResults(
+            os.path.join(folder_to_analyse, ".analysis", "docking_results.parquet"),
+            "Docking results",
+            table=models.docking_data,
         )
+    else:
+        raise Exception(f"No docking data was found in {folder_to_analyse}")
 
     max_threshold = float(block.variables.get("max_threshold", 5))
 
-    best_poses = models.getBestDockingPosesIteratively(
-        metric_distances, max_threshold=max_threshold
+    best_poses = selectBestDockingPoses(
+        models.docking_data, list(metrics.columns), max_threshold=max_threshold
     )
 
     if len(best_poses) == 0:
         raise Exception("No best poses found with the given threshold. Try a lower threshold")
 
-    html = best_poses.to_html()
-
-    Extensions().storeExtensionResults(
-        "horus", "html_loader", data={"html": html}, title="Best docking poses"
+    storeTableResults(
+        os.path.join(folder_to_analyse, ".analysis", "best_docking_poses.parquet"),
+        "Best docking poses",
+        table=best_poses,
     )
 
+    # The local analysis does not need the docking folder on the remote, only the extraction
+    if "final_path_folder_to_analyse" not in block.extraData:
+        uploadDockingFolder(block, folder_to_analyse)
+
     extractDockingPoses(
-        block, models, best_poses, block.extraData["final_path_folder_to_analyse"], output_poses
+        block,
+        models,
+        best_poses,
+        block.extraData["final_path_folder_to_analyse"],
+        output_poses,
+        processes=int(block.variables.get(extractionProcessesVariable.id, 4)),
     )
 
+    # Keep the analysed poses in the docking index, to query them across campaigns
+    if block.variables.get("index_results", False):
+        indexDockingResults(
+            models.docking_data,
+            folder_to_analyse,
+            separator=separatorValue,
+            poses_folder=output_poses,
+        )
+
     print("Docking analysis finished")
 
     block.setOutput("output_poses", output_poses)
@@ -335,6 +378,8 @@ analyseGlideDocking = PluginBlock(
         maxThresholdVariable,
         posesFolderNameVariable,
         selectionsListVariable,
+        indexResultsVariable,
+        extractionProcessesVariable,
     ],
     outputs=[outputPosesVariable, analyseGlideOutputVariable],
     action=analyseDockingAction,
@@ -352,6 +397,7 @@ def analyseDocking(
     ignore_hydrogens=False,
     separator="-",
     overwrite=True,
+    local_analysis=True,
 ):
     """
     Analyse a Glide Docking simulation. The function allows to calculate ligand
@@ -389,6 +435,9 @@ def analyseDocking(
         Symbol to use for separating protein from ligand names. Should not be found in any model or ligand name.
     overwrite : bool
         Rerun analysis.
+    local_analysis : bool
+        Compute the distances locally from the pose files. If False, the Schrodinger
+        analysis script is run on the remote.
     """
 
     import json
@@ -397,6 +446,24 @@ def analyseDocking(
     import pandas as pd
     import prepare_proteins
 
+    # The distances are computed locally, Schrodinger is only needed if requested
+    if local_analysis and (atom_pairs != None or protein_atoms != None):
+        from docking_utils import analyseDockingLocally
+
+        failed_dockings = analyseDockingLocally(
+            models,
+            docking_folder,
+            atom_pairs,
+            separator=separator,
+            only_models=models.models_names,
+            skip_chains=skip_chains,
+            protein_atoms=protein_atoms,
+            ignore_hydrogens=ignore_hydrogens,
+        )
+        if return_failed:
+            return failed_dockings
+        return
+
     # Create analysis folder
     if not os.path.exists(docking_folder + "/.analysis"):
         os.mkdir(docking_folder + "/.analysis")
@@ -420,11 +487,7 @@ def analyseDocking(
             json.dump(atom_pairs, jf)
 
     # Upload the folder to the remote
-    remote_docking_folder = block.remote.sendData(
-        docking_folder, block.extraData["remote_folder"]
-    )
-
-    block.extraData["final_path_folder_to_analyse"] = remote_docking_folder
+    remote_docking_folder = uploadDockingFolder(block, docking_folder)
 
     # Replace the os.system call with a remote call
     # os.system(command)
@@ -462,8 +525,10 @@ def analyseDocking(
     output = block.remote.remoteCommand(command)
     print(output)
 
-    # Download the results
-    docking_folder = block.remote.getData(remote_docking_folder, os.getcwd())
+    # Download only the analysis results, the poses are already local
+    from docking_utils import downloadDockingAnalysis
+
+    downloadDockingAnalysis(block, remote_docking_folder, docking_folder)
 
     # Read the CSV file into pandas
     if not os.path.exists(docking_folder + "/.analysis/docking_data.csv"):
@@ -475,22 +540,11 @@ def analyseDocking(
     # Create multiindex dataframe
     models.docking_data.set_index(["Protein", "Ligand", "Pose"], inplace=True)
 
-    for f in os.listdir(docking_folder + "/.analysis/atom_pairs"):
-        model = f.split(separator)[0]
-        ligand = f.split(separator)[1].split(".")[0]
+    # One dataset partitioned by model and ligand instead of one CSV per pair
+    from docking_utils import convertDockingDistanceCSVs, loadDockingDistances
 
-        # # Read the CSV file into pandas
-        models.docking_distances.setdefault(model, {})
-        models.docking_distances[model][ligand] = pd.read_csv(
-            docking_folder + "/.analysis/atom_pairs/" + f
-        )
-        models.docking_distances[model][ligand].set_index(
-            ["Protein", "Ligand", "Pose"], inplace=True
-        )
-
-        models.docking_ligands.setdefault(model, [])
-        if ligand not in models.docking_ligands[model]:
-            models.docking_ligands[model].append(ligand)
+    convertDockingDistanceCSVs(docking_folder, separator=separator)
+    loadDockingDistances(models, docking_folder)
 
     if return_failed:
         with open(docking_folder + "/.analysis/._failed_dockings.json") as jifd:
@@ -498,6 +552,20 @@ def analyseDocking(
         return failed_dockings
 
 
+def uploadDockingFolder(block: PluginBlock, docking_folder):
+    """
+    Uploads the docking folder to the remote folder of the block and returns its
+    remote path.
+    """
+    remote_docking_folder = block.remote.sendData(
+        docking_folder, block.extraData["remote_folder"]
+    )
+
+    block.extraData["final_path_folder_to_analyse"] = remote_docking_folder
+
+    return remote_docking_folder
+
+
 def extractDockingPoses(
     block: PluginBlock,
     models,
@@ -508,6 +576,7 @@ def extractDockingPoses(
     only_extract_new=True,
     covalent_check=True,
     remove_previous=False,
+    processes=4,
 ):
     """
     Extract docking poses present in a docking_data dataframe. The docking DataFrame
@@ -529,10 +598,21 @@ def extractDockingPoses(
         Only extract models not present in the output_folder
     remove_previous : bool
         Remove all content in the output folder
+    processes : int
+        Number of extraction chunks run in parallel on the remote, and of local
+        processes checking the poses for covalent ligands
     """
 
     import os
     import shutil
+    import tarfile
+
+    import numpy as np
+    from docking_utils import (
+        checkCovalentLigands,
+        readExtractionIndex,
+        updateExtractionIndex,
+    )
 
     # Check the separator is not in model or ligand names
     for model in models.docking_ligands:
@@ -548,6 +628,9 @@ def extractDockingPoses(
                     % (separator, ligand)
                 )
 
+    # Absolute paths, the block does not change the working directory
+    output_folder = os.path.abspath(output_folder)
+
     # Remove output_folder
     if os.path.exists(output_folder):
         if remove_previous:
@@ -555,44 +638,46 @@ def extractDockingPoses(
 
     if not os.path.exists(output_folder):
         os.mkdir(output_folder)
-    else:
-        # Gather already extracted models
-        if only_extract_new:
-            extracted_models = set()
-            for model in os.listdir(output_folder):
-                if not os.path.isdir(output_folder + "/" + model):
-                    continue
-                for f in os.listdir(output_folder + "/" + model):
-                    if f.endswith(".pdb"):
-                        m, l = f.split(separator)[:2]
-                        extracted_models.add((m, l))
-
-            # Filter docking data to not include the already extracted models
-            extracted_indexes = []
-            for i in docking_data.index:
-                if i[:2] in extracted_models:
-                    extracted_indexes.append(i)
-            docking_data = docking_data[~docking_data.index.isin(extracted_indexes)]
-            if docking_data.empty:
-                print("All models were already extracted!")
-                print("Set only_extract_new=False to extract them again!")
-                return
-            else:
-                print(f"{len(extracted_models)} models were already extracted!")
-                print(f"Extracting {docking_data.shape[0]} new models")
-
-    # Copy analyse docking script (it depends on schrodinger so we leave it out.)
-    _copyScriptFile(output_folder, "extract_docking.py")
-    script_path = output_folder + "/._extract_docking.py"
+    elif only_extract_new:
+        # Gather already extracted models from the extraction index
+        extracted_models = {
+            (m, l) for m, l, _ in readExtractionIndex(output_folder, separator).values()
+        }
 
-    output_folder_abs = os.path.abspath(output_folder)
+        # Filter docking data to not include the already extracted models
+        extracted = [i[:2] in extracted_models for i in docking_data.index]
+        docking_data = docking_data[~np.array(extracted, dtype=bool)]
+        if docking_data.empty:
+            print("All models were already extracted!")
+            print("Set only_extract_new=False to extract them again!")
+            return
+        else:
+            print(f"{len(extracted_models)} models were already extracted!")
+            print(f"Extracting {docking_data.shape[0]} new models")
+
+    # Stage the extraction script and the docking data split in chunks. Only this
+    # folder is uploaded, the poses already extracted stay local.
+    staging_folder = os.path.join(output_folder, "._extraction")
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    os.mkdir(staging_folder)
 
-    # Move to output folder
-    os.chdir(output_folder)
+    # Copy analyse docking script (it depends on schrodinger so we leave it out.)
+    _copyScriptFile(staging_folder, "extract_docking.py")
 
-    # Save given docking data to csv
     dd = docking_data.reset_index()
-    dd.to_csv("._docking_data.csv", index=False)
+    n_chunks = max(1, min(processes, dd.shape[0]))
+    for i, chunk in enumerate(np.array_split(np.arange(dd.shape[0]), n_chunks)):
+        dd.iloc[chunk].to_csv(
+            os.path.join(staging_folder, f"._docking_data_{i}.csv"), index=False
+        )
+
+    # Pose files the extraction script writes, relative to the extraction folder
+    expected_files = [
+        f"{protein}/{protein}{separator}{ligand}{separator}{pose}.pdb"
+        for protein, ligand, pose in zip(dd["Protein"], dd["Ligand"], dd["Pose"])
+    ]
+    with open(os.path.join(staging_folder, "._expected_poses.txt"), "w") as f:
+        f.write("\n".join(expected_files) + "\n")
 
     # Upload the data to the remote
     remote_folder = block.extraData["remote_folder"]
@@ -601,45 +686,65 @@ def extractDockingPoses(
     block.remote.remoteCommand(f"mkdir -p {remote_folder}")
 
     # Upload the folder to the remote
-    final_path = block.remote.sendData(output_folder_abs, remote_folder)
+    final_path = block.remote.sendData(staging_folder, remote_folder)
 
-    print(f"Uploaded {output_folder} to {final_path}")
-    schrodinger = block.remote.remoteCommand("echo $SCHRODINGER")
+    print(f"Uploaded {n_chunks} extraction chunks to {final_path}")
+    schrodinger = block.remote.remoteCommand("echo $SCHRODINGER").strip()
+
+    # Create the model folders first so the parallel chunks do not race for them
+    model_folders = sorted({str(m) for m in dd["Protein"]})
+    block.remote.remoteCommand(f"cd {final_path} && mkdir -p " + " ".join(model_folders))
 
-    # Execute docking analysis
+    # Execute the docking extraction chunks in parallel, waiting on each of them so
+    # that a failed chunk makes the command fail
     command = (
-        f"cd {final_path} && "
-        + f"{schrodinger}/run ._extract_docking.py ._docking_data.csv "
-        + docking_folder
-        + " --separator "
-        + separator
+        f"cd {final_path} && pids='' && "
+        + "for data in ._docking_data_*.csv; do "
+        + f"{schrodinger}/run ._extract_docking.py $data {docking_folder} "
+        + f'--separator {separator} & pids="$pids $!"; done; '
+        + "status=0; for pid in $pids; do wait $pid || status=1; done; "
+        + "if [ $status -ne 0 ]; then echo 'An extraction chunk failed'; fi; exit $status"
     )
 
     # Execute the command
     output = block.remote.remoteCommand(command)
     print(output)
 
-    # Download the results
-    block.remote.getData(final_path, os.path.join(os.getcwd(), ".."))
+    # Check every pose was extracted before downloading them
+    missing = block.remote.remoteCommand(
+        f"cd {final_path} && while read -r pose; do "
+        + '[ -f "$pose" ] || echo "$pose"; done < ._expected_poses.txt'
+    )
+    missing = [line.strip() for line in str(missing or "").splitlines() if line.strip()]
+    if missing:
+        raise ValueError(
+            f"{len(missing)} of {len(expected_files)} poses were not extracted in "
+            f"{final_path}, e.g. {', '.join(missing[:5])}"
+        )
+
+    # Download only the extracted poses, packed in a single archive
+    remote_archive = final_path.rstrip("/") + "_poses.tar.gz"
+    block.remote.remoteCommand(
+        f"cd {final_path} && tar -czf {remote_archive} " + " ".join(model_folders)
+    )
+    archive = block.remote.getData(remote_archive, staging_folder)
 
     # Remove the remote folder
-    output = block.remote.remoteCommand(f"rm -rf {remote_folder}")
+    block.remote.remoteCommand(f"rm -rf {remote_folder}")
 
-    # Remove docking data
-    os.remove("._docking_data.csv")
+    try:
+        with tarfile.open(archive, "r:gz") as tar:
+            new_files = [m.name for m in tar.getmembers() if m.name.endswith(".pdb")]
+            tar.extractall(output_folder)
+    finally:
+        shutil.rmtree(staging_folder, ignore_errors=True)
 
-    # move back to folder
-    os.chdir("..")
+    updateExtractionIndex(output_folder, new_files, separator)
+    print(f"Extracted {len(new_files)} poses into {output_folder}")
 
     # Check models for covalent residues
-    for protein in os.listdir(output_folder):
-        if not os.path.isdir(output_folder + "/" + protein):
-            continue
-        for f in os.listdir(output_folder + "/" + protein):
-            if covalent_check:
-                models._checkCovalentLigands(
-                    protein, output_folder + "/" + protein + "/" + f, check_file=True
-                )
+    if covalent_check:
+        checkCovalentLigands(models, output_folder, processes=processes, separator=separator)
 
 
 def _copyScriptFile(output_folder, script_name, no_py=False, subfolder=None, hidden=True):
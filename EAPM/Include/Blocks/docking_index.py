@@ -0,0 +1,90 @@
+"""
+Module containing the Query docking index block for the EAPM plugin
+"""
+
+from HorusAPI import PluginBlock, PluginVariable, VariableTypes
+
+posesOutput = PluginVariable(
+    id="poses",
+    name="Poses",
+    description="CSV file with the best poses of the docking index",
+    type=VariableTypes.FILE,
+)
+
+ligandVariable = PluginVariable(
+    id="ligand",
+    name="Ligand",
+    description="Only return poses of this ligand",
+    type=VariableTypes.STRING,
+)
+
+modelVariable = PluginVariable(
+    id="model",
+    name="Model",
+    description="Only return poses of this model",
+    type=VariableTypes.STRING,
+)
+
+metricVariable = PluginVariable(
+    id="metric",
+    name="Metric",
+    description="Only return poses with this metric or distance column, e.g. metric_SG_S",
+    type=VariableTypes.STRING,
+)
+
+maxValueVariable = PluginVariable(
+    id="max_value",
+    name="Maximum metric value",
+    description="Only return poses whose metric is at most this value",
+    type=VariableTypes.FLOAT,
+)
+
+topKVariable = PluginVariable(
+    id="top_k",
+    name="Number of poses",
+    description="Number of best scored poses returned",
+    type=VariableTypes.INTEGER,
+    defaultValue=10,
+)
+
+
+def queryDockingIndexAction(block: PluginBlock):
+    """
+    Returns the best scored poses of every docking analysed before, across all
+    the docking folders.
+
+    Args:
+        block (PluginBlock): The PluginBlock object representing the Query docking index block.
+    """
+    # pylint: disable=import-outside-toplevel
+    from docking_utils import queryDockingIndex
+    from utils import storeTableResults
+
+    # pylint: enable=import-outside-toplevel
+
+    max_value = block.variables.get(maxValueVariable.id, None)
+
+    poses = queryDockingIndex(
+        ligand=block.variables.get(ligandVariable.id) or None,
+        model=block.variables.get(modelVariable.id) or None,
+        metric=block.variables.get(metricVariable.id) or None,
+        max_value=float(max_value) if max_value is not None else None,
+        top_k=int(block.variables.get(topKVariable.id, 10)),
+    )
+
+    print(f"Found {poses.shape[0]} poses in the docking index")
+
+    poses.to_csv("docking_index_poses.csv", index=False)
+    storeTableResults("docking_index_poses.csv", "Docking index poses")
+
+    block.setOutput(posesOutput.id, "docking_index_poses.csv")
+
+
+queryDockingIndexBlock = PluginBlock(
+    name="Query docking index",
+    id="query_docking_index",
+    description="Return the best docking poses of all the analysed docking campaigns",
+    action=queryDockingIndexAction,
+    variables=[ligandVariable, modelVariable, metricVariable, maxValueVariable, topKVariable],
+    outputs=[posesOutput],
+)
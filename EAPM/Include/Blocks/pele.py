@@ -459,6 +459,18 @@ boxCentersVariable = VariableList(
     prototypes=[modelVariable, ligandVariable, chainVariable, residueVariable, atomNameVariable],
 )
 
+# Remote variables
+downloadTrajectoriesVariable = PluginVariable(
+    id="download_trajectories",
+    name="Download trajectories",
+    description="Download the trajectories when the simulation finishes. If disabled, only the "
+    "reports, logs and configuration files are downloaded and the trajectories are kept on the "
+    "remote, to be fetched on demand by the Analyse PELE block.",
+    type=VariableTypes.BOOLEAN,
+    defaultValue=False,
+    category="Remote",
+)
+
 # Outputs
 peleOutputFolderOutput = PluginVariable(
     id="pele_output_folder",
@@ -726,11 +738,18 @@ def pele_action(block: SlurmBlock):
 def peleFinalAction(block: SlurmBlock):  #
     print("Pele finished")
 
+    from pele_utils import TRAJECTORY_PATTERNS, writeTrajectoryIndex
     from utils import downloadResultsAction
 
-    downloadResultsAction(block)
-
     peleFolderName = block.variables.get("pele_folder_name", "pele")
+    downloadTrajectories = block.variables.get("download_trajectories", False)
+
+    if downloadTrajectories:
+        downloadResultsAction(block)
+    else:
+        # Reports first, the trajectories stay on the remote until they are needed
+        downloadResultsAction(block, excludePatterns=TRAJECTORY_PATTERNS, keepRemoteFolder=True)
+        writeTrajectoryIndex(block, peleFolderName)
 
     block.setOutput("pele_output_folder", peleFolderName)
 
@@ -782,6 +801,7 @@ blockVariables = BSC_JOB_VARIABLES + [
     biasToPointVariable,
     comBias1Variable,
     comBias2Variable,
+    downloadTrajectoriesVariable,
 ]
 
 
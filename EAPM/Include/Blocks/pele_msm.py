@@ -0,0 +1,136 @@
+"""
+Module containing the PELE MSM block for the EAPM plugin
+"""
+
+from HorusAPI import PluginBlock, PluginVariable, VariableTypes
+
+peleOutputFolderInput = PluginVariable(
+    id="pele_folder",
+    name="Pele folder",
+    description="Folder containing PELE output",
+    type=VariableTypes.FOLDER,
+    defaultValue="pele",
+)
+
+msmOutputFolder = PluginVariable(
+    id="msm_folder",
+    name="MSM folder",
+    description="Folder with the Markov state models",
+    type=VariableTypes.FOLDER,
+)
+
+featuresVariable = PluginVariable(
+    id="features",
+    name="Features",
+    description="Features of each step. 'ligand_com' reads the ligand center of mass from the "
+    "trajectories, 'distances' uses the report columns matching the distances pattern.",
+    type=VariableTypes.STRING_LIST,
+    allowedValues=["ligand_com", "distances"],
+    defaultValue="ligand_com",
+)
+
+distancesPatternVariable = PluginVariable(
+    id="distances_pattern",
+    name="Distances pattern",
+    description="Regular expression selecting the report columns used as features",
+    type=VariableTypes.STRING,
+    defaultValue="^metric_",
+)
+
+ligandSelectionVariable = PluginVariable(
+    id="ligand_selection",
+    name="Ligand selection",
+    description="MDTraj selection of the ligand atoms used for the center of mass",
+    type=VariableTypes.STRING,
+    defaultValue="not protein and not water and not element H",
+)
+
+statesVariable = PluginVariable(
+    id="n_states",
+    name="Number of states",
+    description="Number of k-means states per protein and ligand",
+    type=VariableTypes.INTEGER,
+    defaultValue=50,
+)
+
+lagTimesVariable = PluginVariable(
+    id="lag_times",
+    name="Lag times",
+    description="Comma separated lag times, in accepted PELE steps",
+    type=VariableTypes.STRING,
+    defaultValue="1,2,5,10",
+)
+
+
+def peleMSM(block: PluginBlock):
+    """
+    Builds Markov state models from the steps of a PELE simulation.
+
+    Args:
+        block (PluginBlock): The PluginBlock object representing the PELE MSM block.
+    """
+    # pylint: disable=import-outside-toplevel
+    import re
+
+    from pele_utils import (
+        LIGAND_SELECTION,
+        buildMarkovStateModels,
+        featuriseLigandCOM,
+        fetchMissingTrajectories,
+        getReportCache,
+    )
+
+    # pylint: enable=import-outside-toplevel
+
+    pele_folder = block.inputs.get(peleOutputFolderInput.id, "pele")
+
+    report_cache = getReportCache(pele_folder)
+
+    if block.variables.get(featuresVariable.id, "ligand_com") == "ligand_com":
+        fetchMissingTrajectories(block, pele_folder)
+        features = featuriseLigandCOM(
+            report_cache,
+            ligand_selection=block.variables.get(ligandSelectionVariable.id) or LIGAND_SELECTION,
+        )
+    else:
+        pattern = re.compile(block.variables.get(distancesPatternVariable.id, "^metric_"))
+        features = [c for c in report_cache.columns if pattern.search(c)]
+        if len(features) == 0:
+            raise ValueError(f"No report columns match the pattern {pattern.pattern}")
+
+    lag_times = [
+        int(lag) for lag in str(block.variables.get(lagTimesVariable.id, "1")).split(",") if lag
+    ]
+
+    populations = buildMarkovStateModels(
+        report_cache,
+        features,
+        "pele_msm",
+        n_states=int(block.variables.get(statesVariable.id, 50)),
+        lag_times=lag_times,
+    )
+
+    if populations.empty:
+        print("No Markov state model could be built")
+    else:
+        n_models = populations.groupby(["Protein", "Ligand"]).ngroups
+        print(f"Built {n_models} Markov state models in pele_msm")
+
+    block.setOutput(msmOutputFolder.id, "pele_msm")
+
+
+peleMSMBlock = PluginBlock(
+    name="PELE MSM",
+    id="pele_msm",
+    description="Build Markov state models from PELE trajectories",
+    action=peleMSM,
+    inputs=[peleOutputFolderInput],
+    variables=[
+        featuresVariable,
+        distancesPatternVariable,
+        ligandSelectionVariable,
+        statesVariable,
+        lagTimesVariable,
+    ],
+    outputs=[msmOutputFolder],
+)
@@ -70,6 +70,7 @@ def glide_docking(block: SlurmBlock):
     import os
 
     import prepare_proteins
+    from structure_utils import ResidueIndex
     from utils import launchCalculationAction
 
     # pylint: enable=import-outside-toplevel
@@ -121,20 +122,15 @@ def glide_docking(block: SlurmBlock):
         # Get the common residues
         common_residues = block.inputs.get("multimodel_common_residue", {})
 
-        # Parse the atom center for each model
+        # Parse the atom center for each model from the residue index
+        residue_index = ResidueIndex(models_folder, models)
         center_atoms = {}  # Create dictionary to store the atom 3-element tuple for each model
         for model in models:  # Iterate the models inside the library
-            for r in models.structures[
-                model
-            ].get_residues():  # Iterate the residues for each Bio.PDB.Structure object
-                if (
-                    r.id[1] == common_residues[model][0]
-                ):  # Check that the residue matches the defined index
-                    center_atoms[model] = (
-                        r.get_parent().id,
-                        r.id[1],
-                        RESIDUE_DICTIONARY[r.resname],
-                    )  # Store the corresponding tuple.
+            residues = residue_index.findResidues(model, [common_residues[model][0]])
+            if residues:
+                # The last matching residue of the structure, as when walking it
+                chain, number, name = residues[-1]
+                center_atoms[model] = (chain, number, RESIDUE_DICTIONARY[name])
     else:
         # Create a fake center_atoms variable for the library
         center_atoms = {}
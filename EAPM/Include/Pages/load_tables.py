@@ -1,7 +1,10 @@
+import collections
+import json
 import urllib.parse
 import flask
 import urllib
 import os
+import threading
 import HorusAPI
 
 load_page = HorusAPI.PluginPage(
@@ -12,20 +15,240 @@ load_page = HorusAPI.PluginPage(
     hidden=True,
 )
 
+# Rows of a table page returned when the request does not set a limit
+DEFAULT_PAGE_SIZE = 200
+
+MAX_PAGE_SIZE = 5000
+
+# Tables and sorted or filtered views kept in memory between page requests
+_TABLE_CACHE_SIZE = 8
+
+_table_cache = collections.OrderedDict()
+
+# Page requests are served from several threads
+_table_cache_lock = threading.Lock()
+
+_FILTER_OPERATORS = {
+    "==": lambda column, value: column == value,
+    "!=": lambda column, value: column != value,
+    "<": lambda column, value: column < value,
+    "<=": lambda column, value: column <= value,
+    ">": lambda column, value: column > value,
+    ">=": lambda column, value: column >= value,
+    "contains": lambda column, value: column.astype(str).str.contains(
+        str(value), case=False, regex=False
+    ),
+}
+
+
+# Responses of at least this size are compressed when the browser accepts gzip
+_GZIP_MIN_SIZE = 1024
+
+_GZIP_CHUNK_SIZE = 1 << 16
+
+# Types that are already compressed, they are sent as they are
+_COMPRESSED_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/pdf",
+)
+
+
+def _fileETag(stat: os.stat_result) -> str:
+    """
+    Returns a fingerprint of a file from its modification time and size, so it
+    does not need to be read.
+    """
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def _gzipStream(path: str):
+    """
+    Yields the content of a file compressed with gzip, one chunk at a time.
+    """
+    import zlib
+
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_GZIP_CHUNK_SIZE), b""):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
 
 def load_html():
 
     path = flask.request.args.get("path")
+    if path is None:
+        return flask.jsonify({"error": "Path does not exist"}), 404
 
     # The path was safely encoded in the uri
     path = urllib.parse.unquote(path)
 
-    if path is None or not os.path.exists(path):
-        return flask.jsonify({"error": "Path does not exist"}, 404)
+    if not os.path.exists(path):
+        return flask.jsonify({"error": "Path does not exist"}), 404
+
+    import mimetypes
+
+    stat = os.stat(path)
+    etag = _fileETag(stat)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    accepts_gzip = "gzip" in flask.request.headers.get("Accept-Encoding", "")
+    compressible = stat.st_size >= _GZIP_MIN_SIZE and not mimetype.startswith(_COMPRESSED_TYPES)
+
+    # Range requests are answered from the file itself, as partial content of a
+    # compressed stream cannot be served
+    if not accepts_gzip or not compressible or "Range" in flask.request.headers:
+        response = flask.send_file(path, mimetype=mimetype, conditional=True, etag=etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    # The gzip variant has its own tag, so caches do not mix it with the plain file
+    etag = etag + "-gz"
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+        response.set_etag(etag)
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    # Pre-compressed siblings are used while they are newer than the file
+    gz_path = path + ".gz"
+    if os.path.exists(gz_path) and os.stat(gz_path).st_mtime_ns >= stat.st_mtime_ns:
+        response = flask.send_file(gz_path, mimetype=mimetype, conditional=False, etag=False)
+    else:
+        response = flask.Response(_gzipStream(path), mimetype=mimetype)
+
+    response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(etag)
+    return response
+
+
+def _cached(key, function):
+    """
+    Returns the cached value of a key, computing it with function if missing.
+    The value is computed outside the lock, so other tables are served meanwhile.
+    """
+    with _table_cache_lock:
+        if key in _table_cache:
+            _table_cache.move_to_end(key)
+            return _table_cache[key]
+
+    value = function()
+    with _table_cache_lock:
+        _table_cache[key] = value
+        _table_cache.move_to_end(key)
+        while len(_table_cache) > _TABLE_CACHE_SIZE:
+            _table_cache.popitem(last=False)
+
+    return value
+
+
+def _readTable(path: str):
+    """
+    Reads a Parquet file or dataset, or a CSV file, into a DataFrame.
+    """
+    import pandas as pd
+
+    if path.endswith(".csv"):
+        return pd.read_csv(path)
+
+    return pd.read_parquet(path)
+
+
+def _filterTable(table, filters: list):
+    """
+    Applies a list of {"column", "op", "value"} filters to a table.
+    """
+    import pandas as pd
+
+    mask = pd.Series(True, index=table.index)
+    for table_filter in filters:
+        column = table[table_filter["column"]]
+        value = table_filter.get("value")
+        if table_filter.get("op", "contains") != "contains" and pd.api.types.is_numeric_dtype(
+            column
+        ):
+            value = float(value)
+        mask &= _FILTER_OPERATORS[table_filter.get("op", "contains")](column, value)
+
+    return table[mask.to_numpy()]
+
+
+def load_table_page():
+    """
+    Returns a page of a stored table as JSON. The table is sorted and filtered on
+    the server, so only the requested rows are sent to the page.
+
+    Query arguments:
+        path: Parquet or CSV file with the table.
+        offset, limit: First row and number of rows of the page.
+        sort: Column to sort by, and ascending ("true" or "false").
+        filters: JSON list of {"column", "op", "value"}, with op one of ==, !=, <,
+            <=, >, >= or contains.
+    """
+    path = flask.request.args.get("path")
+    if path is None:
+        return flask.jsonify({"error": "Path does not exist"}), 404
+
+    path = urllib.parse.unquote(path)
+    if not os.path.exists(path):
+        return flask.jsonify({"error": "Path does not exist"}), 404
+
+    try:
+        offset = max(0, int(flask.request.args.get("offset", 0)))
+        limit = int(flask.request.args.get("limit", DEFAULT_PAGE_SIZE))
+        limit = min(MAX_PAGE_SIZE, max(1, limit))
+        sort = flask.request.args.get("sort") or None
+        ascending = flask.request.args.get("ascending", "true") == "true"
+        filters = json.loads(flask.request.args.get("filters") or "[]")
+    except ValueError as error:
+        return flask.jsonify({"error": str(error)}), 400
 
-    return flask.send_file(path)
+    # Files are identified by their modification, so a rewritten table is read again
+    stat = os.stat(path)
+    table_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    table = _cached(table_key, lambda: _readTable(path))
+
+    try:
+        view_key = table_key + (sort, ascending, json.dumps(filters, sort_keys=True))
+        view = _cached(
+            view_key,
+            lambda: (
+                _filterTable(table, filters).sort_values(sort, ascending=ascending, kind="stable")
+                if sort
+                else _filterTable(table, filters)
+            ),
+        )
+    except (KeyError, TypeError, ValueError) as error:
+        return flask.jsonify({"error": f"Invalid sort or filter: {error}"}), 400
+
+    page = view.iloc[offset : offset + limit]
+
+    return flask.Response(
+        json.dumps(
+            {
+                "columns": [str(c) for c in view.columns],
+                "total": int(view.shape[0]),
+                "offset": offset,
+                # Missing values are sent as null
+                "rows": json.loads(page.to_json(orient="values")),
+            }
+        ),
+        mimetype="application/json",
+    )
 
 
 load_page.addEndpoint(
     HorusAPI.PluginEndpoint(url="/load_table", methods=["GET"], function=load_html)
 )
+
+load_page.addEndpoint(
+    HorusAPI.PluginEndpoint(url="/table", methods=["GET"], function=load_table_page)
+)
@@ -0,0 +1,1172 @@
+"""
+Helper functions shared by the docking blocks of the EAPM plugin
+"""
+
+import gzip
+import json
+import os
+import re
+import typing
+
+if typing.TYPE_CHECKING:
+    from HorusAPI import PluginBlock
+
+# Tokens of a Maestro file: quoted strings, #comments# and plain values
+_MAE_TOKEN_REGEX = re.compile(r'"(?:[^"\\]|\\.)*"|#[^#\n]*#|\S+')
+
+_MAE_TABLE_REGEX = re.compile(r"^(\w+)\[(\d+)\]$")
+
+# Glide pose viewer files, receptor first and then the ligand poses
+DOCKING_POSE_SUFFIXES = ["_pv.maegz", "_pv.mae"]
+
+# Results of the docking analysis script, relative to the docking folder
+DOCKING_ANALYSIS_FILES = [
+    ".analysis/docking_data.csv",
+    ".analysis/atom_pairs",
+    ".analysis/._failed_dockings.json",
+]
+
+# Properties of the ligand poses with the docking score, by priority
+_SCORE_PROPERTIES = ["r_i_docking_score", "r_i_glide_gscore"]
+
+# Columns of docking_data.csv, as written by the prepare_proteins analysis script,
+# and the pose properties they are read from
+DOCKING_DATA_PROPERTIES = {
+    "Score": _SCORE_PROPERTIES,
+    "RMSD": ["r_i_glide_rmsd_to_input"],
+}
+
+
+def readMAEFile(path: str) -> typing.List[dict]:
+    """
+    Reads the structures (f_m_ct blocks) of a Maestro file, gzipped or not,
+    without the Schrödinger API.
+
+    Returns:
+        list: One dict per structure, with its "properties" (dict) and "atoms", a
+        dict of NumPy arrays with the coordinates ("x", "y", "z"), "chain",
+        "residue", "residue_name" and "name" of every atom.
+    """
+    opener = gzip.open if path.endswith("gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        tokens = [t for t in _MAE_TOKEN_REGEX.findall(f.read()) if not t.startswith("#")]
+
+    structures = []
+    position = 0
+    while position < len(tokens):
+        if tokens[position] == "{":
+            # Version block
+            _, _, position = _parseMAEBlock(tokens, position + 1)
+            continue
+        name = tokens[position]
+        if tokens[position + 1] != "{":
+            raise ValueError(f"Invalid Maestro file {path}: unexpected token {name}")
+        properties, tables, position = _parseMAEBlock(tokens, position + 2)
+        if name == "f_m_ct":
+            structures.append({"properties": properties, "atoms": _getMAEAtoms(tables)})
+
+    return structures
+
+
+def _parseMAEBlock(tokens: typing.List[str], position: int):
+    # Block after its opening brace: keys, ":::", one value per key, sub-blocks, "}"
+    keys = []
+    while tokens[position] != ":::":
+        keys.append(tokens[position])
+        position += 1
+    position += 1
+
+    properties = {
+        key: _parseMAEValue(value)
+        for key, value in zip(keys, tokens[position : position + len(keys)])
+    }
+    position += len(keys)
+
+    tables = {}
+    while tokens[position] != "}":
+        name = tokens[position]
+        position += 2
+        match = _MAE_TABLE_REGEX.match(name)
+        if match is None:
+            _, _, position = _parseMAEBlock(tokens, position)
+            continue
+
+        # Indexed table: keys, ":::", rows (index + one value per key), ":::", "}"
+        columns = []
+        while tokens[position] != ":::":
+            columns.append(tokens[position])
+            position += 1
+        position += 1
+        n_values = int(match.group(2)) * (len(columns) + 1)
+        tables[match.group(1)] = (columns, tokens[position : position + n_values])
+        position += n_values + 2
+
+    return properties, tables, position + 1
+
+
+def _parseMAEValue(value: str):
+    if value.startswith('"'):
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    if value == "<>":
+        return None
+    try:
+        return float(value) if "." in value or "e" in value.lower() else int(value)
+    except ValueError:
+        return value
+
+
+def _getMAEAtoms(tables: dict) -> dict:
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    if "m_atom" not in tables:
+        return {}
+
+    columns, values = tables["m_atom"]
+    rows = np.array(values, dtype=object).reshape(-1, len(columns) + 1)[:, 1:]
+    table = dict(zip(columns, rows.T))
+
+    def text(key):
+        if key not in table:
+            return np.full(len(rows), "", dtype=object)
+        return np.array([_parseMAEValue(v) or "" for v in table[key]], dtype=object)
+
+    atoms = {
+        "x": table["r_m_x_coord"].astype(float),
+        "y": table["r_m_y_coord"].astype(float),
+        "z": table["r_m_z_coord"].astype(float),
+        "chain": np.char.strip(text("s_m_chain_name").astype(str)),
+        "residue": (
+            np.array([_parseMAEValue(v) or 0 for v in table["i_m_residue_number"]])
+            if "i_m_residue_number" in table
+            else np.zeros(len(rows), dtype=int)
+        ),
+        "residue_name": np.char.strip(text("s_m_pdb_residue_name").astype(str)),
+        "name": np.char.strip(text("s_m_pdb_atom_name").astype(str)),
+        # Zero when the file does not give the elements
+        "atomic_number": (
+            table["i_m_atomic_number"].astype(int)
+            if "i_m_atomic_number" in table
+            else np.zeros(len(rows), dtype=int)
+        ),
+    }
+    return atoms
+
+
+def getDockingPoseFiles(docking_folder: str, separator: str = "-") -> typing.Dict[tuple, str]:
+    """
+    Returns the Glide pose viewer file of every model and ligand of a docking
+    folder, keyed by (model, ligand).
+    """
+    files = {}
+    output_models = os.path.join(docking_folder, "output_models")
+    for model in sorted(os.listdir(output_models)):
+        model_folder = os.path.join(output_models, model)
+        if not os.path.isdir(model_folder):
+            continue
+        for file in sorted(os.listdir(model_folder)):
+            suffix = next((s for s in DOCKING_POSE_SUFFIXES if file.endswith(s)), None)
+            if suffix is None:
+                continue
+            name = file[: -len(suffix)]
+            if name.startswith(model + separator):
+                ligand = name[len(model + separator) :]
+            else:
+                ligand = name.split(separator)[-1]
+            files[(model, ligand)] = os.path.join(model_folder, file)
+    return files
+
+
+def calculateDockingDistances(
+    pose_file: str, atom_pairs: typing.List[tuple], model: str, ligand: str
+):
+    """
+    Computes the distances of the given atom pairs for every pose of a Glide pose
+    viewer file, with a single array operation over the poses and the pairs.
+
+    Args:
+        pose_file (str): The _pv.maegz file, receptor first and then the poses.
+        atom_pairs (list): Pairs as ((chain, residue, atom name), ligand atom name).
+        model (str): Name of the model.
+        ligand (str): Name of the ligand.
+
+    Returns:
+        tuple: The docking data (see getDockingData) and the distances, as
+        DataFrames indexed by Protein, Ligand and Pose, or None if there are no poses.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    structures = readMAEFile(pose_file)
+    if len(structures) < 2:
+        return None
+
+    receptor, poses = structures[0]["atoms"], structures[1:]
+
+    # Glide keeps the receptor rigid, so the protein atoms are read once
+    protein_coordinates = []
+    ligand_indexes = []
+    labels = []
+    ligand_names = poses[0]["atoms"]["name"]
+    for (chain, residue, atom), ligand_atom in atom_pairs:
+        mask = (receptor["residue"] == int(residue)) & (receptor["name"] == atom)
+        if chain is not None and str(chain).strip():
+            mask &= receptor["chain"] == str(chain).strip()
+        if not mask.any():
+            raise ValueError(f"Atom {chain}:{residue}:{atom} not found in model {model}")
+        index = int(np.flatnonzero(mask)[0])
+        protein_coordinates.append(
+            [receptor["x"][index], receptor["y"][index], receptor["z"][index]]
+        )
+
+        matches = np.flatnonzero(ligand_names == ligand_atom)
+        if len(matches) == 0:
+            raise ValueError(f"Atom {ligand_atom} not found in ligand {ligand}")
+        ligand_indexes.append(int(matches[0]))
+        labels.append(f"distance_{str(chain or '').strip()}{residue}{atom}_{ligand_atom}")
+
+    # Poses x ligand atoms x 3, every pose of a ligand has the same atoms
+    coordinates = np.stack(
+        [np.stack([p["atoms"]["x"], p["atoms"]["y"], p["atoms"]["z"]], axis=1) for p in poses]
+    )
+    differences = coordinates[:, ligand_indexes, :] - np.array(protein_coordinates)[None]
+    distances = np.linalg.norm(differences, axis=2)
+
+    docking_data = getDockingData(poses, model, ligand)
+    docking_distances = pd.DataFrame(distances, index=docking_data.index, columns=labels)
+    return docking_data, docking_distances
+
+
+def getDockingData(poses: typing.List[dict], model: str, ligand: str):
+    """
+    Returns the docking data of the poses of a model and ligand, with the
+    DOCKING_DATA_PROPERTIES columns written by the prepare_proteins analysis
+    script, indexed by Protein, Ligand and Pose (from 1).
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    index = pd.MultiIndex.from_tuples(
+        [(model, ligand, pose) for pose in range(1, len(poses) + 1)],
+        names=["Protein", "Ligand", "Pose"],
+    )
+
+    data = {}
+    for column, properties in DOCKING_DATA_PROPERTIES.items():
+        values = []
+        for pose in poses:
+            value = next(
+                (pose["properties"][p] for p in properties if p in pose["properties"]), None
+            )
+            values.append(np.nan if value is None else float(value))
+        data[column] = values
+
+    return pd.DataFrame(data, index=index)
+
+
+def _isHydrogen(atoms: dict):
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    if atoms["atomic_number"].any():
+        return atoms["atomic_number"] == 1
+    return np.char.startswith(np.char.lstrip(atoms["name"].astype(str), "0123456789"), "H")
+
+
+def calculateClosestDistances(
+    pose_file: str,
+    protein_atoms: typing.List[tuple],
+    model: str,
+    ligand: str,
+    ignore_hydrogens: bool = False,
+    batch_size: int = 1000,
+):
+    """
+    Computes the closest ligand atom to each of the given protein atoms for every
+    pose of a Glide pose viewer file. The distances between the ligand atoms and
+    the few protein atoms are computed in batches of poses with a single cdist call.
+
+    Args:
+        pose_file (str): The _pv.maegz file, receptor first and then the poses.
+        protein_atoms (list): Protein atoms as (chain, residue, atom name).
+        model (str): Name of the model.
+        ligand (str): Name of the ligand.
+        ignore_hydrogens (bool): Only consider the ligand heavy atoms.
+        batch_size (int): Number of poses queried at once.
+
+    Returns:
+        tuple: The docking data (see getDockingData), with the closest ligand atom
+        to each protein atom as closest_<chain><residue><atom> columns, and the
+        closest distances, as DataFrames indexed by Protein, Ligand and Pose, or
+        None if there are no poses.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+    from scipy.spatial.distance import cdist
+
+    # pylint: enable=import-outside-toplevel
+
+    structures = readMAEFile(pose_file)
+    if len(structures) < 2:
+        return None
+
+    receptor, poses = structures[0]["atoms"], structures[1:]
+
+    # Glide keeps the receptor rigid, so the protein atoms are read once
+    protein_coordinates = []
+    labels = []
+    for chain, residue, atom in protein_atoms:
+        mask = (receptor["residue"] == int(residue)) & (receptor["name"] == atom)
+        if chain is not None and str(chain).strip():
+            mask &= receptor["chain"] == str(chain).strip()
+        if not mask.any():
+            raise ValueError(f"Atom {chain}:{residue}:{atom} not found in model {model}")
+        index = int(np.flatnonzero(mask)[0])
+        protein_coordinates.append(
+            [receptor["x"][index], receptor["y"][index], receptor["z"][index]]
+        )
+        labels.append(f"{str(chain or '').strip()}{residue}{atom}")
+    protein_coordinates = np.array(protein_coordinates)
+
+    ligand_atoms = poses[0]["atoms"]
+    ligand_mask = np.ones(len(ligand_atoms["name"]), dtype=bool)
+    if ignore_hydrogens:
+        ligand_mask = ~_isHydrogen(ligand_atoms)
+    ligand_names = ligand_atoms["name"][ligand_mask]
+
+    # Poses x ligand atoms x 3, every pose of a ligand has the same atoms
+    coordinates = np.stack(
+        [np.stack([p["atoms"]["x"], p["atoms"]["y"], p["atoms"]["z"]], axis=1) for p in poses]
+    )[:, ligand_mask, :]
+    n_poses, n_atoms, _ = coordinates.shape
+    n_protein = len(labels)
+
+    closest = np.empty((n_poses, n_protein))
+    closest_atom = np.empty((n_poses, n_protein), dtype=int)
+    for start in range(0, n_poses, batch_size):
+        batch = coordinates[start : start + batch_size]
+        # Ligand atoms of the batch x protein atoms, then the closest atom of each pose
+        matrix = cdist(batch.reshape(-1, 3), protein_coordinates)
+        matrix = matrix.reshape(batch.shape[0], n_atoms, n_protein)
+        closest[start : start + batch_size] = matrix.min(axis=1)
+        closest_atom[start : start + batch_size] = matrix.argmin(axis=1)
+
+    docking_data = getDockingData(poses, model, ligand)
+    for i, label in enumerate(labels):
+        docking_data[f"closest_{label}"] = ligand_names[closest_atom[:, i]]
+    docking_distances = pd.DataFrame(
+        closest, index=docking_data.index, columns=[f"distance_{label}" for label in labels]
+    )
+    return docking_data, docking_distances
+
+
+def analyseDockingLocally(
+    models,
+    docking_folder: str,
+    atom_pairs: typing.Optional[dict] = None,
+    separator: str = "-",
+    only_models: typing.Optional[typing.List[str]] = None,
+    skip_chains: bool = False,
+    protein_atoms: typing.Optional[dict] = None,
+    ignore_hydrogens: bool = False,
+) -> typing.List[tuple]:
+    """
+    Computes the atom pair distances of a Glide docking with NumPy, or the closest
+    ligand atom to each protein atom (see calculateClosestDistances) when
+    protein_atoms are given instead, reading the pose viewer files directly. The
+    results are loaded into the models (docking_data, docking_distances and
+    docking_ligands) and written to the .analysis folder of the docking folder:
+    docking_data.csv and the failed dockings, as the Schrödinger analysis script
+    does, and the distances dataset (see writeDockingDistances) instead of one CSV
+    per model and ligand.
+
+    Args:
+        models (prepare_proteins.proteinModels): The models of the docking.
+        docking_folder (str): Folder with the docking results.
+        atom_pairs (dict, optional): Pairs per model and ligand, as
+            {model: {ligand: [((chain, residue, atom name), ligand atom name), ...]}}.
+        separator (str): Separator between the model and ligand names.
+        only_models (list, optional): Only analyse these models.
+        skip_chains (bool): Match the protein atoms by residue and name only.
+        protein_atoms (dict, optional): Protein atoms per model, as
+            {model: [(chain, residue, atom name), ...]}. Used if atom_pairs is not given.
+        ignore_hydrogens (bool): Ignore the ligand hydrogens for the closest distances.
+
+    Returns:
+        list: The failed dockings, as (model, ligand) tuples.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    analysis_folder = os.path.join(docking_folder, ".analysis")
+    os.makedirs(analysis_folder, exist_ok=True)
+
+    docking_data = []
+    docking_distances = []
+    failed = []
+    for (model, ligand), pose_file in getDockingPoseFiles(docking_folder, separator).items():
+        if only_models is not None and model not in only_models:
+            continue
+        if atom_pairs is not None:
+            pairs = atom_pairs.get(model, {}).get(ligand)
+            if pairs is None:
+                continue
+            if skip_chains:
+                pairs = [
+                    ((None, residue, atom), ligand_atom)
+                    for (_, residue, atom), ligand_atom in pairs
+                ]
+            result = calculateDockingDistances(pose_file, pairs, model, ligand)
+        else:
+            atoms = protein_atoms.get(model)
+            if atoms is None:
+                continue
+            if skip_chains:
+                atoms = [(None, residue, atom) for _, residue, atom in atoms]
+            result = calculateClosestDistances(
+                pose_file, atoms, model, ligand, ignore_hydrogens=ignore_hydrogens
+            )
+
+        if result is None:
+            failed.append((model, ligand))
+            continue
+
+        data, distances = result
+        docking_data.append(data)
+        docking_distances.append(distances)
+
+        models.docking_distances.setdefault(model, {})
+        models.docking_distances[model][ligand] = distances
+        models.docking_ligands.setdefault(model, [])
+        if ligand not in models.docking_ligands[model]:
+            models.docking_ligands[model].append(ligand)
+
+    if len(docking_data) == 0:
+        raise ValueError(f"No docking poses found in {docking_folder}")
+
+    models.docking_data = pd.concat(docking_data)
+    models.docking_data.to_csv(os.path.join(analysis_folder, "docking_data.csv"))
+    writeDockingDistances(docking_folder, docking_distances)
+
+    with open(
+        os.path.join(analysis_folder, "._failed_dockings.json"), "w", encoding="utf-8"
+    ) as f:
+        json.dump(failed, f)
+
+    return failed
+
+
+def downloadDockingAnalysis(
+    block: "PluginBlock", remote_docking_folder: str, docking_folder: str
+):
+    """
+    Downloads only the results of a remote docking analysis (DOCKING_ANALYSIS_FILES)
+    into the local docking folder, packed in a single archive. The pose files are
+    already local, so they are not transferred back.
+
+    Args:
+        block (PluginBlock): Block whose remote ran the analysis.
+        remote_docking_folder (str): Docking folder on the remote.
+        docking_folder (str): Local docking folder.
+    """
+    # pylint: disable=import-outside-toplevel
+    import shutil
+    import tarfile
+
+    # pylint: enable=import-outside-toplevel
+
+    remote_archive = remote_docking_folder.rstrip("/") + "_analysis.tar.gz"
+    block.remote.remoteCommand(
+        f"cd {remote_docking_folder} && tar -czf {remote_archive} --ignore-failed-read "
+        + " ".join(DOCKING_ANALYSIS_FILES)
+    )
+    archive = block.remote.getData(remote_archive, os.getcwd())
+    block.remote.remoteCommand(f"rm -f {remote_archive}")
+
+    # The remote analysis replaces the distances of previous runs
+    shutil.rmtree(os.path.join(docking_folder, ".analysis", "atom_pairs"), ignore_errors=True)
+
+    try:
+        with tarfile.open(archive, "r:gz") as tar:
+            tar.extractall(docking_folder)
+    finally:
+        os.remove(archive)
+
+
+# Distances of every pose, as a Parquet dataset partitioned by model and ligand
+DOCKING_DISTANCES_DATASET = os.path.join(".analysis", "distances")
+
+
+def writeDockingDistances(docking_folder: str, distances: typing.List):
+    """
+    Writes docking distances into the distances dataset of the docking folder.
+    The distances are stored in long form (Protein, Ligand, Pose, Distance and
+    Value) and partitioned by Protein and Ligand, so readers only load the
+    partitions they filter for. Partitions of the given models and ligands are
+    replaced, the others are kept.
+
+    Args:
+        docking_folder (str): Folder with the docking results.
+        distances (list): DataFrames of distances indexed by Protein, Ligand and Pose,
+            with one column per distance.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # pylint: enable=import-outside-toplevel
+
+    distances = [d for d in distances if not d.empty]
+    if len(distances) == 0:
+        return
+
+    long_distances = []
+    for pair_distances in distances:
+        pair_long = pair_distances.rename_axis(columns="Distance").stack().rename("Value")
+        long_distances.append(pair_long.reset_index())
+    long_distances = pd.concat(long_distances, ignore_index=True)
+    long_distances["Pose"] = long_distances["Pose"].astype("int32")
+
+    pq.write_to_dataset(
+        pa.Table.from_pandas(long_distances, preserve_index=False),
+        os.path.join(docking_folder, DOCKING_DISTANCES_DATASET),
+        partition_cols=["Protein", "Ligand"],
+        existing_data_behavior="delete_matching",
+    )
+
+
+def readDockingDistances(
+    docking_folder: str,
+    models: typing.Optional[typing.List[str]] = None,
+    ligands: typing.Optional[typing.List[str]] = None,
+    long_form: bool = False,
+):
+    """
+    Reads the distances dataset of a docking folder, only loading the partitions
+    of the given models and ligands.
+
+    Args:
+        docking_folder (str): Folder with the docking results.
+        models (list, optional): Models to read, all of them by default.
+        ligands (list, optional): Ligands to read, all of them by default.
+        long_form (bool): Return the Protein, Ligand, Pose, Distance and Value
+            table instead of one column per distance.
+
+    Returns:
+        pandas.DataFrame: The distances, indexed by Protein, Ligand and Pose unless
+        long_form is set.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # pylint: enable=import-outside-toplevel
+
+    path = os.path.join(docking_folder, DOCKING_DISTANCES_DATASET)
+    columns = ["Protein", "Ligand", "Pose", "Distance", "Value"]
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=columns) if long_form else pd.DataFrame()
+
+    partitioning = ds.partitioning(
+        pa.schema([("Protein", pa.string()), ("Ligand", pa.string())]), flavor="hive"
+    )
+    dataset = ds.dataset(path, format="parquet", partitioning=partitioning)
+
+    condition = None
+    for field, values in (("Protein", models), ("Ligand", ligands)):
+        if values is not None:
+            expression = ds.field(field).isin([str(v) for v in values])
+            condition = expression if condition is None else condition & expression
+
+    table = dataset.to_table(columns=columns, filter=condition).to_pandas()
+    if long_form:
+        return table
+
+    # Columns keep the order in which the distances were written
+    order = pd.unique(table["Distance"])
+    wide = table.pivot_table(
+        index=["Protein", "Ligand", "Pose"], columns="Distance", values="Value", aggfunc="first"
+    )
+    return wide[[c for c in order if c in wide.columns]].rename_axis(columns=None)
+
+
+def loadDockingDistances(models, docking_folder: str):
+    """
+    Fills models.docking_distances and models.docking_ligands from the distances
+    dataset, reading it once for all the models of the library.
+    """
+    distances = readDockingDistances(docking_folder, models=list(models.models_names))
+    if distances.empty:
+        return
+
+    for (model, ligand), pair_distances in distances.groupby(level=["Protein", "Ligand"]):
+        models.docking_distances.setdefault(model, {})
+        models.docking_distances[model][ligand] = pair_distances.dropna(axis=1, how="all")
+        models.docking_ligands.setdefault(model, [])
+        if ligand not in models.docking_ligands[model]:
+            models.docking_ligands[model].append(ligand)
+
+
+def convertDockingDistanceCSVs(docking_folder: str, separator: str = "-") -> int:
+    """
+    Moves the per model and ligand CSVs written by the Schrödinger analysis
+    script (.analysis/atom_pairs) into the distances dataset.
+
+    Returns:
+        int: Number of CSV files converted.
+    """
+    # pylint: disable=import-outside-toplevel
+    import shutil
+
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    csv_folder = os.path.join(docking_folder, ".analysis", "atom_pairs")
+    if not os.path.isdir(csv_folder):
+        return 0
+
+    distances = []
+    for file in sorted(os.listdir(csv_folder)):
+        if not file.endswith(".csv"):
+            continue
+        model = file.split(separator)[0]
+        ligand = file.split(separator)[1].split(".")[0]
+        pair_distances = pd.read_csv(os.path.join(csv_folder, file))
+        pair_distances["Protein"] = model
+        pair_distances["Ligand"] = ligand
+        distances.append(pair_distances.set_index(["Protein", "Ligand", "Pose"]))
+
+    writeDockingDistances(docking_folder, distances)
+    shutil.rmtree(csv_folder)
+
+    return len(distances)
+
+
+def combineDockingMetrics(distances, metric_labels):
+    """
+    Combines docking distances into metrics, taking for every pose the minimum
+    distance of each metric group, with grouped reductions over the long-form
+    distance table.
+
+    Args:
+        distances (pandas.DataFrame): Long-form distances (Protein, Ligand, Pose,
+            Distance and Value), see readDockingDistances.
+        metric_labels (list or dict): Metric names, in which case every distance of
+            a model and ligand belongs to every metric, or the distances of each
+            metric as {metric: {model: {ligand: [distance labels]}}}.
+
+    Returns:
+        pandas.DataFrame: One "metric_" + name column per metric, indexed by
+        Protein, Ligand and Pose.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    index = ["Protein", "Ligand", "Pose"]
+
+    if not isinstance(metric_labels, dict):
+        minimum = distances.groupby(index, sort=False)["Value"].min()
+        return pd.DataFrame({f"metric_{name}": minimum for name in metric_labels})
+
+    labels = pd.DataFrame(
+        [
+            (f"metric_{name}", model, ligand, label)
+            for name, model_labels in metric_labels.items()
+            for model, ligand_labels in model_labels.items()
+            for ligand, pair_labels in ligand_labels.items()
+            for label in pair_labels
+        ],
+        columns=["Metric", "Protein", "Ligand", "Distance"],
+    )
+    labeled = distances.merge(labels, on=["Protein", "Ligand", "Distance"])
+    metrics = labeled.groupby(index + ["Metric"], sort=False)["Value"].min().unstack("Metric")
+    return metrics.reindex(columns=[f"metric_{name}" for name in metric_labels])
+
+
+def selectBestDockingPoses(
+    docking_data,
+    metrics: typing.List[str],
+    min_threshold: float = 3.5,
+    max_threshold: float = 5.0,
+    step_size: float = 0.1,
+):
+    """
+    Selects the best pose of every model and ligand, as the iterative selection
+    of prepare_proteins does: the metric threshold is raised from min_threshold
+    to max_threshold in step_size increments and each model and ligand takes the
+    best scoring pose with all its metrics under the first threshold reached by
+    any of its poses.
+
+    Here the threshold level of every pose is found at once with a sorted search,
+    and the selection is two grouped reductions.
+
+    Args:
+        docking_data (pandas.DataFrame): Docking data with the Score and metric
+            columns, indexed by Protein, Ligand and Pose.
+        metrics (list): Metric columns the thresholds apply to.
+        min_threshold (float): First threshold.
+        max_threshold (float): Last threshold.
+        step_size (float): Threshold increment.
+
+    Returns:
+        pandas.DataFrame: The rows of docking_data of the selected poses.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    thresholds = np.arange(min_threshold, max_threshold + (step_size / 10), step_size)
+
+    # A pose passes a threshold when all its metrics are under it, NaN never passes
+    worst = docking_data[metrics].to_numpy(dtype=float).max(axis=1)
+    levels = np.searchsorted(thresholds, worst, side="left")
+    levels[np.isnan(worst)] = len(thresholds)
+
+    candidates = docking_data.assign(_level=levels)
+    candidates = candidates[candidates["_level"] < len(thresholds)]
+    if candidates.empty:
+        return docking_data.iloc[0:0]
+
+    first_level = candidates.groupby(level=["Protein", "Ligand"], sort=False)["_level"].transform(
+        "min"
+    )
+    candidates = candidates[candidates["_level"] == first_level]
+    best = (
+        candidates.sort_values("Score", kind="stable")
+        .groupby(level=["Protein", "Ligand"], sort=False)
+        .head(1)
+    )
+
+    return docking_data[docking_data.index.isin(best.index)]
+
+
+# Manifest of the poses extracted into an output folder
+EXTRACTION_INDEX_FILE = ".extraction_index.json"
+
+
+def readExtractionIndex(output_folder: str, separator: str = "-") -> dict:
+    """
+    Returns the extraction index of a poses folder, as {relative path: [model,
+    ligand, pose]}. Folders extracted before the index existed are scanned once
+    and the index is written.
+
+    Args:
+        output_folder (str): Folder with the extracted poses.
+        separator (str): Separator of the model, ligand and pose in the file names.
+
+    Returns:
+        dict: The extraction index.
+    """
+    index_path = os.path.join(output_folder, EXTRACTION_INDEX_FILE)
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)["poses"]
+
+    files = []
+    if os.path.isdir(output_folder):
+        for model in os.listdir(output_folder):
+            if not os.path.isdir(os.path.join(output_folder, model)):
+                continue
+            for file in os.listdir(os.path.join(output_folder, model)):
+                if file.endswith(".pdb"):
+                    files.append(os.path.join(model, file))
+
+    return updateExtractionIndex(output_folder, files, separator)
+
+
+def updateExtractionIndex(
+    output_folder: str, files: typing.List[str], separator: str = "-"
+) -> dict:
+    """
+    Adds extracted pose files (paths relative to the output folder, named
+    model<separator>ligand<separator>pose.pdb) to the extraction index.
+
+    Args:
+        output_folder (str): Folder with the extracted poses.
+        files (list): New pose files, relative to the output folder.
+        separator (str): Separator of the model, ligand and pose in the file names.
+
+    Returns:
+        dict: The updated index.
+    """
+    index_path = os.path.join(output_folder, EXTRACTION_INDEX_FILE)
+    poses = {}
+    if os.path.exists(index_path):
+        with open(index_path, "r", encoding="utf-8") as f:
+            poses = json.load(f)["poses"]
+
+    for file in files:
+        fields = os.path.basename(file)[: -len(".pdb")].split(separator)
+        if len(fields) < 2:
+            continue
+        pose = int(fields[2]) if len(fields) > 2 and fields[2].isdigit() else None
+        poses[file] = [fields[0], fields[1], pose]
+
+    os.makedirs(output_folder, exist_ok=True)
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump({"separator": separator, "poses": poses}, f)
+
+    return poses
+
+
+# Covalent residues found in each pose file, keyed by model, ligand and file hash
+COVALENT_CACHE_FILE = ".covalent_cache.json"
+
+# Models of a covalent check worker process, set by its pool initializer
+_WORKER_MODELS = None
+
+
+def _hashFile(path: str) -> str:
+    # pylint: disable=import-outside-toplevel
+    import hashlib
+
+    # pylint: enable=import-outside-toplevel
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checkCovalentFile(models, protein: str, path: str) -> list:
+    models._checkCovalentLigands(protein, path, check_file=True)
+    return list(models.covalent[protein])
+
+
+def _initCovalentWorker(models):
+    global _WORKER_MODELS  # pylint: disable=global-statement
+    _WORKER_MODELS = models
+
+
+def _checkCovalentWorker(protein: str, path: str) -> list:
+    return _checkCovalentFile(_WORKER_MODELS, protein, path)
+
+
+def checkCovalentLigands(models, output_folder: str, processes: int = 4, separator: str = "-"):
+    """
+    Checks the extracted poses for covalent ligands, as models._checkCovalentLigands
+    does for a single file. The checks run on a process pool, which receives the
+    models through its initializer, and their results are cached in the output
+    folder by model, ligand and file hash, so files already checked are not parsed
+    again. Files are only hashed again when their size or modification time
+    changed. As with the serial checks, the last file of each protein sets its
+    covalent residues.
+
+    Args:
+        models (proteinModels): Models whose covalent residues are updated.
+        output_folder (str): Folder with the extracted poses, one subfolder per model.
+        processes (int): Number of worker processes.
+        separator (str): Separator of the model, ligand and pose in the file names.
+    """
+    # pylint: disable=import-outside-toplevel
+    from concurrent.futures import ProcessPoolExecutor
+
+    # pylint: enable=import-outside-toplevel
+
+    cache_path = os.path.join(output_folder, COVALENT_CACHE_FILE)
+    cache = {"files": {}, "results": {}}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if "results" not in cache:
+            # Cache of an older version, keyed by hash only
+            cache = {"files": {}, "results": {}}
+
+    extracted = readExtractionIndex(output_folder, separator)
+    files = []
+    for file in sorted(extracted):
+        path = os.path.join(output_folder, file)
+        if not os.path.exists(path):
+            continue
+        protein = os.path.dirname(file)
+        _, ligand, _ = extracted[file]
+
+        # The hash of an unchanged file is taken from the cache
+        stat = os.stat(path)
+        cached = cache["files"].get(file)
+        if cached is not None and cached[:2] == [stat.st_mtime_ns, stat.st_size]:
+            digest = cached[2]
+        else:
+            digest = _hashFile(path)
+            cache["files"][file] = [stat.st_mtime_ns, stat.st_size, digest]
+
+        files.append((protein, path, "|".join([protein, ligand, digest])))
+
+    pending = [
+        (protein, path, key) for protein, path, key in files if key not in cache["results"]
+    ]
+    print(f"Checking {len(pending)} poses for covalent ligands ({len(files)} in total)")
+
+    if processes > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=_initCovalentWorker, initargs=(models,)
+        ) as executor:
+            results = executor.map(
+                _checkCovalentWorker, [p for p, _, _ in pending], [f for _, f, _ in pending]
+            )
+            for (_, _, key), covalent in zip(pending, results):
+                cache["results"][key] = covalent
+    else:
+        for protein, path, key in pending:
+            cache["results"][key] = _checkCovalentFile(models, protein, path)
+
+    for protein, _, key in files:
+        models.covalent[protein] = list(cache["results"][key])
+
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+
+
+# Index of every analysed docking pose, shared by all the docking campaigns
+DOCKING_INDEX_PATH = os.environ.get(
+    "EAPM_DOCKING_INDEX", os.path.join(os.path.expanduser("~"), ".eapm", "docking_index.sqlite")
+)
+
+_DOCKING_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    docking_folder TEXT UNIQUE NOT NULL,
+    label TEXT,
+    analysed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS poses (
+    run_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    ligand TEXT NOT NULL,
+    pose INTEGER NOT NULL,
+    score REAL,
+    file_path TEXT,
+    PRIMARY KEY (run_id, model, ligand, pose)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    ligand TEXT NOT NULL,
+    pose INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS poses_ligand_score ON poses (ligand, score);
+CREATE INDEX IF NOT EXISTS poses_score ON poses (score);
+CREATE INDEX IF NOT EXISTS metrics_model_metric ON metrics (model, metric, value);
+CREATE INDEX IF NOT EXISTS metrics_pose ON metrics (run_id, model, ligand, pose);
+"""
+
+# Seconds a writer waits for another analysis writing to the index
+_DOCKING_INDEX_TIMEOUT = 60.0
+
+
+def _connectDockingIndex(index_path: typing.Optional[str] = None):
+    # pylint: disable=import-outside-toplevel
+    import sqlite3
+
+    # pylint: enable=import-outside-toplevel
+
+    index_path = index_path or DOCKING_INDEX_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+
+    # Several analyses may write to the index at once: readers do not block the
+    # writer in WAL mode, and a writer waits for the lock instead of failing
+    connection = sqlite3.connect(index_path, timeout=_DOCKING_INDEX_TIMEOUT)
+    connection.execute(f"PRAGMA busy_timeout = {int(_DOCKING_INDEX_TIMEOUT * 1000)}")
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.executescript(_DOCKING_INDEX_SCHEMA)
+    return connection
+
+
+def _getExtractedPoseFiles(poses_folder: str, separator: str = "-") -> dict:
+    # Extracted pose files keyed by (model, ligand, pose), named as in the extraction index
+    files = {}
+    if not os.path.isdir(poses_folder):
+        return files
+    for model in os.listdir(poses_folder):
+        model_folder = os.path.join(poses_folder, model)
+        if not os.path.isdir(model_folder):
+            continue
+        for file in os.listdir(model_folder):
+            if not file.endswith(".pdb"):
+                continue
+            fields = file[: -len(".pdb")].split(separator)
+            if len(fields) > 2 and fields[2].isdigit():
+                files[(fields[0], fields[1], int(fields[2]))] = os.path.abspath(
+                    os.path.join(model_folder, file)
+                )
+    return files
+
+
+def indexDockingResults(
+    docking_data,
+    docking_folder: str,
+    separator: str = "-",
+    poses_folder: typing.Optional[str] = None,
+    label: typing.Optional[str] = None,
+    index_path: typing.Optional[str] = None,
+) -> int:
+    """
+    Adds the analysed poses of a docking folder to the docking index. Each docking
+    folder is a run of the index: analysing it again replaces its poses, while the
+    runs of other folders are kept. The file of a pose is the extracted PDB of the
+    pose, for the poses found in the poses folder.
+
+    Args:
+        docking_data (pandas.DataFrame): Docking data indexed by Protein, Ligand and
+            Pose, with the Score and the distance and metric columns.
+        docking_folder (str): Folder with the docking results.
+        separator (str): Separator of the model, ligand and pose in the pose file names.
+        poses_folder (str, optional): Folder with the extracted poses.
+        label (str, optional): Name of the run, by default the docking folder name.
+        index_path (str, optional): SQLite file of the index, DOCKING_INDEX_PATH by default.
+
+    Returns:
+        int: The run id of the docking folder.
+    """
+    # pylint: disable=import-outside-toplevel
+    import time
+
+    # pylint: enable=import-outside-toplevel
+
+    docking_folder = os.path.abspath(docking_folder)
+    pose_files = {}
+    if poses_folder is not None:
+        pose_files = _getExtractedPoseFiles(poses_folder, separator)
+
+    data = docking_data.reset_index()
+    metric_columns = [
+        c for c in data.columns if str(c).startswith(("metric_", "distance_", "closest_"))
+    ]
+    metric_columns = [c for c in metric_columns if data[c].dtype.kind in "fiu"]
+
+    keys = list(
+        zip(
+            data["Protein"].astype(str),
+            data["Ligand"].astype(str),
+            data["Pose"].astype(int).tolist(),
+        )
+    )
+    scores = data["Score"].astype(float).tolist() if "Score" in data else [None] * len(keys)
+
+    connection = _connectDockingIndex(index_path)
+    try:
+        with connection:
+            connection.execute(
+                "INSERT INTO runs (docking_folder, label, analysed) VALUES (?, ?, ?) "
+                "ON CONFLICT (docking_folder) DO UPDATE SET label = excluded.label, "
+                "analysed = excluded.analysed",
+                (docking_folder, label or os.path.basename(docking_folder), time.time()),
+            )
+            run_id = connection.execute(
+                "SELECT run_id FROM runs WHERE docking_folder = ?", (docking_folder,)
+            ).fetchone()[0]
+
+            connection.execute("DELETE FROM poses WHERE run_id = ?", (run_id,))
+            connection.execute("DELETE FROM metrics WHERE run_id = ?", (run_id,))
+
+            connection.executemany(
+                "INSERT INTO poses VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (run_id, model, ligand, pose, score, pose_files.get((model, ligand, pose)))
+                    for (model, ligand, pose), score in zip(keys, scores)
+                ),
+            )
+            for column in metric_columns:
+                connection.executemany(
+                    "INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        (run_id, model, ligand, pose, str(column), value)
+                        for (model, ligand, pose), value in zip(
+                            keys, data[column].astype(float).tolist()
+                        )
+                        if value == value
+                    ),
+                )
+    finally:
+        connection.close()
+
+    return run_id
+
+
+def queryDockingIndex(
+    ligand: typing.Optional[str] = None,
+    model: typing.Optional[str] = None,
+    metric: typing.Optional[str] = None,
+    max_value: typing.Optional[float] = None,
+    top_k: int = 10,
+    index_path: typing.Optional[str] = None,
+):
+    """
+    Returns the best scored poses of the docking index, across all the runs.
+
+    Args:
+        ligand (str, optional): Only poses of this ligand.
+        model (str, optional): Only poses of this model.
+        metric (str, optional): Only poses with this metric, whose value is added
+            to the result.
+        max_value (float, optional): Only poses whose metric is at most this value.
+        top_k (int): Number of poses returned.
+        index_path (str, optional): SQLite file of the index, DOCKING_INDEX_PATH by default.
+
+    Returns:
+        pandas.DataFrame: The poses sorted by score, with their run and pose file.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    columns = (
+        "runs.label AS Run, poses.model AS Protein, poses.ligand AS Ligand, "
+        "poses.pose AS Pose, poses.score AS Score"
+    )
+    joins = "JOIN runs ON runs.run_id = poses.run_id"
+    conditions, parameters = [], []
+
+    if metric is not None:
+        columns += ", metrics.value AS Metric"
+        joins += (
+            " JOIN metrics ON metrics.run_id = poses.run_id AND metrics.model = poses.model"
+            " AND metrics.ligand = poses.ligand AND metrics.pose = poses.pose"
+        )
+        conditions.append("metrics.metric = ?")
+        parameters.append(metric)
+        if max_value is not None:
+            conditions.append("metrics.value <= ?")
+            parameters.append(float(max_value))
+    if ligand is not None:
+        conditions.append("poses.ligand = ?")
+        parameters.append(ligand)
+    if model is not None:
+        conditions.append("poses.model = ?")
+        parameters.append(model)
+
+    query = f"SELECT {columns}, poses.file_path AS File, runs.docking_folder AS Folder "
+    query += f"FROM poses {joins}"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY poses.score LIMIT ?"
+    parameters.append(int(top_k))
+
+    connection = _connectDockingIndex(index_path)
+    try:
+        return pd.read_sql_query(query, connection, params=parameters)
+    finally:
+        connection.close()
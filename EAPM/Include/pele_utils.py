@@ -0,0 +1,2342 @@
+"""
+Helper functions shared by the PELE blocks of the EAPM plugin
+"""
+
+import json
+import os
+import re
+import typing
+
+# The module also runs on the remote (see analysePELEFolder), where HorusAPI is not installed
+if typing.TYPE_CHECKING:
+    from HorusAPI import PluginBlock, SlurmBlock
+
+# Files left on the remote when only the reports are downloaded
+TRAJECTORY_PATTERNS = ["*trajectory_*.pdb", "*trajectory_*.xtc"]
+
+# Index of the trajectories left on the remote, stored inside the PELE folder
+TRAJECTORY_INDEX_FILE = ".trajectory_index.json"
+
+_TRAJECTORY_REGEX = re.compile(r"^trajectory_(\d+)\.(pdb|xtc)$")
+
+# Columnar cache of the data read by pele_analysis, stored inside the PELE folder
+REPORT_CACHE_FOLDER = ".report_cache"
+
+# Index of the pele_analysis data
+INDEX_COLUMNS = ["Protein", "Ligand", "Epoch", "Trajectory", "Accepted Pele Steps"]
+
+_REPORT_REGEX = re.compile(r"^report_(\d+)$")
+
+# Report headers renamed to the names used by pele_analysis
+_REPORT_COLUMN_NAMES = {
+    "numberOfAcceptedPeleSteps": "Accepted Pele Steps",
+    "currentEnergy": "Total Energy",
+    "sasaLig": "Ligand SASA",
+}
+
+
+def writeTrajectoryIndex(block: "SlurmBlock", pele_folder: str):
+    """
+    Lists the trajectory files that were left on the remote and stores their
+    location inside the local PELE folder, so they can be fetched on demand.
+
+    Args:
+        block (SlurmBlock): The PELE block that ran the calculation.
+        pele_folder (str): Name of the PELE folder.
+    """
+    # pylint: disable=import-outside-toplevel
+    from utils import getRemoteResultsFolder
+
+    # pylint: enable=import-outside-toplevel
+
+    if block.remote.name == "Local":
+        return None
+
+    remote_pele_folder = os.path.join(getRemoteResultsFolder(block), pele_folder)
+
+    name_filters = " -o ".join(f"-name '{pattern}'" for pattern in TRAJECTORY_PATTERNS)
+    output = block.remote.remoteCommand(
+        f"cd {remote_pele_folder} && find . -type f \\( {name_filters} \\) -printf '%P\\t%s\\n'"
+    )
+
+    trajectories = {}
+    for line in str(output or "").splitlines():
+        if "\t" not in line:
+            continue
+        path, size = line.rsplit("\t", 1)
+        trajectories[path] = int(size)
+
+    index = {
+        "remote": block.remote.name,
+        "host": block.remote.host,
+        "remote_folder": remote_pele_folder,
+        "trajectories": trajectories,
+    }
+
+    index_path = os.path.join(pele_folder, TRAJECTORY_INDEX_FILE)
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    total_size = sum(trajectories.values()) / 1024**3
+    print(
+        f"{len(trajectories)} trajectories ({total_size:.2f} GB) left on the remote, "
+        f"indexed in {index_path}"
+    )
+
+    return index
+
+
+def readTrajectoryIndex(pele_folder: str) -> typing.Optional[dict]:
+    """
+    Returns the remote trajectory index of a PELE folder or None if all the
+    trajectories were downloaded.
+    """
+    index_path = os.path.join(pele_folder, TRAJECTORY_INDEX_FILE)
+
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def getTrajectoryPaths(
+    pele_folder: str,
+    poses: typing.Iterable[typing.Tuple[str, str, int, int]],
+    separator: str = "-",
+) -> typing.List[str]:
+    """
+    Maps (protein, ligand, epoch, trajectory) tuples to the relative path of their
+    trajectory file inside the PELE folder.
+
+    Both the remote index and the local files are considered, so the paths are
+    valid whether the trajectories were downloaded or not.
+    """
+    lookup = getTrajectoryLookup(pele_folder)
+
+    paths = []
+    for protein, ligand, epoch, trajectory in poses:
+        key = (f"{protein}{separator}{ligand}", int(epoch), int(trajectory))
+        if key not in lookup:
+            raise ValueError(
+                f"No trajectory found for {protein} {ligand} epoch {epoch} "
+                f"trajectory {trajectory} in {pele_folder}"
+            )
+        if lookup[key] not in paths:
+            paths.append(lookup[key])
+
+    return paths
+
+
+def getTrajectoryLookup(pele_folder: str) -> dict:
+    """
+    Returns the relative path of every trajectory of the PELE folder, local or
+    indexed on the remote, keyed by (protein-ligand folder, epoch, trajectory).
+    """
+    available = set()
+    index = readTrajectoryIndex(pele_folder)
+    if index is not None:
+        available.update(index["trajectories"])
+
+    for root, _, files in os.walk(pele_folder):
+        for file in files:
+            if _TRAJECTORY_REGEX.match(file):
+                available.add(os.path.relpath(os.path.join(root, file), pele_folder))
+
+    lookup = {}
+    for path in available:
+        parts = path.split(os.sep)
+        match = _TRAJECTORY_REGEX.match(parts[-1])
+        if match is None or len(parts) < 3 or not parts[-2].isdigit():
+            continue
+        lookup[(parts[0], int(parts[-2]), int(match.group(1)))] = path
+
+    return lookup
+
+
+def fetchTrajectories(
+    block: "PluginBlock", pele_folder: str, trajectories: typing.List[str]
+) -> typing.List[str]:
+    """
+    Downloads the given trajectories (relative to the PELE folder) that are only
+    available on the remote. The files are packed into a single archive on the
+    remote to avoid one transfer per file.
+
+    Args:
+        block (PluginBlock): Block whose remote holds the PELE data.
+        pele_folder (str): Local PELE folder.
+        trajectories (list): Relative paths of the trajectories to fetch.
+
+    Returns:
+        list: Local paths of the requested trajectories.
+    """
+    # pylint: disable=import-outside-toplevel
+    import shutil
+    import tarfile
+    import time
+
+    # pylint: enable=import-outside-toplevel
+
+    local_paths = [os.path.join(pele_folder, path) for path in trajectories]
+    missing = [
+        path for path, local in zip(trajectories, local_paths) if not os.path.exists(local)
+    ]
+
+    if len(missing) == 0:
+        return local_paths
+
+    index = readTrajectoryIndex(pele_folder)
+    if index is None:
+        raise ValueError(f"Trajectories not found in {pele_folder}: {missing}")
+
+    if block.remote.host != index["host"]:
+        raise ValueError(
+            f"The trajectories are stored on {index['remote']} ({index['host']}). "
+            f"Select that remote to fetch them."
+        )
+
+    for path in missing:
+        if path not in index["trajectories"]:
+            raise ValueError(f"Trajectory {path} is not in the remote index")
+
+    print(f"Fetching {len(missing)} trajectories from {index['remote']}...")
+
+    remote_folder = index["remote_folder"]
+    tag = f"._fetch_{time.time()}"
+    download_folder = os.path.join(os.getcwd(), tag)
+    os.makedirs(download_folder)
+
+    try:
+        list_file = os.path.join(download_folder, "trajectories.txt")
+        with open(list_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(missing) + "\n")
+
+        remote_list = block.remote.sendData(list_file, remote_folder)
+        remote_archive = os.path.join(remote_folder, tag + ".tar")
+
+        # Trajectories are already compressed (xtc) or are not worth the CPU time
+        block.remote.remoteCommand(
+            f"cd {remote_folder} && tar -cf {remote_archive} -T {remote_list} "
+            f"&& rm -f {remote_list}"
+        )
+        archive = block.remote.getData(remote_archive, download_folder)
+        block.remote.remoteCommand(f"rm -f {remote_archive}")
+
+        with tarfile.open(archive, "r") as tar:
+            tar.extractall(pele_folder)
+    finally:
+        shutil.rmtree(download_folder, ignore_errors=True)
+
+    return local_paths
+
+
+class PELEReportCache:
+    """
+    Columnar on-disk cache of the data read by pele_analysis from the reports of
+    a PELE folder.
+
+    pele_analysis parses the reports and combines the metrics, and its data frame
+    is then stored here column by column, as raw binary files with their dtype
+    recorded in the metadata. The columns are memory-mapped when read, so the
+    later steps (plots, summaries, clustering, MSM) only touch the columns they
+    ask for. Proteins and ligands are stored as integer codes. The size and
+    modification time of every report are recorded with the data, together with
+    the distance rules of the metrics, so the analysis can reuse the cache instead
+    of reading the PELE folder again while it still matches.
+
+    Each report also keeps the byte offset of its last stored line and its number
+    of rows. When reports only grew or were added (e.g. new epochs of a running or
+    extended campaign), update parses the appended lines alone and adds them to
+    the columns, so pele_analysis does not need to read the folder again.
+    """
+
+    def __init__(self, pele_folder: str, separator: str = "-", cache_folder: str = None):
+        self.pele_folder = pele_folder
+        self.separator = separator
+        self.cache_folder = cache_folder or os.path.join(pele_folder, REPORT_CACHE_FOLDER)
+        self.metadata = self._readMetadata()
+        self._pair_rows = None
+
+    def __len__(self):
+        return self.metadata["n_rows"]
+
+    @property
+    def columns(self) -> typing.List[str]:
+        return list(self.metadata["columns"])
+
+    @property
+    def proteins(self) -> typing.List[str]:
+        return list(self.metadata["proteins"])
+
+    @property
+    def ligands(self) -> typing.List[str]:
+        return list(self.metadata["ligands"])
+
+    def isUpToDate(
+        self, rules: typing.Optional[typing.List[dict]] = None, energy_by_residue: bool = False
+    ) -> bool:
+        """
+        Returns whether the cache holds data and no report of the PELE folder was
+        added, removed or modified since it was stored.
+
+        Args:
+            rules (list, optional): Distance rules the metrics must have been
+                combined with. Not checked if None.
+            energy_by_residue (bool): Require the energy by residue columns.
+        """
+        if len(self.metadata["columns"]) == 0:
+            return False
+        if rules is not None and self.metadata["rules"] != json.loads(json.dumps(rules)):
+            return False
+        if energy_by_residue and not self.metadata["energy_by_residue"]:
+            return False
+        cached = {
+            path: {"size": report["size"], "mtime": report["mtime"]}
+            for path, report in self.metadata["reports"].items()
+        }
+        return cached == self.listReports()
+
+    def update(
+        self,
+        rules: typing.Optional[typing.List[dict]] = None,
+        energy_by_residue: bool = False,
+        processes: typing.Optional[int] = None,
+        verbose: bool = True,
+    ) -> typing.Optional[int]:
+        """
+        Brings the cache up to date with the reports of the PELE folder. Each report
+        is read from the byte offset where the stored data stops, so only the lines
+        appended since then are parsed, with the column names of pele_analysis.
+        The reports of each protein and ligand are parsed by a pool of processes.
+        The metrics of the new rows are combined with the rules of the cache.
+
+        The cache cannot be updated, and the folder has to be read again with
+        pele_analysis (see storePELEAnalysis), when it is empty, when it was stored
+        with other rules or without the requested energy by residue columns, or
+        when a report was removed or rewritten.
+
+        Args:
+            rules (list, optional): Distance rules the metrics must have been
+                combined with. Not checked if None.
+            energy_by_residue (bool): Require the energy by residue columns.
+            processes (int, optional): Number of processes parsing the reports.
+                All the available CPUs by default.
+            verbose (bool): Print the progress.
+
+        Returns:
+            int: Number of rows added, or None if the cache cannot be updated.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        if len(self.metadata["columns"]) == 0:
+            return None
+        if rules is not None and self.metadata["rules"] != json.loads(json.dumps(rules)):
+            return None
+        if energy_by_residue and not self.metadata["energy_by_residue"]:
+            return None
+
+        reports = self.listReports()
+        cached = self.metadata["reports"]
+
+        # Reports that disappeared or shrank were rewritten
+        if any(
+            path not in reports or reports[path]["size"] < cached[path]["offset"]
+            for path in cached
+        ):
+            if verbose:
+                print("Reports were removed or rewritten, the report cache cannot be updated")
+            return None
+
+        pending = [
+            path
+            for path in sorted(reports)
+            if path not in cached
+            or cached[path]["size"] != reports[path]["size"]
+            or cached[path]["mtime"] != reports[path]["mtime"]
+        ]
+        if len(pending) == 0:
+            if verbose:
+                print(f"The report cache is up to date ({len(self)} steps)")
+            return 0
+
+        if verbose:
+            print(f"Parsing the lines appended to {len(pending)} of {len(reports)} reports...")
+
+        pairs = {}
+        for path in pending:
+            report = dict(cached.get(path, {"offset": 0, "rows": 0, "header": None}))
+            report.update(reports[path])
+            pairs.setdefault(path.split(os.sep)[0], []).append((path, report))
+
+        parsed = []
+        for results in self._readPairs(pairs, processes):
+            for path, report, header, rows in results:
+                if report["header"] is not None and header != report["header"]:
+                    if verbose:
+                        print(f"Report {path} was rewritten, the report cache cannot be updated")
+                    return None
+                report["header"] = header
+                parsed.append((path, report, rows))
+
+        catalytic_labels = self._getCatalyticLabels()
+        start = len(self)
+        for path, report, rows in parsed:
+            pair = path.split(os.sep)[0]
+            names = pair.split(self.separator)
+            if rows is not None and len(names) == 2:
+                report["rows"] += self._appendRows(self._addPairColumns(pair, names, rows))
+            cached[path] = report
+
+        # Metrics of the new rows, and of every row of the pairs with new distances
+        if catalytic_labels is not None:
+            updated_labels = self._getCatalyticLabels()
+            rows = [np.arange(start, len(self))]
+            for (protein, ligand), pair_rows in self.getPairRows().items():
+                if any(
+                    labels[protein][ligand]
+                    != catalytic_labels[metric].get(protein, {}).get(ligand, [])
+                    for metric, labels in updated_labels.items()
+                ):
+                    rows.append(pair_rows)
+            self._combineMetrics(updated_labels, np.unique(np.concatenate(rows)))
+
+        self._writeMetadata()
+
+        if verbose:
+            print(f"Added {len(self) - start} steps to the report cache ({len(self)} steps)")
+
+        return len(self) - start
+
+    def store(
+        self,
+        data,
+        reports: typing.Optional[dict] = None,
+        rules: typing.Optional[typing.List[dict]] = None,
+        energy_by_residue: bool = False,
+    ) -> int:
+        """
+        Replaces the cached data with a pele_analysis data frame, indexed by
+        protein, ligand, epoch, trajectory and accepted PELE step. Columns that
+        are not numeric are not stored.
+
+        Args:
+            data (pandas.DataFrame): The data of a pele_analysis.peleAnalysis.
+            reports (dict, optional): The reports the data was read from, as
+                returned by listReports before reading them. Listed now by default.
+            rules (list, optional): Distance rules the metrics were combined with.
+            energy_by_residue (bool): Whether the data holds the energy by residue
+                columns.
+
+        Returns:
+            int: Number of rows stored.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+        import pandas as pd
+
+        # pylint: enable=import-outside-toplevel
+
+        missing = [name for name in INDEX_COLUMNS if name not in data.index.names]
+        if missing:
+            raise ValueError(f"The PELE data is not indexed by {', '.join(missing)}")
+
+        if reports is None:
+            reports = self.listReports()
+        self.clear()
+        os.makedirs(self.cache_folder, exist_ok=True)
+
+        index = data.index
+        columns = {}
+        for name in ("Protein", "Ligand"):
+            values = pd.Categorical(index.get_level_values(name).astype(str))
+            self.metadata[name.lower() + "s"] = list(values.categories)
+            columns[name] = values.codes.astype(np.int32)
+        for name in INDEX_COLUMNS[2:]:
+            columns[name] = index.get_level_values(name).to_numpy(dtype=np.int32)
+
+        for name in data.columns:
+            if pd.api.types.is_numeric_dtype(data[name]):
+                columns[str(name)] = data[name].to_numpy(dtype=np.float64)
+
+        for name, values in columns.items():
+            info = {"file": f"{len(self.metadata['columns']):04d}.bin", "dtype": values.dtype.str}
+            values.tofile(os.path.join(self.cache_folder, info["file"]))
+            self.metadata["columns"][name] = info
+
+        # Columns holding data of each protein and ligand, as pele.getDistances does
+        self.metadata["n_rows"] = len(data)
+        for (protein, ligand), rows in self.getPairRows().items():
+            self.metadata["pair_columns"][f"{protein}{self.separator}{ligand}"] = [
+                name
+                for name in columns
+                if name not in INDEX_COLUMNS and np.isfinite(columns[name][rows]).any()
+            ]
+
+        # Rows and last complete line of every report, later updates start there
+        counts = data.groupby(level=INDEX_COLUMNS[:4], observed=True).size()
+        counts = {
+            (str(protein), str(ligand), int(epoch), int(trajectory)): int(n_rows)
+            for (protein, ligand, epoch, trajectory), n_rows in counts.items()
+        }
+        for path, report in reports.items():
+            names = path.split(os.sep)[0].split(self.separator)
+            key = (*names, *_getReportKey(path))
+            report_path = os.path.join(self.pele_folder, path)
+            report["rows"] = counts.get(key, 0)
+            report["offset"] = _getLineEnd(report_path, report["size"])
+            report["header"] = _readReportHeader(report_path) if report["offset"] else None
+
+        self.metadata["reports"] = reports
+        self.metadata["rules"] = json.loads(json.dumps(rules)) if rules is not None else None
+        self.metadata["energy_by_residue"] = bool(energy_by_residue)
+        self._writeMetadata()
+
+        return len(data)
+
+    def clear(self):
+        """
+        Removes all the cached data.
+        """
+        # pylint: disable=import-outside-toplevel
+        import shutil
+
+        # pylint: enable=import-outside-toplevel
+
+        if os.path.exists(self.cache_folder):
+            shutil.rmtree(self.cache_folder)
+
+        self.metadata = self._emptyMetadata()
+        self._pair_rows = None
+
+    def getColumn(self, column: str):
+        """
+        Returns the memory-mapped values of a cached column.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        if column not in self.metadata["columns"]:
+            raise ValueError(f"Column {column} not found in the report cache")
+
+        info = self.metadata["columns"][column]
+        if len(self) == 0:
+            return np.empty(0, dtype=info["dtype"])
+
+        return np.memmap(
+            os.path.join(self.cache_folder, info["file"]),
+            dtype=info["dtype"],
+            mode="r",
+            shape=(len(self),),
+        )
+
+    def getData(
+        self,
+        columns: typing.Optional[typing.List[str]] = None,
+        protein: typing.Optional[str] = None,
+        ligand: typing.Optional[str] = None,
+        rows=None,
+    ):
+        """
+        Returns a dataframe indexed like pele_analysis data, reading only the given
+        columns (all of them by default) and, optionally, a single protein or ligand
+        or the given row indexes.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+        import pandas as pd
+
+        # pylint: enable=import-outside-toplevel
+
+        if columns is None:
+            columns = [c for c in self.columns if c not in INDEX_COLUMNS]
+
+        mask = None
+        for name, value, values in (
+            ("Protein", protein, self.metadata["proteins"]),
+            ("Ligand", ligand, self.metadata["ligands"]),
+        ):
+            if value is None:
+                continue
+            code = values.index(value) if value in values else -1
+            selected = self.getColumn(name) == code
+            mask = selected if mask is None else mask & selected
+        # Rows are read by index, so only the pages holding them are loaded
+        if rows is not None:
+            rows = np.sort(np.asarray(rows, dtype=np.int64))
+            mask = rows if mask is None else rows[mask[rows]]
+
+        def read(column):
+            values = self.getColumn(column)
+            return np.asarray(values if mask is None else values[mask])
+
+        index = {}
+        for name, values in (
+            ("Protein", self.metadata["proteins"]),
+            ("Ligand", self.metadata["ligands"]),
+        ):
+            index[name] = pd.Categorical.from_codes(read(name), categories=values)
+        for name in INDEX_COLUMNS[2:]:
+            index[name] = read(name)
+
+        data = pd.DataFrame({column: read(column) for column in columns})
+        data.index = pd.MultiIndex.from_arrays(list(index.values()), names=list(index))
+
+        return data
+
+    def getPairRows(self) -> dict:
+        """
+        Returns the row indexes of every protein and ligand pair in the cache. They
+        are computed once and kept until rows are stored or added, so the arrays
+        must not be modified.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        if self._pair_rows is not None:
+            return self._pair_rows
+
+        n_ligands = max(len(self.metadata["ligands"]), 1)
+        pair_codes = np.asarray(self.getColumn("Protein"), dtype=np.int64) * n_ligands
+        pair_codes += self.getColumn("Ligand")
+
+        order = np.argsort(pair_codes, kind="stable")
+        codes, starts = np.unique(pair_codes[order], return_index=True)
+        ends = list(starts[1:]) + [len(order)]
+
+        pair_rows = {}
+        for code, start, end in zip(codes, starts, ends):
+            protein = self.metadata["proteins"][code // n_ligands]
+            ligand = self.metadata["ligands"][code % n_ligands]
+            pair_rows[(protein, ligand)] = order[start:end]
+
+        self._pair_rows = pair_rows
+        return pair_rows
+
+    def setColumn(self, column: str, values):
+        """
+        Stores a column computed from the cached data (e.g. a metric). The rows
+        added afterwards by update are missing values, except for the metrics,
+        which update combines again. The column is dropped when the data is stored
+        again.
+        """
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        if column in INDEX_COLUMNS:
+            raise ValueError(f"Column {column} cannot be overwritten")
+
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape != (len(self),):
+            raise ValueError(f"Column {column} must have {len(self)} values")
+
+        columns = self.metadata["columns"]
+        if column not in columns:
+            columns[column] = {"file": f"{len(columns):04d}.bin", "dtype": values.dtype.str}
+
+        with open(os.path.join(self.cache_folder, columns[column]["file"]), "wb") as f:
+            f.write(values.astype(columns[column]["dtype"]).tobytes())
+
+        self._writeMetadata()
+
+    def getPairColumns(self, protein: str, ligand: str) -> typing.List[str]:
+        """
+        Returns the report columns holding data for a protein and ligand.
+        """
+        return list(self.metadata["pair_columns"].get(f"{protein}{self.separator}{ligand}", []))
+
+    def listReports(self) -> dict:
+        """
+        Returns the size and modification time of every report of the PELE folder,
+        keyed by their path relative to it.
+        """
+        reports = {}
+        for pair in sorted(os.listdir(self.pele_folder)):
+            pair_folder = os.path.join(self.pele_folder, pair)
+            if pair.startswith(".") or not os.path.isdir(pair_folder):
+                continue
+            for root, _, files in os.walk(pair_folder):
+                if not os.path.basename(root).isdigit():
+                    continue
+                for file in files:
+                    if _REPORT_REGEX.match(file):
+                        path = os.path.join(root, file)
+                        stat = os.stat(path)
+                        reports[os.path.relpath(path, self.pele_folder)] = {
+                            "size": stat.st_size,
+                            "mtime": stat.st_mtime,
+                        }
+        return reports
+
+    def _readPairs(self, pairs: dict, processes: typing.Optional[int]):
+        if processes is None:
+            processes = getAvailableCPUs()
+        processes = min(processes, len(pairs))
+        if processes <= 1:
+            return [_readReports(self.pele_folder, jobs) for jobs in pairs.values()]
+
+        # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ProcessPoolExecutor
+
+        # pylint: enable=import-outside-toplevel
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            folders = [self.pele_folder] * len(pairs)
+            return list(executor.map(_readReports, folders, pairs.values()))
+
+    def _addPairColumns(self, pair: str, names: typing.List[str], rows: dict) -> dict:
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        # Report columns pele_analysis does not keep are skipped, new distances are added
+        rows = {
+            name: values
+            for name, values in rows.items()
+            if name in INDEX_COLUMNS
+            or name in self.metadata["columns"]
+            or name.startswith("distance_")
+        }
+
+        n_rows = len(rows["Epoch"])
+        protein, ligand = names
+        rows["Protein"] = np.full(n_rows, self._getCode("proteins", protein), dtype=np.int32)
+        rows["Ligand"] = np.full(n_rows, self._getCode("ligands", ligand), dtype=np.int32)
+
+        pair_columns = self.metadata["pair_columns"].setdefault(pair, [])
+        for name, values in rows.items():
+            if name in INDEX_COLUMNS or name in pair_columns:
+                continue
+            if np.isfinite(values).any():
+                pair_columns.append(name)
+
+        return rows
+
+    def _getCode(self, key: str, value: str) -> int:
+        if value not in self.metadata[key]:
+            self.metadata[key].append(value)
+        return self.metadata[key].index(value)
+
+    def _appendRows(self, rows: dict) -> int:
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        n_rows = len(rows["Protein"])
+        columns = self.metadata["columns"]
+
+        # New columns are back-filled with missing values
+        for name, values in rows.items():
+            if name not in columns:
+                dtype = np.dtype(values.dtype).str
+                columns[name] = {"file": f"{len(columns):04d}.bin", "dtype": dtype}
+                fill = np.full(len(self), np.nan, dtype=dtype)
+                with open(os.path.join(self.cache_folder, columns[name]["file"]), "wb") as f:
+                    f.write(fill.tobytes())
+
+        for name, info in columns.items():
+            values = rows.get(name)
+            if values is None:
+                values = np.full(n_rows, np.nan, dtype=info["dtype"])
+            path = os.path.join(self.cache_folder, info["file"])
+            with open(path, "r+b") as f:
+                # Drop any data written after the last saved metadata
+                f.truncate(len(self) * np.dtype(info["dtype"]).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(values, dtype=info["dtype"]).tobytes())
+
+        self.metadata["n_rows"] += n_rows
+        self._pair_rows = None
+
+        return n_rows
+
+    def _getCatalyticLabels(self) -> typing.Optional[dict]:
+        # The catalytic labels of the stored rules, from the distances of each pair
+        if self.metadata["rules"] is None:
+            return None
+
+        distances = {}
+        for protein in self.proteins:
+            for ligand in self.ligands:
+                pair_distances = [
+                    column
+                    for column in self.getPairColumns(protein, ligand)
+                    if column.startswith("distance_")
+                ]
+                if pair_distances:
+                    distances[(protein, ligand)] = pair_distances
+
+        return groupCatalyticLabels(
+            distances, self.proteins, self.ligands, self.metadata["rules"]
+        )
+
+    def _combineMetrics(self, catalytic_labels: dict, rows):
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        # The minimum distance of each group, as pele.combineDistancesIntoMetrics does
+        proteins = np.asarray(self.getColumn("Protein")[rows])
+        ligands = np.asarray(self.getColumn("Ligand")[rows])
+        for metric, metric_labels in catalytic_labels.items():
+            values = np.full(len(rows), np.nan)
+            for protein, ligand_labels in metric_labels.items():
+                for ligand, labels in ligand_labels.items():
+                    if len(labels) == 0:
+                        continue
+                    mask = (proteins == self.proteins.index(protein)) & (
+                        ligands == self.ligands.index(ligand)
+                    )
+                    if not mask.any():
+                        continue
+                    distances = [self.getColumn(label)[rows][mask] for label in labels]
+                    values[mask] = np.fmin.reduce(distances, axis=0)
+
+            column = "metric_" + metric
+            if column not in self.metadata["columns"]:
+                self.setColumn(column, np.full(len(self), np.nan))
+            info = self.metadata["columns"][column]
+            stored = np.memmap(
+                os.path.join(self.cache_folder, info["file"]),
+                dtype=info["dtype"],
+                mode="r+",
+                shape=(len(self),),
+            )
+            stored[rows] = values
+            stored.flush()
+
+    def _emptyMetadata(self) -> dict:
+        return {
+            "version": 5,
+            "separator": self.separator,
+            "n_rows": 0,
+            "proteins": [],
+            "ligands": [],
+            "columns": {},
+            "reports": {},
+            "pair_columns": {},
+            "rules": None,
+            "energy_by_residue": False,
+        }
+
+    def _readMetadata(self) -> dict:
+        path = os.path.join(self.cache_folder, "metadata.json")
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                metadata = json.load(f)
+            if metadata.get("version") == 5 and metadata.get("separator") == self.separator:
+                return metadata
+        return self._emptyMetadata()
+
+    def _writeMetadata(self):
+        os.makedirs(self.cache_folder, exist_ok=True)
+        path = os.path.join(self.cache_folder, "metadata.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.metadata, f)
+        os.replace(path + ".tmp", path)
+
+
+def _getReportKey(path: str) -> typing.Tuple[int, int]:
+    # Epoch and trajectory of a report, from its folder and name
+    parts = path.split(os.sep)
+    return int(parts[-2]), int(_REPORT_REGEX.match(parts[-1]).group(1))
+
+
+def _getLineEnd(path: str, size: int, block_size: int = 65536) -> int:
+    """
+    Returns the end of the last complete line in the first size bytes of a file,
+    reading it backwards.
+    """
+    with open(path, "rb") as f:
+        end = size
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            position = f.read(end - start).rfind(b"\n")
+            if position >= 0:
+                return start + position + 1
+            end = start
+    return 0
+
+
+def _parseReportHeader(line: bytes) -> typing.List[str]:
+    return [
+        _REPORT_COLUMN_NAMES.get(name, name)
+        for name in re.split(r"\s{2,}|\t", line.decode("utf-8").strip().lstrip("#"))
+        if name.strip() != ""
+    ]
+
+
+def _readReportHeader(path: str) -> typing.List[str]:
+    with open(path, "rb") as f:
+        return _parseReportHeader(f.readline())
+
+
+def _readReport(pele_folder: str, path: str, report: dict) -> tuple:
+    """
+    Parses the complete lines of a report between the offset stored in the report
+    dictionary and its listed size, updating the offset.
+
+    Returns:
+        tuple: The header of the report and its new rows, by column, or None if
+        there are no new rows.
+    """
+    # pylint: disable=import-outside-toplevel
+    import io
+
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    with open(os.path.join(pele_folder, path), "rb") as f:
+        header_line = f.readline()
+        f.seek(report["offset"])
+        content = f.read(max(report["size"] - report["offset"], 0))
+
+    # Only complete lines are parsed, PELE may still be writing the last one
+    end = content.rfind(b"\n") + 1
+    content = content[:end]
+    if not header_line.endswith(b"\n"):
+        return None, None
+    header = _parseReportHeader(header_line)
+
+    if report["offset"] == 0:
+        content = content[len(header_line) :]
+    report["offset"] += end
+
+    if content.strip() == b"":
+        return header, None
+
+    values = pd.read_csv(io.BytesIO(content), sep=r"\s+", header=None, dtype=np.float64)
+    if values.shape[1] != len(header):
+        raise ValueError(f"Report {path} has a different number of columns than its header")
+
+    rows = {name: values[i].to_numpy() for i, name in enumerate(header)}
+
+    n_rows = values.shape[0]
+    epoch, trajectory = _getReportKey(path)
+    rows["Epoch"] = np.full(n_rows, epoch, dtype=np.int32)
+    rows["Trajectory"] = np.full(n_rows, trajectory, dtype=np.int32)
+    rows["Accepted Pele Steps"] = rows["Accepted Pele Steps"].astype(np.int32)
+
+    return header, rows
+
+
+def _readReports(pele_folder: str, jobs: typing.List[tuple]) -> typing.List[tuple]:
+    # Reports of one protein and ligand, as (path, report, header, rows)
+    results = []
+    for path, report in jobs:
+        header, rows = _readReport(pele_folder, path, report)
+        results.append((path, report, header, rows))
+    return results
+
+
+def getAvailableCPUs() -> int:
+    """
+    Returns the number of CPUs the process can run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def plotBindingEnergyLandscape(
+    report_cache: PELEReportCache,
+    output_folder: str,
+    bins: int = 100,
+    top_k: int = 10,
+    mode: str = "binned",
+) -> typing.List[str]:
+    """
+    Plots the binding energy landscape of every metric for each protein and
+    ligand.
+
+    In the binned mode the steps are accumulated into 2D histograms, reading the
+    report cache in chunks, and only the top_k best binding energy steps are drawn
+    as points. Each plot is written with a JSON tile holding the histogram and the
+    top steps. The scatter mode draws every step, as pele_analysis does, for the
+    analyses that reuse the report cache without loading pele_analysis.
+
+    Args:
+        report_cache (PELEReportCache): The report cache holding the data.
+        output_folder (str): Folder where the PNG (and JSON) files are written.
+        bins (int): Number of bins per axis of the histograms.
+        top_k (int): Number of best binding energy steps drawn on the histograms.
+        mode (str): "binned" or "scatter".
+
+    Returns:
+        list: Paths of the written plots.
+    """
+    # pylint: disable=import-outside-toplevel
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+
+    # pylint: enable=import-outside-toplevel
+
+    if mode not in LANDSCAPE_MODES:
+        raise ValueError(f"Landscape mode {mode} not found. Try: {LANDSCAPE_MODES}")
+
+    metrics = [column for column in report_cache.columns if column.startswith("metric_")]
+    if len(metrics) == 0:
+        print("No metrics found, skipping the binding energy landscape")
+        return []
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    binding_energy = report_cache.getColumn("Binding Energy")
+
+    plots = []
+    for (protein, ligand), rows in report_cache.getPairRows().items():
+        name = f"{protein}{report_cache.separator}{ligand}"
+        tile = {"protein": protein, "ligand": ligand, "metrics": {}}
+
+        fig, axes = plt.subplots(1, len(metrics), figsize=(5 * len(metrics), 4), squeeze=False)
+        for ax, metric in zip(axes[0], metrics):
+            if mode == "scatter":
+                ax.scatter(report_cache.getColumn(metric)[rows], binding_energy[rows], s=2)
+            else:
+                landscape = binLandscape(report_cache, rows, metric, bins=bins, top_k=top_k)
+                if landscape is None:
+                    continue
+                x_edges, y_edges, counts, top_rows = landscape
+                if counts.max() > 0:
+                    ax.pcolormesh(
+                        x_edges, y_edges, counts.T, norm=LogNorm(vmin=1), cmap="viridis"
+                    )
+                top_x = report_cache.getColumn(metric)[top_rows]
+                ax.scatter(top_x, binding_energy[top_rows], s=8, c="red")
+
+                tile["metrics"][metric] = {
+                    "x_edges": x_edges.round(4).tolist(),
+                    "y_edges": y_edges.round(4).tolist(),
+                    "counts": counts.astype(int).tolist(),
+                    "top": _getTopSteps(report_cache, top_rows, metric),
+                }
+            ax.set_xlabel(metric.replace("metric_", "") + " (Å)")
+            ax.set_ylabel("Binding Energy")
+        fig.suptitle(f"{protein} {ligand}")
+        fig.tight_layout()
+
+        path = os.path.join(output_folder, f"{name}.png")
+        fig.savefig(path, dpi=100)
+        plt.close(fig)
+        plots.append(path)
+
+        if mode == "binned":
+            with open(os.path.join(output_folder, f"{name}.json"), "w", encoding="utf-8") as f:
+                json.dump(tile, f)
+
+    return plots
+
+
+def binLandscape(
+    report_cache: PELEReportCache,
+    rows,
+    metric: str,
+    bins: int = 100,
+    top_k: int = 10,
+    chunk_size: int = 1000000,
+):
+    """
+    Accumulates the binding energy against a metric into a 2D histogram, reading
+    the given rows of the report cache in chunks.
+
+    Returns:
+        tuple: The x and y bin edges, the counts and the rows of the top_k best
+        binding energy steps, or None if there is no data.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    x_values = report_cache.getColumn(metric)
+    y_values = report_cache.getColumn("Binding Energy")
+
+    def chunks():
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            x, y = x_values[chunk], y_values[chunk]
+            valid = np.isfinite(x) & np.isfinite(y)
+            yield chunk[valid], x[valid], y[valid]
+
+    # First pass, data ranges and best steps
+    x_range = [np.inf, -np.inf]
+    y_range = [np.inf, -np.inf]
+    top_rows = np.empty(0, dtype=np.int64)
+    top_y = np.empty(0)
+    for chunk, x, y in chunks():
+        if len(chunk) == 0:
+            continue
+        x_range = [min(x_range[0], x.min()), max(x_range[1], x.max())]
+        y_range = [min(y_range[0], y.min()), max(y_range[1], y.max())]
+
+        top_rows = np.concatenate([top_rows, chunk])
+        top_y = np.concatenate([top_y, y])
+        if len(top_y) > top_k:
+            best = np.argpartition(top_y, top_k - 1)[:top_k] if top_k > 0 else []
+            top_rows, top_y = top_rows[best], top_y[best]
+
+    if not np.isfinite(x_range[0]):
+        return None
+
+    x_edges = np.linspace(x_range[0], max(x_range[1], x_range[0] + 1e-6), bins + 1)
+    y_edges = np.linspace(y_range[0], max(y_range[1], y_range[0] + 1e-6), bins + 1)
+
+    # Second pass, counts
+    counts = np.zeros((bins, bins), dtype=np.int64)
+    for _, x, y in chunks():
+        counts += np.histogram2d(x, y, bins=[x_edges, y_edges])[0].astype(np.int64)
+
+    return x_edges, y_edges, counts, top_rows[np.argsort(top_y)]
+
+
+def _getTopSteps(report_cache: PELEReportCache, rows, metric: str) -> typing.List[dict]:
+    columns = {
+        "epoch": "Epoch",
+        "trajectory": "Trajectory",
+        "step": "Accepted Pele Steps",
+        "metric": metric,
+        "binding_energy": "Binding Energy",
+    }
+    values = {
+        key: report_cache.getColumn(column)[rows].tolist() for key, column in columns.items()
+    }
+    return [dict(zip(values, step)) for step in zip(*values.values())]
+
+
+# Default rules used to group distances into metrics
+DISTANCE_RULES_FILE = os.path.join(os.path.dirname(__file__), "pele_distance_rules.yaml")
+
+
+def readDistanceRules(path: typing.Optional[str] = None) -> typing.List[dict]:
+    """
+    Reads the rules that group distances into metrics from a YAML file (see
+    pele_distance_rules.yaml for the format).
+
+    Args:
+        path (str, optional): YAML file with the rules, the default rules otherwise.
+    """
+    # pylint: disable=import-outside-toplevel
+    import yaml
+
+    # pylint: enable=import-outside-toplevel
+
+    with open(path or DISTANCE_RULES_FILE, "r", encoding="utf-8") as f:
+        rules = yaml.safe_load(f)
+
+    if not isinstance(rules, list):
+        raise ValueError(f"The distance rules in {path} must be a list")
+
+    for rule in rules:
+        if not isinstance(rule, dict) or "metric" not in rule:
+            raise ValueError(f"Invalid distance rule {rule}, a metric label is required")
+        if not any(key in rule for key in ("atom1", "atom2", "column")):
+            raise ValueError(f"Distance rule {rule['metric']} has no atom1, atom2 or column")
+
+    return rules
+
+
+def classifyDistances(columns: typing.List[str], rules: typing.List[dict]) -> dict:
+    """
+    Assigns distance columns to metrics with a vectorised match of the rules
+    over all the column names.
+
+    Returns:
+        dict: Metric label of each matched column.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    names = pd.Series(columns, dtype=object)
+    atoms = names.str.extract(r"^distance_([^_]+)_([^_]+)")
+    fields = {"column": names, "atom1": atoms[0], "atom2": atoms[1]}
+
+    unassigned = pd.Series(True, index=names.index)
+    labels = pd.Series(None, index=names.index, dtype=object)
+    for rule in rules:
+        mask = unassigned.copy()
+        for key, field in fields.items():
+            if key in rule:
+                mask &= field.str.contains(rule[key], regex=True, na=False)
+        labels[mask] = rule["metric"]
+        unassigned &= ~mask
+
+    return dict(zip(names[~unassigned], labels[~unassigned]))
+
+
+# Folder where pele_analysis keeps the data it reads from the reports
+PELE_DATA_FOLDER = "pele_data/"
+
+LANDSCAPE_MODES = ["scatter", "binned"]
+
+
+def readPELEAnalysis(
+    pele_folder: str, data_folder: str = PELE_DATA_FOLDER, energy_by_residue: bool = False
+):
+    """
+    Reads a PELE folder with pele_analysis, with the options of the Analyse PELE
+    block.
+
+    Args:
+        pele_folder (str): Folder containing the PELE output.
+        data_folder (str): Folder where pele_analysis keeps the data it reads.
+        energy_by_residue (bool): Read the energy by residue columns.
+
+    Returns:
+        pele_analysis.peleAnalysis: The PELE analysis.
+    """
+    # pylint: disable=import-outside-toplevel
+    import pele_analysis
+
+    # pylint: enable=import-outside-toplevel
+
+    options = {"energy_by_residue": True} if energy_by_residue else {}
+
+    return pele_analysis.peleAnalysis(
+        pele_folder,
+        verbose=True,
+        separator="-",
+        trajectories=False,
+        data_folder_name=data_folder,
+        read_equilibration=True,
+        **options,
+    )
+
+
+def getCatalyticLabels(pele, rules: typing.List[dict]) -> dict:
+    """
+    Groups the distances of every protein and ligand of a pele_analysis into the
+    metrics of the rules, in the format of pele.combineDistancesIntoMetrics. The
+    rules are matched once over the distances of all the pairs.
+
+    Returns:
+        dict: Distance columns of each metric, protein and ligand, as
+        {metric: {protein: {ligand: [distance columns]}}}.
+    """
+    # The distances with values in each pair, in one pass over the data
+    columns = [column for column in pele.data.columns if column.startswith("distance_")]
+    has_values = (
+        pele.data[columns].notna().groupby(level=["Protein", "Ligand"], observed=True).any()
+    )
+    distances = {}
+    for (protein, ligand), row in has_values.iterrows():
+        if row.any():
+            distances[(protein, ligand)] = list(row.index[row.to_numpy()])
+
+    return groupCatalyticLabels(distances, pele.proteins, pele.ligands, rules)
+
+
+def groupCatalyticLabels(
+    distances: dict,
+    proteins: typing.List[str],
+    ligands: typing.List[str],
+    rules: typing.List[dict],
+) -> dict:
+    """
+    Groups the distances of each protein and ligand, as {(protein, ligand):
+    [distance columns]}, into the metrics of the rules, matching the rules once
+    over the distances of all the pairs.
+
+    Returns:
+        dict: Distance columns of each metric, protein and ligand, as
+        {metric: {protein: {ligand: [distance columns]}}}.
+    """
+    columns = sorted({d for pair_distances in distances.values() for d in pair_distances})
+    distance_metrics = classifyDistances(columns, rules)
+
+    catalytic_labels = {}
+    for metric in dict.fromkeys(rule["metric"] for rule in rules):
+        catalytic_labels[metric] = {}
+        for protein in proteins:
+            catalytic_labels[metric][protein] = {}
+            for ligand in ligands:
+                catalytic_labels[metric][protein][ligand] = []
+
+    for (protein, ligand), pair_distances in distances.items():
+        for d in pair_distances:
+            if d in distance_metrics:
+                catalytic_labels[distance_metrics[d]][protein][ligand].append(d)
+
+    return catalytic_labels
+
+
+def analysePELEFolder(
+    pele_folder: str,
+    output_folder: str = ".",
+    data_folder: str = PELE_DATA_FOLDER,
+    rules_path: typing.Optional[str] = None,
+    landscape_mode: str = "scatter",
+    landscape_bins: int = 100,
+    landscape_top: int = 10,
+    energy_by_residue: typing.Optional[str] = None,
+    energy_by_residue_type: str = "all",
+    energy_by_residue_top: int = 10,
+    temperature: float = 298.15,
+    processes: typing.Optional[int] = None,
+) -> PELEReportCache:
+    """
+    Runs the analysis of a PELE folder: reads it with pele_analysis, combines the
+    distances into the catalytic metrics, stores the data in the report cache of
+    the PELE folder and writes the binding energy landscapes and summary tables.
+    When the report cache was stored with the same rules and the reports were
+    only appended to, pele_analysis is not run: the appended lines are added to
+    the cache (see PELEReportCache.update) and the cached data is used.
+
+    It is shared by the local and the remote analysis of the Analyse PELE block,
+    so both produce the same files.
+
+    Args:
+        pele_folder (str): Folder containing the PELE output.
+        output_folder (str): Folder where the plots and tables are written.
+        data_folder (str): Folder where pele_analysis keeps the data it reads.
+        rules_path (str, optional): YAML file with the distance rules.
+        landscape_mode (str): "scatter" draws the landscapes with pele_analysis, or
+            into pele_plots when the cache is reused, "binned" writes binned
+            landscapes to pele_plots.
+        landscape_bins (int): Number of bins per axis of the binned landscapes.
+        landscape_top (int): Number of best steps drawn and summarised per pair.
+        energy_by_residue (str, optional): Aggregation of the energy by residue
+            columns, "boltzmann" or "best_k". Not aggregated if None.
+        energy_by_residue_type (str): Energy by residue type of the columns.
+        energy_by_residue_top (int): Number of best steps of the best_k aggregation.
+        temperature (float): Temperature (K) of the Boltzmann weights.
+        processes (int, optional): Number of processes parsing the appended
+            report lines. All the available CPUs by default.
+
+    Returns:
+        PELEReportCache: The report cache holding the analysed data.
+    """
+    if landscape_mode not in LANDSCAPE_MODES:
+        raise ValueError(f"Landscape mode {landscape_mode} not found. Try: {LANDSCAPE_MODES}")
+
+    rules = readDistanceRules(rules_path)
+
+    # pele_analysis is only run when the appended lines cannot be added to the cache
+    report_cache = PELEReportCache(pele_folder, separator="-")
+    pele = None
+    updated = report_cache.update(
+        rules, energy_by_residue=bool(energy_by_residue), processes=processes
+    )
+    if updated is None:
+        pele = storePELEAnalysis(
+            report_cache, data_folder, rules, energy_by_residue=bool(energy_by_residue)
+        )
+
+    if landscape_mode == "binned" or pele is None:
+        plots = plotBindingEnergyLandscape(
+            report_cache,
+            os.path.join(output_folder, "pele_plots"),
+            bins=landscape_bins,
+            top_k=landscape_top,
+            mode=landscape_mode,
+        )
+        print(f"Binding energy landscapes written to {len(plots)} plots in pele_plots")
+    else:
+        pele.bindingEnergyLandscape()
+
+    writePELESummary(report_cache, output_folder, top_k=landscape_top)
+
+    if energy_by_residue:
+        aggregateEnergyByResidue(
+            report_cache,
+            os.path.join(output_folder, "pele_energy_by_residue"),
+            energy_type=energy_by_residue_type,
+            mode=energy_by_residue,
+            top_k=energy_by_residue_top,
+            temperature=temperature,
+        )
+
+    return report_cache
+
+
+def storePELEAnalysis(
+    report_cache: PELEReportCache,
+    data_folder: str = PELE_DATA_FOLDER,
+    rules: typing.Optional[typing.List[dict]] = None,
+    energy_by_residue: bool = False,
+):
+    """
+    Reads the PELE folder of a report cache with pele_analysis, combines its
+    distances into the metrics of the rules and stores the data in the cache.
+
+    Args:
+        report_cache (PELEReportCache): The report cache of the PELE folder.
+        data_folder (str): Folder where pele_analysis keeps the data it reads.
+        rules (list, optional): Distance rules of the metrics. No metrics if None.
+        energy_by_residue (bool): Read the energy by residue columns.
+
+    Returns:
+        pele_analysis.peleAnalysis: The PELE analysis.
+    """
+    # The reports are listed first, lines written while they are read are read next time
+    reports = report_cache.listReports()
+    pele = readPELEAnalysis(
+        report_cache.pele_folder, data_folder, energy_by_residue=energy_by_residue
+    )
+
+    if rules is not None:
+        # Classify distances into common metrics --> the catalytic labels
+        catalytic_labels = getCatalyticLabels(pele, rules)
+
+        print("catalytic_labels", catalytic_labels)
+
+        # Calculate the catalytic distances for each group of distances
+        pele.combineDistancesIntoMetrics(catalytic_labels, overwrite=True)
+
+        print("Success combining distances into metrics")
+
+    report_cache.store(pele.data, reports, rules=rules, energy_by_residue=energy_by_residue)
+
+    return pele
+
+
+def getReportCache(pele_folder: str, data_folder: str = PELE_DATA_FOLDER) -> PELEReportCache:
+    """
+    Returns the report cache of a PELE folder, adding the lines appended to its
+    reports, or reading the folder again with pele_analysis if the cache cannot be
+    updated. The metrics are combined with the rules the cache was stored with.
+    """
+    report_cache = PELEReportCache(pele_folder, separator="-")
+    if report_cache.update() is None:
+        print("The report cache cannot be updated, reading the PELE folder with pele_analysis")
+        storePELEAnalysis(
+            report_cache,
+            data_folder,
+            report_cache.metadata["rules"],
+            energy_by_residue=report_cache.metadata["energy_by_residue"],
+        )
+    return report_cache
+
+
+def writePELESummary(report_cache: PELEReportCache, output_folder: str, top_k: int = 10):
+    """
+    Writes the summary tables of the report cache: pele_summary.csv, with the
+    binding energy and the best value of each metric per protein and ligand,
+    and pele_best_steps.csv, with the metrics of the top_k best binding energy
+    steps of each protein and ligand.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    metrics = [column for column in report_cache.columns if column.startswith("metric_")]
+    binding_energy = report_cache.getColumn("Binding Energy")
+
+    summary = []
+    best_rows = []
+    for (protein, ligand), rows in report_cache.getPairRows().items():
+        energies = binding_energy[rows]
+        pair_summary = {
+            "Protein": protein,
+            "Ligand": ligand,
+            "Steps": len(rows),
+            "Best Binding Energy": np.nanmin(energies) if len(rows) else np.nan,
+            "Mean Binding Energy": np.nanmean(energies) if len(rows) else np.nan,
+        }
+        for metric in metrics:
+            values = report_cache.getColumn(metric)[rows]
+            name = metric.replace("metric_", "")
+            pair_summary[f"Best {name}"] = (
+                np.nanmin(values) if np.isfinite(values).any() else np.nan
+            )
+        summary.append(pair_summary)
+
+        order = np.argsort(energies, kind="stable")[:top_k]
+        best_rows.append(rows[order])
+
+    os.makedirs(output_folder, exist_ok=True)
+    pd.DataFrame(summary).to_csv(os.path.join(output_folder, "pele_summary.csv"), index=False)
+
+    # Only the best steps are read from the columns
+    best_rows = np.concatenate(best_rows) if best_rows else np.array([], dtype=np.int64)
+    best_steps = report_cache.getData(["Binding Energy"] + metrics, rows=best_rows)
+    best_steps.to_csv(os.path.join(output_folder, "pele_best_steps.csv"))
+
+
+# Boltzmann constant in kcal/(mol K), the unit of the PELE energies
+BOLTZMANN_CONSTANT = 0.0019872043
+
+ENERGY_BY_RESIDUE_TYPES = ["all", "lennard_jones", "sgb", "electrostatic"]
+
+
+def getEnergyByResidueColumns(
+    columns: typing.List[str], energy_type: str = "all"
+) -> typing.Dict[str, str]:
+    """
+    Returns the energy by residue columns of the given type, named
+    chain:residue_type (e.g. A:145_all), mapped to their residue.
+    """
+    if energy_type not in ENERGY_BY_RESIDUE_TYPES:
+        raise ValueError(f"{energy_type} not found. Try: {ENERGY_BY_RESIDUE_TYPES}")
+
+    pattern = re.compile(rf"^(\w+:-?\d+\w?)_{energy_type}$")
+    residues = {}
+    for column in columns:
+        match = pattern.match(column)
+        if match:
+            residues[column] = match.group(1)
+    return residues
+
+
+def aggregateEnergyByResidue(
+    report_cache: PELEReportCache,
+    output_folder: str,
+    energy_type: str = "all",
+    mode: str = "boltzmann",
+    top_k: int = 10,
+    temperature: float = 298.15,
+    chunk_size: int = 100000,
+):
+    """
+    Aggregates the energy by residue columns of every protein and ligand into one
+    matrix of residues by statistics (mean, standard deviation and minimum).
+
+    In the boltzmann mode the steps are weighted by the Boltzmann factor of their
+    binding energy, accumulated over chunks of the report cache. In the best_k
+    mode the top_k best binding energy steps are averaged. Each pair is written
+    as an NPZ file (residues, statistics and matrix) and the means of all the
+    pairs are gathered in energy_by_residue_<type>.csv.
+
+    Returns:
+        pandas.DataFrame: Mean energy of every residue (columns) per pair (rows).
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    if mode not in ("boltzmann", "best_k"):
+        raise ValueError(f"Energy by residue mode {mode} not found. Try: boltzmann, best_k")
+
+    os.makedirs(output_folder, exist_ok=True)
+    binding_energy = report_cache.getColumn("Binding Energy")
+    statistics = ["mean", "std", "min"]
+
+    means = {}
+    for (protein, ligand), rows in report_cache.getPairRows().items():
+        residues = getEnergyByResidueColumns(
+            report_cache.getPairColumns(protein, ligand), energy_type
+        )
+        if len(residues) == 0:
+            continue
+        columns = [report_cache.getColumn(column) for column in residues]
+
+        energies = binding_energy[rows]
+        valid = np.isfinite(energies)
+        rows, energies = rows[valid], energies[valid]
+        if len(rows) == 0:
+            continue
+
+        if mode == "best_k":
+            best = np.argsort(energies, kind="stable")[:top_k]
+            rows, weights = rows[best], np.ones(len(best))
+        else:
+            kt = BOLTZMANN_CONSTANT * temperature
+            weights = np.exp(-(energies - energies.min()) / kt)
+
+        # Weighted first and second moments, accumulated over chunks of steps
+        total = np.zeros(len(columns))
+        first = np.zeros(len(columns))
+        second = np.zeros(len(columns))
+        minimum = np.full(len(columns), np.inf)
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start : start + chunk_size]
+            w = weights[start : start + chunk_size, None]
+            values = np.stack([column[chunk] for column in columns], axis=1)
+            finite = np.isfinite(values)
+            values = np.where(finite, values, 0.0)
+            total += (w * finite).sum(axis=0)
+            first += (w * values).sum(axis=0)
+            second += (w * values**2).sum(axis=0)
+            minimum = np.minimum(minimum, np.where(finite, values, np.inf).min(axis=0))
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = first / total
+            std = np.sqrt(np.maximum(second / total - mean**2, 0.0))
+        minimum[np.isinf(minimum)] = np.nan
+
+        name = f"{protein}{report_cache.separator}{ligand}"
+        np.savez_compressed(
+            os.path.join(output_folder, f"{name}_{energy_type}.npz"),
+            residues=np.array(list(residues.values())),
+            statistics=np.array(statistics),
+            matrix=np.stack([mean, std, minimum], axis=1),
+        )
+        means[(protein, ligand)] = pd.Series(mean, index=list(residues.values()))
+
+    if len(means) == 0:
+        print(f"No energy by residue columns of type {energy_type} found")
+        return pd.DataFrame()
+
+    means = pd.DataFrame(means).T
+    means.index.names = ["Protein", "Ligand"]
+    means.to_csv(os.path.join(output_folder, f"energy_by_residue_{energy_type}.csv"))
+    print(
+        f"Energy by residue of {len(means)} protein and ligand pairs written to {output_folder}"
+    )
+
+    return means
+
+
+# Selection of the ligand heavy atoms used when none is given
+LIGAND_SELECTION = "not protein and not water and not element H"
+
+
+def clusterLigandPoses(
+    report_cache: PELEReportCache,
+    protein: str,
+    ligand: str,
+    output_folder: str,
+    threshold: float = 2.0,
+    ligand_selection: str = LIGAND_SELECTION,
+    chunk_size: int = 1000,
+):
+    """
+    Clusters the ligand poses of a protein and ligand with a leader algorithm.
+
+    The trajectories are streamed in chunks, every frame is superposed on the
+    receptor CA atoms of the first frame and the RMSD of the ligand heavy atoms
+    is computed against all the cluster leaders at once. Only the leader
+    coordinates are kept in memory. The lowest binding energy pose of each
+    cluster is written as its representative PDB together with a CSV of the
+    cluster energies.
+
+    Args:
+        report_cache (PELEReportCache): The report cache of the PELE folder.
+        protein (str): Name of the protein.
+        ligand (str): Name of the ligand.
+        output_folder (str): Folder where the representatives are written.
+        threshold (float): Ligand RMSD (Å) under which a pose joins a cluster.
+        ligand_selection (str): MDTraj selection of the ligand atoms.
+        chunk_size (int): Number of frames read at once from the trajectories.
+
+    Returns:
+        pandas.DataFrame: The clusters, or None if no trajectory was found.
+    """
+    # pylint: disable=import-outside-toplevel
+    import mdtraj as md
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    pair = f"{protein}{report_cache.separator}{ligand}"
+    binding_energy = report_cache.getColumn("Binding Energy")
+
+    ligand_atoms = leaders = None
+    sizes = np.empty(0, dtype=np.int64)
+    energy_sums = np.empty(0)
+    best_energies = np.empty(0)
+    best_rows = np.empty(0, dtype=np.int64)
+    best_frames = []
+
+    for chunk, chunk_rows, path, top, frame in iterPairFrames(
+        report_cache, protein, ligand, chunk_size=chunk_size
+    ):
+        if ligand_atoms is None:
+            ligand_atoms = chunk.topology.select(ligand_selection)
+            if len(ligand_atoms) == 0:
+                raise ValueError(f"No ligand atoms match '{ligand_selection}' in {pair}")
+            leaders = np.empty((0, len(ligand_atoms) * 3), dtype=np.float32)
+
+        coordinates = chunk.xyz[:, ligand_atoms].reshape(len(chunk), -1) * 10.0
+        energies = binding_energy[chunk_rows]
+
+        labels, leaders = _assignLeaders(coordinates, leaders, len(ligand_atoms), threshold)
+
+        n_clusters = len(leaders)
+        sizes = np.append(sizes, np.zeros(n_clusters - len(sizes), dtype=np.int64))
+        energy_sums = np.append(energy_sums, np.zeros(n_clusters - len(energy_sums)))
+        best_energies = np.append(best_energies, np.full(n_clusters - len(best_energies), np.inf))
+        best_rows = np.append(best_rows, np.full(n_clusters - len(best_rows), -1))
+        best_frames += [None] * (n_clusters - len(best_frames))
+
+        sizes += np.bincount(labels, minlength=n_clusters)
+        energy_sums += np.bincount(labels, weights=energies, minlength=n_clusters)
+
+        # Lowest binding energy frame of each cluster in the chunk
+        order = np.lexsort((energies, labels))
+        clusters, first = np.unique(labels[order], return_index=True)
+        for cluster, index in zip(clusters, order[first]):
+            if energies[index] < best_energies[cluster]:
+                best_energies[cluster] = energies[index]
+                best_rows[cluster] = chunk_rows[index]
+                best_frames[cluster] = (path, top, frame + index)
+
+    if leaders is None:
+        return None
+
+    pair_folder = os.path.join(output_folder, pair)
+    os.makedirs(pair_folder, exist_ok=True)
+
+    clusters = []
+    for cluster in np.argsort(best_energies):
+        if best_frames[cluster] is None:
+            continue
+        path, top, index = best_frames[cluster]
+        pdb = os.path.join(pair_folder, f"cluster_{len(clusters)}.pdb")
+        md.load_frame(path, index, top=top).save_pdb(pdb)
+        row = best_rows[cluster]
+        clusters.append(
+            {
+                "Protein": protein,
+                "Ligand": ligand,
+                "Cluster": len(clusters),
+                "Size": sizes[cluster],
+                "Epoch": report_cache.getColumn("Epoch")[row],
+                "Trajectory": report_cache.getColumn("Trajectory")[row],
+                "Accepted Pele Steps": report_cache.getColumn("Accepted Pele Steps")[row],
+                "Binding Energy": best_energies[cluster],
+                "Mean Binding Energy": energy_sums[cluster] / sizes[cluster],
+                "Representative": pdb,
+            }
+        )
+
+    clusters = pd.DataFrame(clusters)
+    clusters.to_csv(os.path.join(pair_folder, "clusters.csv"), index=False)
+
+    return clusters
+
+
+def iterPairFrames(
+    report_cache: PELEReportCache,
+    protein: str,
+    ligand: str,
+    chunk_size: int = 1000,
+    superpose: bool = True,
+):
+    """
+    Streams the trajectories of a protein and ligand in chunks of frames, each
+    frame superposed on the receptor CA atoms of the first one unless superpose
+    is False.
+
+    The frames of a trajectory are matched in order with the report lines of the
+    same epoch and trajectory. Trajectories not found locally are skipped.
+
+    Yields:
+        tuple: The chunk (mdtraj.Trajectory), its report cache rows, the path and
+        topology of its trajectory and the index of its first frame.
+    """
+    # pylint: disable=import-outside-toplevel
+    import mdtraj as md
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    pair = f"{protein}{report_cache.separator}{ligand}"
+    rows = report_cache.getPairRows().get((protein, ligand))
+    if rows is None:
+        return
+
+    rows = sortTrajectoryRows(report_cache, rows)
+    epochs = report_cache.getColumn("Epoch")[rows]
+    trajectories = report_cache.getColumn("Trajectory")[rows]
+
+    lookup = getTrajectoryLookup(report_cache.pele_folder)
+    topology = _findTopology(report_cache.pele_folder, pair)
+
+    reference = receptor_atoms = None
+    _, starts = np.unique(np.stack([epochs, trajectories], axis=1), axis=0, return_index=True)
+    bounds = list(np.sort(starts)) + [len(rows)]
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        epoch, trajectory = int(epochs[start]), int(trajectories[start])
+        path = lookup.get((pair, epoch, trajectory))
+        if path is None or not os.path.exists(os.path.join(report_cache.pele_folder, path)):
+            print(f"Trajectory {trajectory} of epoch {epoch} of {pair} not found, skipping it")
+            continue
+        path = os.path.join(report_cache.pele_folder, path)
+        top = topology if path.endswith(".xtc") else None
+
+        frame = 0
+        for chunk in md.iterload(path, chunk=chunk_size, top=top):
+            if reference is None:
+                reference = chunk[0]
+                receptor_atoms = reference.topology.select("protein and name CA")
+
+            n_frames = min(len(chunk), end - start - frame)
+            if n_frames <= 0:
+                break
+            chunk = chunk[:n_frames]
+            if superpose and len(receptor_atoms) > 0:
+                chunk.superpose(reference, atom_indices=receptor_atoms)
+
+            yield chunk, rows[start + frame : start + frame + n_frames], path, top, frame
+            frame += n_frames
+
+
+def sortTrajectoryRows(report_cache: PELEReportCache, rows):
+    """
+    Sorts report cache rows by epoch, trajectory and accepted step, the order of
+    the frames in the trajectory files.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    epochs = report_cache.getColumn("Epoch")[rows]
+    trajectories = report_cache.getColumn("Trajectory")[rows]
+    steps = report_cache.getColumn("Accepted Pele Steps")[rows]
+    return rows[np.lexsort((steps, trajectories, epochs))]
+
+
+def fetchMissingTrajectories(block: "PluginBlock", pele_folder: str) -> int:
+    """
+    Downloads every trajectory of the PELE folder that was left on the remote.
+
+    Returns:
+        int: Number of trajectories fetched.
+    """
+    missing = [
+        path
+        for path in getTrajectoryLookup(pele_folder).values()
+        if not os.path.exists(os.path.join(pele_folder, path))
+    ]
+    if missing:
+        fetchTrajectories(block, pele_folder, missing)
+    return len(missing)
+
+
+def _assignLeaders(coordinates, leaders, n_atoms: int, threshold: float):
+    """
+    Assigns each pose to its nearest leader if it is within the threshold, in the
+    frame order, making the pose a new leader otherwise. The RMSD against all
+    the current leaders is computed with a single matrix product.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    labels = np.full(len(coordinates), -1, dtype=np.int64)
+    if len(leaders) > 0:
+        rmsd = _pairwiseRMSD(coordinates, leaders, n_atoms)
+        nearest = rmsd.argmin(axis=1)
+        within = rmsd[np.arange(len(coordinates)), nearest] <= threshold
+        labels[within] = nearest[within]
+
+    # Poses far from every leader are compared only with the leaders created here
+    new_leaders = []
+    for index in np.flatnonzero(labels < 0):
+        if new_leaders:
+            rmsd = _pairwiseRMSD(
+                coordinates[index : index + 1], coordinates[new_leaders], n_atoms
+            )
+            nearest = int(rmsd[0].argmin())
+            if rmsd[0, nearest] <= threshold:
+                labels[index] = len(leaders) + nearest
+                continue
+        labels[index] = len(leaders) + len(new_leaders)
+        new_leaders.append(index)
+
+    return labels, np.concatenate([leaders, coordinates[new_leaders]])
+
+
+def _pairwiseRMSD(a, b, n_atoms: int):
+    # |a - b|^2 = |a|^2 + |b|^2 - 2 a.b, over the flattened coordinates
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    squared = (a * a).sum(axis=1)[:, None] + (b * b).sum(axis=1)[None, :] - 2.0 * a @ b.T
+    return np.sqrt(np.maximum(squared, 0.0) / n_atoms)
+
+
+def _findTopology(pele_folder: str, pair: str) -> typing.Optional[str]:
+    """
+    Returns the topology PDB written by PELE for the XTC trajectories of a pair.
+    """
+    # pylint: disable=import-outside-toplevel
+    import glob
+
+    # pylint: enable=import-outside-toplevel
+
+    for pattern in ("**/topologies/topology_*.pdb", "**/input/*.pdb"):
+        topologies = sorted(glob.glob(os.path.join(pele_folder, pair, pattern), recursive=True))
+        if topologies:
+            return topologies[0]
+    return None
+
+
+def featuriseLigandCOM(
+    report_cache: PELEReportCache,
+    ligand_selection: str = LIGAND_SELECTION,
+    chunk_size: int = 1000,
+) -> typing.List[str]:
+    """
+    Computes the ligand center of mass (Å) of every step, after superposing the
+    frames on the receptor CA atoms, streaming the trajectories in chunks. The
+    coordinates are stored in the report cache as the ligand_com_x, ligand_com_y
+    and ligand_com_z columns, NaN for the steps without trajectory.
+
+    Returns:
+        list: Names of the feature columns.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    com = np.full((len(report_cache), 3), np.nan)
+    for protein, ligand in report_cache.getPairRows():
+        ligand_atoms = masses = None
+        for chunk, rows, _, _, _ in iterPairFrames(
+            report_cache, protein, ligand, chunk_size=chunk_size
+        ):
+            if ligand_atoms is None:
+                ligand_atoms = chunk.topology.select(ligand_selection)
+                if len(ligand_atoms) == 0:
+                    raise ValueError(
+                        f"No ligand atoms match '{ligand_selection}' in {protein} {ligand}"
+                    )
+                atoms = list(chunk.topology.atoms)
+                masses = np.array([atoms[i].element.mass for i in ligand_atoms])
+                masses /= masses.sum()
+            com[rows] = np.einsum("fai,a->fi", chunk.xyz[:, ligand_atoms], masses) * 10.0
+
+    columns = ["ligand_com_x", "ligand_com_y", "ligand_com_z"]
+    for i, column in enumerate(columns):
+        report_cache.setColumn(column, com[:, i])
+    return columns
+
+
+def buildMarkovStateModels(
+    report_cache: PELEReportCache,
+    features: typing.List[str],
+    output_folder: str,
+    n_states: int = 50,
+    lag_times: typing.Iterable[int] = (1, 2, 5, 10),
+    chunk_size: int = 100000,
+):
+    """
+    Builds a Markov state model for each protein and ligand from feature columns
+    of the report cache.
+
+    The steps are discretised with mini-batch k-means, fitted and assigned over
+    chunks of the memory-mapped features. Each epoch and trajectory is an
+    independent segment, so transitions are only counted inside a trajectory,
+    at every lag time (in accepted PELE steps). The stationary populations are
+    estimated from the symmetrised counts, which assumes detailed balance, and
+    the implied timescales are taken from the eigenvalues of the resulting
+    transition matrix. The states are stored in the report cache as the
+    msm_state column.
+
+    Args:
+        report_cache (PELEReportCache): The report cache of the PELE folder.
+        features (list): Report cache columns used as features.
+        output_folder (str): Folder where the models are written.
+        n_states (int): Number of k-means states per protein and ligand.
+        lag_times (list): Lag times, in accepted PELE steps.
+        chunk_size (int): Number of steps read at once from the report cache.
+
+    Returns:
+        pandas.DataFrame: Stationary population of every state and lag time.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+    from sklearn.cluster import MiniBatchKMeans
+
+    # pylint: enable=import-outside-toplevel
+
+    os.makedirs(output_folder, exist_ok=True)
+    lag_times = sorted({int(lag) for lag in lag_times if int(lag) > 0})
+    columns = [report_cache.getColumn(feature) for feature in features]
+
+    def read(rows):
+        return np.stack([column[rows] for column in columns], axis=1)
+
+    states = np.full(len(report_cache), np.nan)
+    populations = []
+    for (protein, ligand), rows in report_cache.getPairRows().items():
+        rows = sortTrajectoryRows(report_cache, rows)
+
+        valid = np.ones(len(rows), dtype=bool)
+        for start in range(0, len(rows), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            valid[chunk] = np.isfinite(read(rows[chunk])).all(axis=1)
+
+        n_clusters = min(n_states, int(valid.sum()))
+        if n_clusters < 2:
+            print(f"Not enough featurised steps for {protein} {ligand}, skipping it")
+            continue
+
+        # Fit over shuffled chunks, assign over ordered ones
+        kmeans = MiniBatchKMeans(n_clusters=n_clusters, random_state=0, n_init=3)
+        fit_rows = np.random.default_rng(0).permutation(rows[valid])
+        fit_size = max(chunk_size, n_clusters)
+        for start in range(0, len(fit_rows), fit_size):
+            batch = fit_rows[start : start + fit_size]
+            if start > 0 and len(batch) < n_clusters:
+                break
+            kmeans.partial_fit(read(np.sort(batch)))
+
+        pair_states = np.full(len(rows), -1, dtype=np.int64)
+        for start in range(0, len(rows), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            chunk_valid = valid[chunk]
+            if chunk_valid.any():
+                predicted = kmeans.predict(read(rows[chunk][chunk_valid]))
+                pair_states[chunk][chunk_valid] = predicted
+        states[rows[pair_states >= 0]] = pair_states[pair_states >= 0]
+
+        # Transitions are only counted inside the same epoch and trajectory
+        epochs = report_cache.getColumn("Epoch")[rows]
+        trajectories = report_cache.getColumn("Trajectory")[rows]
+        segments = np.cumsum(np.r_[0, (np.diff(epochs) != 0) | (np.diff(trajectories) != 0)])
+
+        model = {
+            "protein": protein,
+            "ligand": ligand,
+            "features": list(features),
+            "centers": kmeans.cluster_centers_.round(4).tolist(),
+            "lag_times": {},
+        }
+        for lag in lag_times:
+            counts = countTransitions(pair_states, segments, lag, n_clusters)
+            stationary, timescales = _estimateStationary(counts, lag)
+            model["lag_times"][str(lag)] = {
+                "counts": counts.tolist(),
+                "stationary": stationary.round(6).tolist(),
+                "timescales": timescales.round(4).tolist(),
+            }
+            populations.append(
+                pd.DataFrame(
+                    {
+                        "Protein": protein,
+                        "Ligand": ligand,
+                        "Lag": lag,
+                        "State": np.arange(n_clusters),
+                        "Population": stationary,
+                        **{
+                            feature: kmeans.cluster_centers_[:, i]
+                            for i, feature in enumerate(features)
+                        },
+                    }
+                )
+            )
+
+        name = f"{protein}{report_cache.separator}{ligand}"
+        with open(os.path.join(output_folder, f"{name}.json"), "w", encoding="utf-8") as f:
+            json.dump(model, f)
+
+    report_cache.setColumn("msm_state", states)
+
+    if len(populations) == 0:
+        return pd.DataFrame()
+    populations = pd.concat(populations, ignore_index=True)
+    populations.to_csv(os.path.join(output_folder, "stationary_populations.csv"), index=False)
+    return populations
+
+
+def countTransitions(states, segments, lag: int, n_states: int):
+    """
+    Counts the transitions between states at a lag time, only between steps of
+    the same segment. Unassigned steps (negative states) are ignored.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    if lag >= len(states):
+        return np.zeros((n_states, n_states), dtype=np.int64)
+
+    origin, target = states[:-lag], states[lag:]
+    valid = (segments[:-lag] == segments[lag:]) & (origin >= 0) & (target >= 0)
+    counts = np.bincount(origin[valid] * n_states + target[valid], minlength=n_states * n_states)
+    return counts.reshape(n_states, n_states)
+
+
+def _estimateStationary(counts, lag: int, n_timescales: int = 5):
+    # Reversible estimate from the symmetrised counts
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    symmetric = counts + counts.T
+    total = symmetric.sum()
+    if total == 0:
+        return np.zeros(len(counts)), np.empty(0)
+    stationary = symmetric.sum(axis=1) / total
+
+    visited = symmetric.sum(axis=1) > 0
+    transition = symmetric[visited][:, visited] / symmetric[visited].sum(axis=1)[:, None]
+    eigenvalues = np.sort(np.abs(np.linalg.eigvals(transition)))[::-1][1 : n_timescales + 1]
+    eigenvalues = eigenvalues[(eigenvalues > 0) & (eigenvalues < 1)]
+    timescales = -lag / np.log(eigenvalues)
+
+    return stationary, timescales
+
+
+# Packed trajectories, stored inside the PELE folder
+TRAJECTORY_STORE_FOLDER = ".trajectory_store"
+
+
+class PELETrajectoryStore:
+    """
+    Compressed copy of the trajectories of a PELE folder, with one folder per
+    protein and ligand holding:
+
+    - topology.pdb: first frame, used as topology.
+    - shard_NNNN.npz: coordinates of up to frames_per_shard frames, quantised to
+      integers of 0.001 nm (the XTC precision) and zlib compressed.
+    - index.npz: epoch, trajectory and accepted step of every frame, with its
+      shard and offset inside it.
+
+    Loading a pose only decompresses its shard, whatever the size of the campaign.
+    """
+
+    PRECISION = 1000.0
+
+    def __init__(self, pele_folder: str, separator: str = "-", store_folder: str = None):
+        self.pele_folder = pele_folder
+        self.separator = separator
+        self.store_folder = store_folder or os.path.join(pele_folder, TRAJECTORY_STORE_FOLDER)
+        self._indexes = {}
+        self._topologies = {}
+        self._shard = (None, None)
+
+    def pack(
+        self, report_cache: PELEReportCache, frames_per_shard: int = 1000, verbose: bool = True
+    ) -> int:
+        """
+        Packs the local trajectories of every protein and ligand. Pairs whose
+        store already holds all their steps are skipped, the others are packed
+        again.
+
+        Returns:
+            int: Number of frames packed.
+        """
+        # pylint: disable=import-outside-toplevel
+        import shutil
+
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        packed = 0
+        for (protein, ligand), rows in report_cache.getPairRows().items():
+            index = self._readIndex(protein, ligand)
+            if index is not None and len(index["epoch"]) == len(rows):
+                continue
+
+            pair_folder = self._pairFolder(protein, ligand)
+            if os.path.exists(pair_folder):
+                shutil.rmtree(pair_folder)
+            os.makedirs(pair_folder)
+            self._indexes.pop((protein, ligand), None)
+            self._topologies.pop((protein, ligand), None)
+            self._shard = (None, None)
+
+            keys = {"epoch": [], "trajectory": [], "step": [], "shard": [], "offset": []}
+            buffer = []
+            n_buffered = 0
+
+            def flush():
+                shard = keys["shard"][-1] + 1 if keys["shard"] else 0
+                xyz = np.concatenate(buffer)
+                np.savez_compressed(
+                    os.path.join(pair_folder, f"shard_{shard:04d}.npz"),
+                    xyz=np.round(xyz * self.PRECISION).astype(np.int32),
+                )
+                keys["shard"] += [shard] * len(xyz)
+                keys["offset"] += list(range(len(xyz)))
+                buffer.clear()
+
+            for chunk, chunk_rows, _, _, _ in iterPairFrames(
+                report_cache, protein, ligand, chunk_size=frames_per_shard, superpose=False
+            ):
+                if not os.path.exists(os.path.join(pair_folder, "topology.pdb")):
+                    chunk[0].save_pdb(os.path.join(pair_folder, "topology.pdb"))
+
+                keys["epoch"] += report_cache.getColumn("Epoch")[chunk_rows].tolist()
+                keys["trajectory"] += report_cache.getColumn("Trajectory")[chunk_rows].tolist()
+                keys["step"] += report_cache.getColumn("Accepted Pele Steps")[chunk_rows].tolist()
+
+                # Shards are filled up to frames_per_shard across trajectories
+                xyz = chunk.xyz
+                while len(xyz) > 0:
+                    take = frames_per_shard - n_buffered
+                    buffer.append(xyz[:take])
+                    n_buffered += len(xyz[:take])
+                    xyz = xyz[take:]
+                    if n_buffered == frames_per_shard:
+                        flush()
+                        n_buffered = 0
+
+            if buffer:
+                flush()
+
+            if len(keys["epoch"]) == 0:
+                shutil.rmtree(pair_folder)
+                continue
+
+            np.savez(
+                os.path.join(pair_folder, "index.npz"),
+                **{key: np.array(values, dtype=np.int32) for key, values in keys.items()},
+            )
+            packed += len(keys["epoch"])
+            if verbose:
+                print(f"Packed {len(keys['epoch'])} frames of {protein} {ligand}")
+
+        return packed
+
+    def getFrame(self, protein: str, ligand: str, epoch: int, trajectory: int, step: int):
+        """
+        Returns the frame of an accepted step as an mdtraj.Trajectory.
+        """
+        return self.getFrames(protein, ligand, [(epoch, trajectory, step)])
+
+    def getFrames(
+        self, protein: str, ligand: str, steps: typing.List[typing.Tuple[int, int, int]]
+    ):
+        """
+        Returns the frames of several (epoch, trajectory, accepted step) tuples, in
+        the given order, decompressing each shard once.
+        """
+        # pylint: disable=import-outside-toplevel
+        import mdtraj as md
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        index = self._readIndex(protein, ligand)
+        if index is None:
+            raise ValueError(f"{protein} {ligand} is not in the trajectory store")
+
+        locations = []
+        for step in steps:
+            location = index["lookup"].get(tuple(int(value) for value in step))
+            if location is None:
+                raise ValueError(f"Step {step} of {protein} {ligand} is not in the store")
+            locations.append(location)
+
+        xyz = np.empty((len(locations), self._topology(protein, ligand).n_atoms, 3), np.float32)
+        for shard in sorted({shard for shard, _ in locations}):
+            coordinates = self._readShard(protein, ligand, shard)
+            for i, (frame_shard, offset) in enumerate(locations):
+                if frame_shard == shard:
+                    xyz[i] = coordinates[offset]
+
+        return md.Trajectory(xyz, self._topology(protein, ligand))
+
+    def getSteps(self, protein: str, ligand: str):
+        """
+        Returns the (epoch, trajectory, accepted step) of every packed frame.
+        """
+        index = self._readIndex(protein, ligand)
+        if index is None:
+            return []
+        return list(index["lookup"])
+
+    def _pairFolder(self, protein: str, ligand: str) -> str:
+        return os.path.join(self.store_folder, f"{protein}{self.separator}{ligand}")
+
+    def _readIndex(self, protein: str, ligand: str) -> typing.Optional[dict]:
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        if (protein, ligand) not in self._indexes:
+            path = os.path.join(self._pairFolder(protein, ligand), "index.npz")
+            if not os.path.exists(path):
+                return None
+            with np.load(path) as data:
+                index = {key: data[key] for key in data.files}
+            keys = zip(
+                index["epoch"].tolist(), index["trajectory"].tolist(), index["step"].tolist()
+            )
+            locations = zip(index["shard"].tolist(), index["offset"].tolist())
+            index["lookup"] = dict(zip(keys, locations))
+            self._indexes[(protein, ligand)] = index
+        return self._indexes[(protein, ligand)]
+
+    def _readShard(self, protein: str, ligand: str, shard: int):
+        # pylint: disable=import-outside-toplevel
+        import numpy as np
+
+        # pylint: enable=import-outside-toplevel
+
+        # The last shard read is kept, consecutive poses usually share it
+        key = (protein, ligand, shard)
+        if self._shard[0] != key:
+            path = os.path.join(self._pairFolder(protein, ligand), f"shard_{shard:04d}.npz")
+            with np.load(path) as data:
+                self._shard = (key, data["xyz"].astype(np.float32) / self.PRECISION)
+        return self._shard[1]
+
+    def _topology(self, protein: str, ligand: str):
+        # pylint: disable=import-outside-toplevel
+        import mdtraj as md
+
+        # pylint: enable=import-outside-toplevel
+
+        if (protein, ligand) not in self._topologies:
+            path = os.path.join(self._pairFolder(protein, ligand), "topology.pdb")
+            self._topologies[(protein, ligand)] = md.load_topology(path)
+        return self._topologies[(protein, ligand)]
+
+
+if __name__ == "__main__":
+    # Entry point of the remote analysis jobs submitted by the Analyse PELE block
+    # pylint: disable=import-outside-toplevel
+    import argparse
+
+    # pylint: enable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description="Analyse the reports of a PELE folder")
+    parser.add_argument("pele_folder", help="Folder containing the PELE output")
+    parser.add_argument("--output_folder", default=".")
+    parser.add_argument("--data_folder", default=PELE_DATA_FOLDER)
+    parser.add_argument("--rules", default=None)
+    parser.add_argument("--landscape_mode", default="scatter")
+    parser.add_argument("--landscape_bins", type=int, default=100)
+    parser.add_argument("--landscape_top", type=int, default=10)
+    parser.add_argument("--energy_by_residue", default=None)
+    parser.add_argument("--energy_by_residue_type", default="all")
+    parser.add_argument("--energy_by_residue_top", type=int, default=10)
+    parser.add_argument("--temperature", type=float, default=298.15)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    analysePELEFolder(
+        args.pele_folder,
+        output_folder=args.output_folder,
+        data_folder=args.data_folder,
+        rules_path=args.rules,
+        landscape_mode=args.landscape_mode,
+        landscape_bins=args.landscape_bins,
+        landscape_top=args.landscape_top,
+        energy_by_residue=args.energy_by_residue,
+        energy_by_residue_type=args.energy_by_residue_type,
+        energy_by_residue_top=args.energy_by_residue_top,
+        temperature=args.temperature,
+        processes=args.processes,
+    )
@@ -0,0 +1,90 @@
+"""
+Helper functions shared by the blocks that load protein models
+"""
+
+import json
+import os
+import typing
+
+# Residues of every model of a models folder, cached next to the models
+RESIDUE_INDEX_FILE = ".residue_index.json"
+
+
+def _modelFingerprint(models_folder: str, model: str) -> typing.Optional[list]:
+    path = os.path.join(models_folder, model + ".pdb")
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+class ResidueIndex:
+    """
+    Index of the residues of each model of a models folder, mapping the residue
+    numbers to their residues. The index is built once from the parsed
+    structures and cached in the models folder; a model is walked again only
+    when its file changes.
+
+    Args:
+        models_folder (str): Folder with the models, as given to proteinModels.
+        models (prepare_proteins.proteinModels): The models loaded from the folder,
+            used to index the models missing in the cache.
+    """
+
+    def __init__(self, models_folder: str, models):
+        self.models_folder = models_folder
+        self.index_path = os.path.join(models_folder, RESIDUE_INDEX_FILE)
+
+        cache = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+
+        updated = False
+        self._by_number = {}
+        for model in models:
+            fingerprint = _modelFingerprint(models_folder, model)
+            entry = cache.get(model)
+            if entry is None or fingerprint is None or entry["fingerprint"] != fingerprint:
+                entry = {
+                    "fingerprint": fingerprint,
+                    "residues": self._walkStructure(models.structures[model]),
+                }
+                cache[model] = entry
+                updated = True
+            self._addModel(model, entry["residues"])
+
+        if updated:
+            with open(self.index_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+
+    @staticmethod
+    def _walkStructure(structure) -> list:
+        return [[r.get_parent().id, r.id[1], r.resname] for r in structure.get_residues()]
+
+    def _addModel(self, model: str, residues: list):
+        self._by_number[model] = {}
+        # Residues are kept with their position in the structure, older index files
+        # also hold the atom names of each residue
+        for position, residue in enumerate(residues):
+            chain, number, name = residue[:3]
+            self._by_number[model].setdefault(number, []).append(
+                (position, (chain, number, name))
+            )
+
+    def findResidues(
+        self, model: str, numbers: typing.Iterable[int], name: typing.Optional[str] = None
+    ) -> typing.List[tuple]:
+        """
+        Returns the residues of a model with any of the given residue numbers, and
+        the given residue name if set, as (chain, number, name) tuples in the
+        order of the structure.
+        """
+        residues = []
+        for number in numbers:
+            residues += [
+                (position, residue)
+                for position, residue in self._by_number[model].get(int(number), [])
+                if name is None or residue[2] == name
+            ]
+        return [residue for _, residue in sorted(residues)]
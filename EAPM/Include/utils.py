@@ -2,9 +2,17 @@ import datetime
 import os
 import shutil
 import subprocess
+import tarfile
 import typing
 
-from HorusAPI import PluginBlock, PluginVariable, SlurmBlock, VariableList, VariableTypes
+from HorusAPI import (
+    Extensions,
+    PluginBlock,
+    PluginVariable,
+    SlurmBlock,
+    VariableList,
+    VariableTypes,
+)
 
 localIPs = {"cactus": "84.88.51.217", "blossom": "84.88.51.250", "bubbles": "84.88.51.219"}
 
@@ -336,12 +344,37 @@ def launchCalculationAction(
             os.environ = oldEnv
 
 
-def downloadResultsAction(block: SlurmBlock):
+def getRemoteResultsFolder(block: SlurmBlock) -> str:
+    """
+    Returns the folder of the remote that holds the results of the calculation.
+
+    Args:
+        block (SlurmBlock): The block that launched the calculation.
+    """
+    simRemoteDir = block.extraData["remoteDir"]
+
+    # If we sent the whole folder, the results are in a subfolder
+    if block.extraData.get("uploadedFolder", False):
+        simRemoteDir = os.path.join(simRemoteDir, os.path.basename(os.getcwd()))
+
+    return simRemoteDir
+
+
+def downloadResultsAction(
+    block: SlurmBlock,
+    excludePatterns: typing.Optional[typing.List[str]] = None,
+    keepRemoteFolder: bool = False,
+):
     """
     Final action of the block. It downloads the results from the remote.
 
     Args:
         block (SlurmBlock): The block to run the action on.
+        excludePatterns (list, optional): Shell patterns of the files that should
+            stay on the remote. When given, the results are packed on the remote
+            and only the remaining files are transferred.
+        keepRemoteFolder (bool, optional): Never remove the remote folder, e.g. because
+            excluded files will be fetched later.
     """
 
     if block.remote.name != "Local":
@@ -363,27 +396,26 @@ def downloadResultsAction(block: SlurmBlock):
         # Create the folder
         os.makedirs(folderDestinationOverride)
 
-        final_path = block.remote.getData(simRemoteDir, folderDestinationOverride)
+        if excludePatterns:
+            _downloadFilteredResults(block, excludePatterns, folderDestinationOverride)
+        else:
+            final_path = block.remote.getData(simRemoteDir, folderDestinationOverride)
 
-        # If we sent the whole folder, the results are in a subfolder
-        # Move them to the parent folder
-        if block.extraData.get("uploadedFolder", False):
-            print("Uploaded folder, moving results to parent folder")
-            final_path = os.path.join(final_path, os.path.basename(currentFolder))
+            # If we sent the whole folder, the results are in a subfolder
+            # Move them to the parent folder
+            if block.extraData.get("uploadedFolder", False):
+                print("Uploaded folder, moving results to parent folder")
+                final_path = os.path.join(final_path, os.path.basename(currentFolder))
 
-        # Move the contents of the downloaded folder to its parent
-        # This is done because the folder is downloaded as a subfolder
-        for file in os.listdir(final_path):
-            current_path = os.path.join(final_path, file)
-            new_path = os.path.join(currentFolder, file)
+            # Move the contents of the downloaded folder to its parent
+            # This is done because the folder is downloaded as a subfolder
+            for file in os.listdir(final_path):
+                current_path = os.path.join(final_path, file)
+                new_path = os.path.join(currentFolder, file)
 
-            if os.path.exists(new_path):
-                if os.path.isdir(new_path):
-                    shutil.rmtree(new_path)
-                else:
-                    os.remove(new_path)
+                _removePath(new_path)
 
-            shutil.move(current_path, new_path)
+                shutil.move(current_path, new_path)
 
         # Remove the downloaded folder
         shutil.rmtree(folderDestinationOverride)
@@ -396,7 +428,11 @@ def downloadResultsAction(block: SlurmBlock):
 
         remove_remote_folder_on_finish = block.variables.get("remove_folder_on_finish", True)
         # Remove the remote folder
-        if remove_remote_folder_on_finish:
+        if keepRemoteFolder:
+            print(
+                f"Keeping remote folder {remoteContainer}, the remaining files are fetched later"
+            )
+        elif remove_remote_folder_on_finish:
             print(f"Removing remote folder {remoteContainer}")
             block.remote.remoteCommand(f"rm -rf {remoteContainer}")
     else:
@@ -406,6 +442,71 @@ def downloadResultsAction(block: SlurmBlock):
     return final_path
 
 
+def _downloadFilteredResults(
+    block: SlurmBlock, excludePatterns: typing.List[str], downloadFolder: str
+):
+    """
+    Packs the results on the remote skipping the excluded files, downloads the
+    archive and extracts it on the current folder.
+    """
+    remoteResultsDir = getRemoteResultsFolder(block)
+
+    # The archive is written next to the results, never inside them
+    remoteArchive = block.extraData["remoteDir"].rstrip("/") + "_results.tar.gz"
+
+    excludeFlags = " ".join(f"--exclude='{pattern}'" for pattern in excludePatterns)
+    block.remote.remoteCommand(
+        f"cd {remoteResultsDir} && tar -czf {remoteArchive} {excludeFlags} ."
+    )
+
+    archivePath = block.remote.getData(remoteArchive, downloadFolder)
+    block.remote.remoteCommand(f"rm -f {remoteArchive}")
+
+    with tarfile.open(archivePath, "r:gz") as tar:
+        members = tar.getmembers()
+
+        # Replace the top level entries, as done when downloading the whole folder
+        topLevel = set()
+        for member in members:
+            name = os.path.normpath(member.name)
+            if name != ".":
+                topLevel.add(name.split(os.sep)[0])
+
+        for name in topLevel:
+            _removePath(os.path.join(os.getcwd(), name))
+
+        tar.extractall(os.getcwd(), members=members)
+
+
+def _removePath(path: str):
+    if os.path.exists(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def storeTableResults(path: str, title: str, table=None):
+    """
+    Shows a table in the EAPM table page, which loads it by pages sorted and
+    filtered on the server. Only the visible rows are sent to the browser, so
+    the table can have any number of rows.
+
+    Args:
+        path (str): Parquet or CSV file with the table.
+        title (str): Title of the results.
+        table (pandas.DataFrame, optional): Table written to path as Parquet before
+            showing it, with its index as columns.
+    """
+    if table is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        table.reset_index().to_parquet(path, index=False)
+
+    Extensions().storeExtensionResults(
+        "eapm", "load_tables", data={"path": os.path.abspath(path), "table": True}, title=title
+    )
+
+
 # Other variables
 # simulationNameVariable = PluginVariable(
 #     name="Simulation name",
@@ -0,0 +1,197 @@
+"""
+Shared fixtures of the EAPM tests
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "EAPM", "Include"))
+
+
+def _maeValue(value):
+    if isinstance(value, str):
+        return '"' + value + '"'
+    return str(value)
+
+
+def writeMAEStructure(f, title, properties, atoms):
+    """
+    Writes an f_m_ct block with the given properties and atoms, as
+    (chain, residue, residue name, atom name, atomic number, x, y, z).
+    """
+    properties = {"s_m_title": title, **properties}
+    f.write("f_m_ct {\n")
+    for key in properties:
+        f.write(f" {key}\n")
+    f.write(" :::\n")
+    for value in properties.values():
+        f.write(f" {_maeValue(value)}\n")
+    f.write(f" m_atom[{len(atoms)}] {{\n")
+    f.write("  # First column is atom index #\n")
+    for key in [
+        "r_m_x_coord",
+        "r_m_y_coord",
+        "r_m_z_coord",
+        "s_m_chain_name",
+        "i_m_residue_number",
+        "s_m_pdb_residue_name",
+        "s_m_pdb_atom_name",
+        "i_m_atomic_number",
+    ]:
+        f.write(f"  {key}\n")
+    f.write("  :::\n")
+    for i, (chain, residue, residue_name, name, number, x, y, z) in enumerate(atoms, 1):
+        f.write(f'  {i} {x} {y} {z} {chain} {residue} "{residue_name:<4}" "{name:<4}" {number}\n')
+    f.write("  :::\n }\n}\n\n")
+
+
+@pytest.fixture
+def pose_file_writer():
+    """
+    Returns a function writing a Glide pose viewer file: the receptor atoms and
+    then one structure per pose, as (properties, atoms).
+    """
+
+    def write(path, receptor, poses):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("{\n s_m_m2io_version\n :::\n 2.0.0\n}\n\n")
+            writeMAEStructure(f, "receptor", {}, receptor)
+            for i, (properties, atoms) in enumerate(poses, 1):
+                writeMAEStructure(f, f"pose {i}", properties, atoms)
+        return path
+
+    return write
+
+
+def writePELEFolder(
+    pele_folder, pairs=(("P1", "L1"), ("P2", "L1")), epochs=2, trajectories=2, steps=5, seed=0
+):
+    """
+    Writes the reports of a PELE folder and returns their data as pele_analysis
+    reads it: indexed by Protein, Ligand, Epoch, Trajectory and Accepted Pele
+    Steps, with the energies, a distance of each pair and energy by residue columns.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import pandas as pd
+
+    # pylint: enable=import-outside-toplevel
+
+    rng = np.random.default_rng(seed)
+    rows = []
+    for protein, ligand in pairs:
+        distance = f"distance_A{protein[-1]}0OG_L1C1"
+        for epoch in range(epochs):
+            folder = os.path.join(pele_folder, f"{protein}-{ligand}", "output", str(epoch))
+            os.makedirs(folder, exist_ok=True)
+            for trajectory in range(1, trajectories + 1):
+                lines = [
+                    f"#Task    Step    numberOfAcceptedPeleSteps    Binding Energy    {distance}"
+                ]
+                for step in range(steps):
+                    row = {
+                        "Protein": protein,
+                        "Ligand": ligand,
+                        "Epoch": epoch,
+                        "Trajectory": trajectory,
+                        "Accepted Pele Steps": step,
+                        "Total Energy": rng.normal(-1000, 10),
+                        "Binding Energy": rng.normal(-50, 5),
+                        distance: rng.uniform(2, 8),
+                        "A:10_all": rng.normal(-2, 1),
+                        "A:11_all": rng.normal(-1, 1),
+                    }
+                    rows.append(row)
+                    lines.append(
+                        f"1    {step}    {step}    {row['Binding Energy']}    {row[distance]}"
+                    )
+                with open(os.path.join(folder, f"report_{trajectory}"), "w") as f:
+                    f.write("\n".join(lines) + "\n")
+
+    data = pd.DataFrame(rows).set_index(
+        ["Protein", "Ligand", "Epoch", "Trajectory", "Accepted Pele Steps"]
+    )
+    return data
+
+
+@pytest.fixture
+def pele_folder(tmp_path):
+    """
+    Returns a PELE folder with two protein and ligand pairs and its data.
+    """
+    folder = str(tmp_path / "pele")
+    return folder, writePELEFolder(folder)
+
+
+def writePELETrajectories(
+    pele_folder, pairs=(("P1", "L1"), ("P2", "L1")), epochs=2, trajectories=2, steps=5, seed=0
+):
+    """
+    Writes a PDB trajectory next to every report of writePELEFolder: four CA atoms
+    and a three atom ligand that jumps between two sites 5 Å apart. Returns the
+    site of every frame, keyed by (pair, epoch, trajectory).
+    """
+    # pylint: disable=import-outside-toplevel
+    import mdtraj as md
+    import numpy as np
+
+    # pylint: enable=import-outside-toplevel
+
+    topology = md.Topology()
+    chain = topology.add_chain()
+    for _ in range(4):
+        topology.add_atom("CA", md.element.carbon, topology.add_residue("ALA", chain))
+    residue = topology.add_residue("LIG", topology.add_chain())
+    for name in ("C1", "C2", "C3"):
+        topology.add_atom(name, md.element.carbon, residue)
+
+    rng = np.random.default_rng(seed)
+    base = rng.random((7, 3))
+    sites = {}
+    for protein, ligand in pairs:
+        for epoch in range(epochs):
+            folder = os.path.join(pele_folder, f"{protein}-{ligand}", "output", str(epoch))
+            for trajectory in range(1, trajectories + 1):
+                site = rng.integers(0, 2, steps)
+                # Coordinates in nm, with a small noise
+                xyz = np.repeat(base[None], steps, axis=0)
+                xyz[:, 4:] += site[:, None, None] * 0.5
+                xyz += rng.normal(0, 0.002, xyz.shape)
+                md.Trajectory(xyz, topology).save_pdb(
+                    os.path.join(folder, f"trajectory_{trajectory}.pdb")
+                )
+                sites[(f"{protein}-{ligand}", epoch, trajectory)] = site
+    return sites
+
+
+class LocalRemote:
+    """
+    Remote of a block backed by a local folder, running its commands in a shell.
+    """
+
+    name = "cluster"
+    host = "cluster.example.org"
+
+    def __init__(self):
+        self.commands = []
+
+    def remoteCommand(self, command):
+        self.commands.append(command)
+        return subprocess.run(
+            command, shell=True, check=True, capture_output=True, text=True
+        ).stdout
+
+    def sendData(self, path, remote_folder):
+        if os.path.isdir(path):
+            return shutil.copytree(
+                path, os.path.join(remote_folder, os.path.basename(path.rstrip("/")))
+            )
+        return shutil.copy(path, remote_folder)
+
+    def getData(self, path, local_folder):
+        return shutil.copy(path, local_folder)
@@ -0,0 +1,111 @@
+"""
+Tests of the cached covalent ligand checks of the extracted docking poses
+"""
+
+import json
+import os
+
+import docking_utils
+
+
+class CovalentModels:
+    """
+    Stand-in for proteinModels: a pose is covalent when its file has a LINK record.
+    """
+
+    def __init__(self):
+        self.covalent = {}
+
+    def _checkCovalentLigands(self, model, pdb_file, check_file=False):
+        assert check_file
+        with open(pdb_file, "r", encoding="utf-8") as f:
+            linked = any(line.startswith("LINK") for line in f)
+        self.covalent[model] = [900] if linked else []
+        with open(pdb_file + ".checked", "a", encoding="utf-8") as f:
+            f.write("checked\n")
+
+
+def _writePose(output_folder, model, ligand, pose, covalent):
+    os.makedirs(os.path.join(output_folder, model), exist_ok=True)
+    path = os.path.join(output_folder, model, f"{model}-{ligand}-{pose}.pdb")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("LINK         OG  SER A  10                 C1  LIG L 900\n" if covalent else "")
+        f.write("END\n")
+    return path
+
+
+def _checks(path):
+    if not os.path.exists(path + ".checked"):
+        return 0
+    with open(path + ".checked", "r", encoding="utf-8") as f:
+        return len(f.readlines())
+
+
+def _cleanChecks(output_folder):
+    for model in os.listdir(output_folder):
+        if os.path.isdir(os.path.join(output_folder, model)):
+            for file in os.listdir(os.path.join(output_folder, model)):
+                if file.endswith(".checked"):
+                    os.remove(os.path.join(output_folder, model, file))
+
+
+def test_covalent_check_cache(tmp_path):
+    output_folder = str(tmp_path)
+    first = _writePose(output_folder, "P1", "L1", 1, covalent=True)
+    second = _writePose(output_folder, "P2", "L1", 1, covalent=False)
+
+    models = CovalentModels()
+    docking_utils.checkCovalentLigands(models, output_folder, processes=1)
+    assert models.covalent == {"P1": [900], "P2": []}
+    assert _checks(first) == 1 and _checks(second) == 1
+
+    with open(os.path.join(output_folder, docking_utils.COVALENT_CACHE_FILE)) as f:
+        cache = json.load(f)
+    assert sorted(key.split("|")[:2] for key in cache["results"]) == [
+        ["P1", "L1"],
+        ["P2", "L1"],
+    ]
+
+    # Unchanged files are not checked nor hashed again
+    _cleanChecks(output_folder)
+    hashed = []
+    hash_file = docking_utils._hashFile
+    docking_utils._hashFile = lambda path: hashed.append(path) or hash_file(path)
+    try:
+        models = CovalentModels()
+        docking_utils.checkCovalentLigands(models, output_folder, processes=1)
+    finally:
+        docking_utils._hashFile = hash_file
+    assert models.covalent == {"P1": [900], "P2": []}
+    assert hashed == [] and _checks(first) == 0
+
+    # A modified file is hashed and checked again
+    _writePose(output_folder, "P1", "L1", 1, covalent=False)
+    os.utime(first, ns=(0, 0))
+    models = CovalentModels()
+    docking_utils.checkCovalentLigands(models, output_folder, processes=1)
+    assert models.covalent == {"P1": [], "P2": []}
+    assert _checks(first) == 1 and _checks(second) == 0
+
+
+def test_same_file_of_another_ligand_is_checked(tmp_path):
+    output_folder = str(tmp_path)
+    first = _writePose(output_folder, "P1", "L1", 1, covalent=True)
+    models = CovalentModels()
+    docking_utils.checkCovalentLigands(models, output_folder, processes=1)
+
+    # Same contents as the first pose, but of another ligand
+    second = _writePose(output_folder, "P1", "L2", 1, covalent=True)
+    docking_utils.updateExtractionIndex(output_folder, [os.path.join("P1", "P1-L2-1.pdb")])
+    docking_utils.checkCovalentLigands(models, output_folder, processes=1)
+    assert _checks(first) == 1 and _checks(second) == 1
+
+
+def test_covalent_check_pool(tmp_path):
+    output_folder = str(tmp_path)
+    for i, model in enumerate(["P1", "P2", "P3"]):
+        _writePose(output_folder, model, "L1", 1, covalent=i % 2 == 0)
+
+    models = CovalentModels()
+    docking_utils.checkCovalentLigands(models, output_folder, processes=2)
+    assert models.covalent == {"P1": [900], "P2": [], "P3": [900]}
@@ -0,0 +1,125 @@
+"""
+Tests of the local analysis of the Glide dockings
+"""
+
+import os
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import docking_utils
+
+RECEPTOR = [
+    ("A", 10, "SER", "OG", 8, 0.0, 0.0, 0.0),
+    ("A", 12, "HIS", "NE2", 7, 10.0, 0.0, 0.0),
+]
+
+# Two poses of a ligand with a carbon and a hydrogen
+POSES = [
+    (
+        {"r_i_docking_score": -7.5, "r_i_glide_gscore": -7.6, "r_i_glide_rmsd_to_input": 1.25},
+        [
+            ("L", 900, "LIG", "C1", 6, 3.0, 0.0, 0.0),
+            ("L", 900, "LIG", "H1", 1, 1.0, 0.0, 0.0),
+        ],
+    ),
+    (
+        {"r_i_docking_score": -6.0, "r_i_glide_gscore": -6.1, "r_i_glide_rmsd_to_input": 2.5},
+        [
+            ("L", 900, "LIG", "C1", 6, 0.0, 4.0, 0.0),
+            ("L", 900, "LIG", "H1", 1, 9.0, 0.0, 0.0),
+        ],
+    ),
+]
+
+# docking_data.csv of the same poses, as written by the remote prepare_proteins analysis
+REMOTE_DOCKING_DATA = """Protein,Ligand,Pose,Score,RMSD
+P1,L1,1,-7.5,1.25
+P1,L1,2,-6.0,2.5
+"""
+
+
+@pytest.fixture
+def docking_folder(tmp_path, pose_file_writer):
+    pose_file_writer(str(tmp_path / "output_models" / "P1" / "P1-L1_pv.mae"), RECEPTOR, POSES)
+    return str(tmp_path)
+
+
+def _models():
+    return types.SimpleNamespace(docking_data=None, docking_distances={}, docking_ligands={})
+
+
+def test_read_mae_file(docking_folder):
+    structures = docking_utils.readMAEFile(
+        os.path.join(docking_folder, "output_models", "P1", "P1-L1_pv.mae")
+    )
+
+    assert len(structures) == 3
+    assert structures[1]["properties"]["r_i_docking_score"] == -7.5
+    receptor = structures[0]["atoms"]
+    assert list(receptor["name"]) == ["OG", "NE2"]
+    assert list(receptor["residue_name"]) == ["SER", "HIS"]
+    assert list(receptor["residue"]) == [10, 12]
+    np.testing.assert_allclose(receptor["x"], [0.0, 10.0])
+
+
+def test_local_docking_data_matches_remote(tmp_path, docking_folder):
+    models = _models()
+    atom_pairs = {"P1": {"L1": [(("A", 10, "OG"), "C1")]}}
+
+    failed = docking_utils.analyseDockingLocally(models, docking_folder, atom_pairs=atom_pairs)
+    assert failed == []
+
+    remote_path = tmp_path / "remote_docking_data.csv"
+    remote_path.write_text(REMOTE_DOCKING_DATA)
+    remote = pd.read_csv(remote_path).set_index(["Protein", "Ligand", "Pose"])
+    local = pd.read_csv(os.path.join(docking_folder, ".analysis", "docking_data.csv"))
+    local = local.set_index(["Protein", "Ligand", "Pose"])
+
+    pd.testing.assert_frame_equal(local, remote)
+    pd.testing.assert_frame_equal(models.docking_data, remote)
+
+
+def test_docking_distances(docking_folder):
+    models = _models()
+    atom_pairs = {"P1": {"L1": [(("A", 10, "OG"), "C1"), (("A", 12, "NE2"), "H1")]}}
+
+    docking_utils.analyseDockingLocally(models, docking_folder, atom_pairs=atom_pairs)
+
+    distances = models.docking_distances["P1"]["L1"]
+    assert list(distances.columns) == ["distance_A10OG_C1", "distance_A12NE2_H1"]
+    np.testing.assert_allclose(distances.to_numpy(), [[3.0, 9.0], [4.0, 1.0]])
+    assert models.docking_ligands == {"P1": ["L1"]}
+
+
+def test_closest_distances(docking_folder):
+    models = _models()
+    protein_atoms = {"P1": [("A", 10, "OG"), ("A", 12, "NE2")]}
+
+    docking_utils.analyseDockingLocally(models, docking_folder, protein_atoms=protein_atoms)
+    distances = models.docking_distances["P1"]["L1"]
+    np.testing.assert_allclose(distances.to_numpy(), [[1.0, 7.0], [4.0, 1.0]])
+    assert list(models.docking_data["closest_A10OG"]) == ["H1", "C1"]
+    assert list(models.docking_data["closest_A12NE2"]) == ["C1", "H1"]
+
+    docking_utils.analyseDockingLocally(
+        models, docking_folder, protein_atoms=protein_atoms, ignore_hydrogens=True
+    )
+    distances = models.docking_distances["P1"]["L1"]
+    np.testing.assert_allclose(distances.to_numpy(), [[3.0, 7.0], [4.0, np.hypot(10, 4)]])
+    assert list(models.docking_data["closest_A12NE2"]) == ["C1", "C1"]
+
+
+def test_closest_distances_batches(docking_folder):
+    pose_file = os.path.join(docking_folder, "output_models", "P1", "P1-L1_pv.mae")
+    atoms = [("A", 10, "OG"), ("A", 12, "NE2")]
+
+    data, distances = docking_utils.calculateClosestDistances(pose_file, atoms, "P1", "L1")
+    batch_data, batch_distances = docking_utils.calculateClosestDistances(
+        pose_file, atoms, "P1", "L1", batch_size=1
+    )
+
+    pd.testing.assert_frame_equal(batch_distances, distances)
+    pd.testing.assert_frame_equal(batch_data, data)
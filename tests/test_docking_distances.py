@@ -0,0 +1,106 @@
+"""
+Tests of the Parquet dataset of docking distances
+"""
+
+import os
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import docking_utils
+
+
+def _pairDistances(model, ligand, n_poses=3, labels=("A45OG_L1C1", "A90NE2_L1O2"), seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_tuples(
+        [(model, ligand, pose) for pose in range(1, n_poses + 1)],
+        names=["Protein", "Ligand", "Pose"],
+    )
+    return pd.DataFrame(rng.uniform(2, 8, (n_poses, len(labels))), index=index, columns=labels)
+
+
+@pytest.fixture
+def distances(tmp_path):
+    docking_folder = str(tmp_path)
+    distances = [
+        _pairDistances("P1", "L1"),
+        _pairDistances("P1", "L2", labels=("A45OG_L2C4",), seed=1),
+        _pairDistances("P2", "L1", n_poses=2, seed=2),
+    ]
+    docking_utils.writeDockingDistances(docking_folder, distances)
+    return docking_folder, distances
+
+
+def test_round_trip(distances):
+    docking_folder, written = distances
+
+    read = docking_utils.readDockingDistances(docking_folder)
+    for pair_distances in written:
+        model, ligand, _ = pair_distances.index[0]
+        pair = read.xs((model, ligand), level=["Protein", "Ligand"], drop_level=False)
+        pd.testing.assert_frame_equal(
+            pair.dropna(axis=1, how="all"), pair_distances, check_index_type=False
+        )
+    assert list(read.columns) == ["A45OG_L1C1", "A90NE2_L1O2", "A45OG_L2C4"]
+
+
+def test_partition_filters(distances):
+    docking_folder, _ = distances
+
+    read = docking_utils.readDockingDistances(docking_folder, models=["P1"], ligands=["L1"])
+    assert set(read.index.droplevel("Pose")) == {("P1", "L1")}
+    assert list(read.columns) == ["A45OG_L1C1", "A90NE2_L1O2"]
+
+    long_form = docking_utils.readDockingDistances(docking_folder, ligands=["L2"], long_form=True)
+    assert list(long_form.columns) == ["Protein", "Ligand", "Pose", "Distance", "Value"]
+    assert len(long_form) == 3
+
+    assert docking_utils.readDockingDistances(str(os.path.dirname(docking_folder))).empty
+
+
+def test_rewrite_replaces_partitions(distances):
+    docking_folder, written = distances
+
+    docking_utils.writeDockingDistances(docking_folder, [_pairDistances("P1", "L1", 1, seed=3)])
+
+    read = docking_utils.readDockingDistances(docking_folder)
+    assert len(read.xs(("P1", "L1"), level=["Protein", "Ligand"])) == 1
+    assert len(read.xs(("P2", "L1"), level=["Protein", "Ligand"])) == len(written[2])
+
+
+def test_load_docking_distances(distances):
+    docking_folder, written = distances
+    models = types.SimpleNamespace(
+        models_names=["P1"], docking_distances={}, docking_ligands={"P1": ["L1"]}
+    )
+
+    docking_utils.loadDockingDistances(models, docking_folder)
+
+    assert list(models.docking_distances) == ["P1"]
+    assert models.docking_ligands == {"P1": ["L1", "L2"]}
+    pd.testing.assert_frame_equal(
+        models.docking_distances["P1"]["L2"], written[1], check_index_type=False
+    )
+
+
+def test_convert_csvs(tmp_path):
+    docking_folder = str(tmp_path)
+    csv_folder = os.path.join(docking_folder, ".analysis", "atom_pairs")
+    os.makedirs(csv_folder)
+    written = [_pairDistances("P1", "L1"), _pairDistances("P2", "L1", seed=1)]
+    for pair_distances in written:
+        model, ligand, _ = pair_distances.index[0]
+        pair_distances.reset_index(["Protein", "Ligand"], drop=True).to_csv(
+            os.path.join(csv_folder, f"{model}-{ligand}.csv")
+        )
+
+    assert docking_utils.convertDockingDistanceCSVs(docking_folder) == 2
+    assert not os.path.exists(csv_folder)
+    pd.testing.assert_frame_equal(
+        docking_utils.readDockingDistances(docking_folder),
+        pd.concat(written),
+        check_index_type=False,
+    )
+    assert docking_utils.convertDockingDistanceCSVs(docking_folder) == 0
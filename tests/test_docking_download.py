@@ -0,0 +1,56 @@
+"""
+Tests of the download of the remote docking analysis results
+"""
+
+import os
+import types
+
+import pandas as pd
+
+import docking_utils
+from conftest import LocalRemote
+
+
+def _writeFile(path, content=""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def test_download_docking_analysis(tmp_path, monkeypatch):
+    remote_folder = str(tmp_path / "remote" / "docking")
+    docking_folder = str(tmp_path / "local" / "docking")
+    monkeypatch.chdir(tmp_path)
+
+    data = pd.DataFrame({"Protein": ["P1"], "Ligand": ["L1"], "Pose": [1], "Score": [-7.5]})
+    os.makedirs(os.path.join(remote_folder, ".analysis"))
+    data.to_csv(os.path.join(remote_folder, ".analysis", "docking_data.csv"), index=False)
+    _writeFile(os.path.join(remote_folder, ".analysis", "atom_pairs", "P1-L1.csv"), "new")
+    _writeFile(os.path.join(remote_folder, "output_models", "P1", "P1-L1_pv.mae"), "pose")
+    _writeFile(os.path.join(remote_folder, "output_models", "P1", "P1-L1.log"), "log")
+
+    # Distances of a previous run, replaced by the remote ones
+    _writeFile(os.path.join(docking_folder, ".analysis", "atom_pairs", "P2-L1.csv"), "old")
+
+    remote = LocalRemote()
+    docking_utils.downloadDockingAnalysis(
+        types.SimpleNamespace(remote=remote), remote_folder, docking_folder
+    )
+
+    # Only the analysis results are transferred, without the missing failed dockings
+    local_files = sorted(
+        os.path.relpath(os.path.join(root, name), docking_folder)
+        for root, _, names in os.walk(docking_folder)
+        for name in names
+    )
+    assert local_files == [
+        os.path.join(".analysis", "atom_pairs", "P1-L1.csv"),
+        os.path.join(".analysis", "docking_data.csv"),
+    ]
+    pd.testing.assert_frame_equal(
+        pd.read_csv(os.path.join(docking_folder, ".analysis", "docking_data.csv")), data
+    )
+
+    # The archives are cleaned up on both sides
+    assert not os.path.exists(remote_folder + "_analysis.tar.gz")
+    assert sorted(os.listdir(tmp_path)) == ["local", "remote"]
@@ -0,0 +1,154 @@
+"""
+Tests of the extraction of the docking poses and its index
+"""
+
+import json
+import os
+import stat
+import subprocess
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+import docking_utils
+from conftest import LocalRemote
+
+# Stand-in of the Schrödinger extraction script, writing the pose files of its chunk
+# except for the proteins in SKIP_PROTEINS, and failing for those in FAIL_PROTEINS
+_EXTRACT_SCRIPT = """
+import csv
+import os
+import sys
+
+separator = sys.argv[sys.argv.index("--separator") + 1]
+skip = os.environ.get("SKIP_PROTEINS", "").split(",")
+fail = os.environ.get("FAIL_PROTEINS", "").split(",")
+with open(sys.argv[1]) as f:
+    for row in csv.DictReader(f):
+        if row["Protein"] in fail:
+            sys.exit(1)
+        if row["Protein"] in skip:
+            continue
+        name = separator.join([row["Protein"], row["Ligand"], row["Pose"]])
+        with open(os.path.join(row["Protein"], name + ".pdb"), "w") as pose:
+            pose.write("END\\n")
+"""
+
+
+def test_read_extraction_index_scans_legacy_folders(tmp_path):
+    output_folder = str(tmp_path)
+    for model, file in (("P1", "P1-L1-1.pdb"), ("P1", "P1-L2-3.pdb"), ("P2", "P2-L1-2.pdb")):
+        os.makedirs(tmp_path / model, exist_ok=True)
+        (tmp_path / model / file).write_text("END\n")
+    (tmp_path / "P1" / "notes.txt").write_text("")
+    (tmp_path / "summary.csv").write_text("")
+
+    index = docking_utils.readExtractionIndex(output_folder)
+
+    assert index == {
+        os.path.join("P1", "P1-L1-1.pdb"): ["P1", "L1", 1],
+        os.path.join("P1", "P1-L2-3.pdb"): ["P1", "L2", 3],
+        os.path.join("P2", "P2-L1-2.pdb"): ["P2", "L1", 2],
+    }
+    with open(tmp_path / docking_utils.EXTRACTION_INDEX_FILE, encoding="utf-8") as f:
+        assert json.load(f) == {"separator": "-", "poses": index}
+
+    # The index is read instead of scanning the folder again
+    (tmp_path / "P2" / "P2-L2-1.pdb").write_text("END\n")
+    assert docking_utils.readExtractionIndex(output_folder) == index
+
+
+def test_update_extraction_index(tmp_path):
+    output_folder = str(tmp_path / "poses")
+
+    docking_utils.updateExtractionIndex(output_folder, ["P1/P1_L1_1.pdb"], separator="_")
+    index = docking_utils.updateExtractionIndex(
+        output_folder, ["P2/P2_L1_best.pdb", "P2/P2.pdb", "P1/P1_L1_1.pdb"], separator="_"
+    )
+
+    assert index == {"P1/P1_L1_1.pdb": ["P1", "L1", 1], "P2/P2_L1_best.pdb": ["P2", "L1", None]}
+    assert docking_utils.readExtractionIndex(output_folder, separator="_") == index
+
+
+@pytest.fixture
+def extraction(tmp_path, monkeypatch):
+    pytest.importorskip("HorusAPI")
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "EAPM", "Include", "Blocks"))
+    import analyse_glide_docking  # pylint: disable=import-outside-toplevel
+
+    def copyScriptFile(output_folder, script_name, **kwargs):
+        with open(os.path.join(output_folder, f"._{script_name}"), "w", encoding="utf-8") as f:
+            f.write(_EXTRACT_SCRIPT)
+
+    monkeypatch.setattr(analyse_glide_docking, "_copyScriptFile", copyScriptFile)
+
+    # The Schrödinger run wrapper, running the script with this interpreter
+    schrodinger = tmp_path / "schrodinger"
+    schrodinger.mkdir()
+    (schrodinger / "run").write_text(f'#!/bin/sh\nexec {sys.executable} "$@"\n')
+    (schrodinger / "run").chmod(stat.S_IRWXU)
+    monkeypatch.setenv("SCHRODINGER", str(schrodinger))
+
+    block = types.SimpleNamespace(
+        remote=LocalRemote(), extraData={"remote_folder": str(tmp_path / "remote")}
+    )
+    models = types.SimpleNamespace(docking_ligands={"P1": ["L1", "L2"], "P2": ["L1"]})
+    docking_data = pd.DataFrame(
+        {"Score": [-8.0, -7.0, -6.0, -5.0]},
+        index=pd.MultiIndex.from_tuples(
+            [("P1", "L1", 2), ("P1", "L2", 1), ("P2", "L1", 4), ("P2", "L1", 5)],
+            names=["Protein", "Ligand", "Pose"],
+        ),
+    )
+
+    def extract(**kwargs):
+        return analyse_glide_docking.extractDockingPoses(
+            block,
+            models,
+            docking_data,
+            str(tmp_path / "docking"),
+            str(tmp_path / "poses"),
+            covalent_check=False,
+            processes=2,
+            **kwargs,
+        )
+
+    return extract, str(tmp_path / "poses"), str(tmp_path / "remote")
+
+
+def test_extract_docking_poses(extraction):
+    extract, output_folder, remote_folder = extraction
+
+    extract()
+
+    assert docking_utils.readExtractionIndex(output_folder) == {
+        "P1/P1-L1-2.pdb": ["P1", "L1", 2],
+        "P1/P1-L2-1.pdb": ["P1", "L2", 1],
+        "P2/P2-L1-4.pdb": ["P2", "L1", 4],
+        "P2/P2-L1-5.pdb": ["P2", "L1", 5],
+    }
+    assert os.path.exists(os.path.join(output_folder, "P2", "P2-L1-5.pdb"))
+    assert not os.path.exists(os.path.join(output_folder, "._extraction"))
+    assert not os.path.exists(remote_folder)
+
+
+def test_failed_chunk(extraction, monkeypatch):
+    extract, output_folder, _ = extraction
+    monkeypatch.setenv("FAIL_PROTEINS", "P2")
+
+    # The stand-in remote raises when the command exits non-zero
+    with pytest.raises(subprocess.CalledProcessError) as error:
+        extract()
+    assert "An extraction chunk failed" in error.value.stdout
+    assert not os.path.exists(os.path.join(output_folder, docking_utils.EXTRACTION_INDEX_FILE))
+
+
+def test_missing_poses(extraction, monkeypatch):
+    extract, output_folder, _ = extraction
+    monkeypatch.setenv("SKIP_PROTEINS", "P1")
+
+    with pytest.raises(ValueError, match="2 of 4 poses were not extracted"):
+        extract()
+    assert not os.path.exists(os.path.join(output_folder, docking_utils.EXTRACTION_INDEX_FILE))
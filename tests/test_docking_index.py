@@ -0,0 +1,86 @@
+"""
+Tests of the SQLite index of the analysed docking poses
+"""
+
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+import docking_utils
+
+
+def _dockingData(scores, metric):
+    index = pd.MultiIndex.from_tuples(
+        [("P1", "L1", pose) for pose in range(1, len(scores) + 1)],
+        names=["Protein", "Ligand", "Pose"],
+    )
+    return pd.DataFrame({"Score": scores, "metric_SG_S": metric}, index=index)
+
+
+def test_index_and_query(tmp_path):
+    index_path = str(tmp_path / "index.sqlite")
+    poses_folder = tmp_path / "best_docking_poses"
+    (poses_folder / "P1").mkdir(parents=True)
+    (poses_folder / "P1" / "P1-L1-2.pdb").write_text("END\n")
+
+    docking_utils.indexDockingResults(
+        _dockingData([-5.0, -7.0, -6.0], [3.0, 2.0, 9.0]),
+        str(tmp_path / "docking_a"),
+        poses_folder=str(poses_folder),
+        index_path=index_path,
+    )
+    docking_utils.indexDockingResults(
+        _dockingData([-8.0], [4.0]), str(tmp_path / "docking_b"), index_path=index_path
+    )
+
+    poses = docking_utils.queryDockingIndex(top_k=2, index_path=index_path)
+    assert list(poses["Run"]) == ["docking_b", "docking_a"]
+    assert list(poses["Score"]) == [-8.0, -7.0]
+    assert poses["File"].isna().iloc[0]
+    assert poses["File"].iloc[1] == os.path.abspath(poses_folder / "P1" / "P1-L1-2.pdb")
+
+    poses = docking_utils.queryDockingIndex(
+        metric="metric_SG_S", max_value=3.5, index_path=index_path
+    )
+    assert list(poses["Score"]) == [-7.0, -5.0]
+    assert list(poses["Metric"]) == [2.0, 3.0]
+
+    # Analysing a folder again replaces its poses
+    docking_utils.indexDockingResults(
+        _dockingData([-4.0], [1.0]), str(tmp_path / "docking_a"), index_path=index_path
+    )
+    poses = docking_utils.queryDockingIndex(index_path=index_path)
+    assert sorted(zip(poses["Run"], poses["Score"])) == [("docking_a", -4.0), ("docking_b", -8.0)]
+
+
+def test_concurrent_writers(tmp_path):
+    index_path = str(tmp_path / "index.sqlite")
+    errors = []
+
+    def index(i):
+        try:
+            docking_utils.indexDockingResults(
+                _dockingData([-float(i)] * 200, [1.0] * 200),
+                str(tmp_path / f"docking_{i}"),
+                index_path=index_path,
+            )
+        except sqlite3.Error as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=index, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    poses = docking_utils.queryDockingIndex(top_k=10000, index_path=index_path)
+    assert len(poses) == 8 * 200
+
+    connection = sqlite3.connect(index_path)
+    try:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    finally:
+        connection.close()
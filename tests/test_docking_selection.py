@@ -0,0 +1,92 @@
+"""
+Tests of the best docking pose selection and the docking metrics
+"""
+
+import numpy as np
+import pandas as pd
+
+import docking_utils
+
+
+def _dockingData(n_models=6, n_ligands=3, n_poses=8, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [
+            [f"P{m}" for m in range(n_models)],
+            [f"L{l}" for l in range(n_ligands)],
+            range(1, n_poses + 1),
+        ],
+        names=["Protein", "Ligand", "Pose"],
+    )
+    data = pd.DataFrame(
+        {
+            "Score": rng.uniform(-10, -2, len(index)).round(2),
+            "metric_a": rng.uniform(2.5, 7, len(index)),
+            "metric_b": rng.uniform(2.5, 6, len(index)),
+        },
+        index=index,
+    )
+    data.loc[data.sample(frac=0.1, random_state=0).index, "metric_b"] = np.nan
+    return data
+
+
+def referenceSelection(data, metrics, min_threshold=3.5, max_threshold=5.0, step_size=0.1):
+    # The iterative selection of prepare_proteins
+    thresholds = np.arange(min_threshold, max_threshold + (step_size / 10), step_size)
+    selected = []
+    for _, pair in data.groupby(level=["Protein", "Ligand"], sort=False):
+        for threshold in thresholds:
+            passing = pair[(pair[metrics] <= threshold).all(axis=1)]
+            if not passing.empty:
+                selected.append(passing["Score"].idxmin())
+                break
+    return data.loc[selected]
+
+
+def test_select_best_docking_poses():
+    data = _dockingData()
+
+    for metrics, thresholds in (
+        (["metric_a", "metric_b"], {}),
+        (["metric_a"], {"min_threshold": 3.0, "max_threshold": 4.0, "step_size": 0.25}),
+    ):
+        best = docking_utils.selectBestDockingPoses(data, metrics, **thresholds)
+        reference = referenceSelection(data, metrics, **thresholds)
+        assert len(reference) > 0
+        pd.testing.assert_frame_equal(best.sort_index(), reference.sort_index())
+
+
+def test_select_without_passing_poses():
+    data = _dockingData(n_models=1, n_ligands=1)
+    data["metric_a"] = 9.0
+
+    assert docking_utils.selectBestDockingPoses(data, ["metric_a"]).empty
+
+
+def test_combine_docking_metrics():
+    distances = pd.DataFrame(
+        [
+            ("P1", "L1", 1, "d1", 3.0),
+            ("P1", "L1", 1, "d2", 2.0),
+            ("P1", "L1", 2, "d1", 4.0),
+            ("P1", "L1", 2, "d2", 5.0),
+            ("P2", "L1", 1, "d3", 6.0),
+        ],
+        columns=["Protein", "Ligand", "Pose", "Distance", "Value"],
+    )
+
+    metrics = docking_utils.combineDockingMetrics(distances, ["all"])
+    assert metrics["metric_all"].tolist() == [2.0, 4.0, 6.0]
+
+    metrics = docking_utils.combineDockingMetrics(
+        distances,
+        {
+            "first": {"P1": {"L1": ["d1"]}, "P2": {"L1": ["d3"]}},
+            "second": {"P1": {"L1": ["d2"]}},
+        },
+    )
+    assert list(metrics.columns) == ["metric_first", "metric_second"]
+    assert metrics.loc[("P1", "L1", 1)].tolist() == [3.0, 2.0]
+    assert metrics.loc[("P1", "L1", 2)].tolist() == [4.0, 5.0]
+    assert metrics.loc[("P2", "L1", 1), "metric_first"] == 6.0
+    assert np.isnan(metrics.loc[("P2", "L1", 1), "metric_second"])
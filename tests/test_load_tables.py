@@ -0,0 +1,207 @@
+"""
+Tests of the endpoints of the table page
+"""
+
+import gzip
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("HorusAPI")
+flask = pytest.importorskip("flask")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "EAPM", "Include", "Pages"))
+
+import load_tables  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def client():
+    app = flask.Flask(__name__)
+    app.add_url_rule("/table", view_func=load_tables.load_table_page)
+    app.add_url_rule("/load_table", view_func=load_tables.load_html)
+    app.add_url_rule("/load", view_func=load_tables.load_html)
+    load_tables._table_cache.clear()
+    return app.test_client()
+
+
+@pytest.fixture
+def table_path(tmp_path):
+    table = pd.DataFrame(
+        {
+            "Protein": ["P1"] * 5 + ["P2"] * 5,
+            "Score": [float(-i) for i in range(10)],
+            "metric_SG_S": [None] + [float(i) for i in range(9)],
+        }
+    )
+    path = str(tmp_path / "docking_results.parquet")
+    table.to_parquet(path, index=False)
+    return path
+
+
+def test_table_page(client, table_path):
+    page = client.get("/table", query_string={"path": table_path, "limit": 3}).get_json()
+
+    assert page["columns"] == ["Protein", "Score", "metric_SG_S"]
+    assert page["total"] == 10
+    assert page["rows"] == [["P1", 0.0, None], ["P1", -1.0, 0.0], ["P1", -2.0, 1.0]]
+
+
+def test_sorted_and_filtered_page(client, table_path):
+    filters = [
+        {"column": "Score", "op": "<=", "value": "-3"},
+        {"column": "Protein", "op": "contains", "value": "p2"},
+    ]
+    page = client.get(
+        "/table",
+        query_string={
+            "path": table_path,
+            "sort": "Score",
+            "ascending": "true",
+            "offset": 1,
+            "limit": 2,
+            "filters": json.dumps(filters),
+        },
+    ).get_json()
+
+    assert page["total"] == 5
+    assert page["offset"] == 1
+    assert [row[1] for row in page["rows"]] == [-8.0, -7.0]
+
+
+def test_page_size_is_clamped(client, table_path):
+    page = client.get("/table", query_string={"path": table_path, "limit": 0}).get_json()
+    assert len(page["rows"]) == 1
+
+    page = client.get("/table", query_string={"path": table_path, "limit": -5}).get_json()
+    assert len(page["rows"]) == 1
+
+
+def test_table_cache_from_threads(client, table_path, tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.setattr(load_tables, "_TABLE_CACHE_SIZE", 2)
+    paths = [table_path]
+    for i in range(3):
+        paths.append(str(tmp_path / f"table_{i}.csv"))
+        pd.DataFrame({"Score": [float(j) for j in range(i + 1)]}).to_csv(paths[-1], index=False)
+
+    def total(path):
+        return client.get("/table", query_string={"path": path}).get_json()["total"]
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        totals = list(executor.map(total, paths * 10))
+
+    assert totals == [10, 1, 2, 3] * 10
+    assert len(load_tables._table_cache) <= 2
+
+
+def test_rewritten_table_is_read_again(client, table_path):
+    client.get("/table", query_string={"path": table_path})
+    pd.DataFrame({"Score": [1.0]}).to_parquet(table_path, index=False)
+
+    page = client.get("/table", query_string={"path": table_path}).get_json()
+    assert page["total"] == 1
+
+
+def test_invalid_table_requests(client, table_path):
+    response = client.get("/table", query_string={"path": table_path, "sort": "Missing"})
+    assert response.status_code == 400
+
+    response = client.get("/table", query_string={"path": table_path + ".missing"})
+    assert response.status_code == 404
+
+
+@pytest.fixture
+def html_path(tmp_path):
+    path = tmp_path / "report.html"
+    path.write_text("<p>" + "pose " * 1000 + "</p>")
+    return str(path)
+
+
+def _content(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _load(client, path, **headers):
+    # Buffer the body and close the response, so the served file is closed
+    response = client.get("/load", query_string={"path": path}, headers=headers)
+    response.get_data()
+    response.close()
+    return response
+
+
+def test_load_file_with_etag(client, html_path):
+    response = _load(client, html_path)
+
+    assert response.status_code == 200
+    assert response.data == _content(html_path)
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+    etag = response.headers["ETag"]
+    assert _load(client, html_path, **{"If-None-Match": etag}).status_code == 304
+
+    # A modified file gets a new tag
+    with open(html_path, "a", encoding="utf-8") as f:
+        f.write("<p>new</p>")
+    response = _load(client, html_path, **{"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_load_gzip(client, html_path):
+    response = _load(client, html_path, **{"Accept-Encoding": "gzip, deflate"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(response.data) == _content(html_path)
+
+    etag = response.headers["ETag"]
+    assert etag.endswith('-gz"')
+    assert etag != _load(client, html_path).headers["ETag"]
+    response = _load(client, html_path, **{"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+
+
+def test_load_gzip_sibling(client, html_path):
+    with gzip.open(html_path + ".gz", "wb") as f:
+        f.write(b"precompressed")
+
+    response = _load(client, html_path, **{"Accept-Encoding": "gzip"})
+    assert gzip.decompress(response.data) == b"precompressed"
+
+    # A sibling older than the file is ignored
+    stat = os.stat(html_path)
+    os.utime(html_path + ".gz", ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+    response = _load(client, html_path, **{"Accept-Encoding": "gzip"})
+    assert gzip.decompress(response.data) == _content(html_path)
+
+
+def test_load_uncompressed_files(client, html_path, tmp_path):
+    small = tmp_path / "small.html"
+    small.write_text("<p>small</p>")
+    image = tmp_path / "plot.png"
+    image.write_bytes(b"\x89PNG" + bytes(4096))
+
+    for path in (str(small), str(image)):
+        response = _load(client, path, **{"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert "Content-Encoding" not in response.headers
+        assert response.data == _content(path)
+
+    # Ranges are served from the plain file
+    response = _load(client, html_path, **{"Accept-Encoding": "gzip", "Range": "bytes=0-9"})
+    assert response.status_code == 206
+    assert "Content-Encoding" not in response.headers
+    assert response.data == _content(html_path)[:10]
+
+
+def test_load_missing_file(client, html_path):
+    assert _load(client, html_path + ".missing").status_code == 404
+    assert client.get("/load").status_code == 404
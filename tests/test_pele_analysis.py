@@ -0,0 +1,263 @@
+"""
+Tests of the Analyse PELE steps around pele_analysis
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pele_utils
+
+
+class PELEAnalysis:
+    """
+    Stand-in for pele_analysis.peleAnalysis over the data of a PELE folder.
+    """
+
+    def __init__(self, data):
+        self.data = data.copy()
+        self.proteins = sorted(set(data.index.get_level_values("Protein")))
+        self.ligands = sorted(set(data.index.get_level_values("Ligand")))
+        self.landscapes = 0
+
+    def getDistances(self, protein, ligand):
+        pair = self.data.xs((protein, ligand), level=["Protein", "Ligand"])
+        columns = [c for c in pair if c.startswith("distance_") and pair[c].notna().any()]
+        return columns or None
+
+    def combineDistancesIntoMetrics(self, catalytic_labels, overwrite=False):
+        for metric, proteins in catalytic_labels.items():
+            values = pd.Series(np.nan, index=self.data.index)
+            for protein, ligands in proteins.items():
+                for ligand, distances in ligands.items():
+                    mask = (self.data.index.get_level_values("Protein") == protein) & (
+                        self.data.index.get_level_values("Ligand") == ligand
+                    )
+                    if distances:
+                        values[mask] = self.data.loc[mask, distances].min(axis=1)
+            self.data["metric_" + metric] = values
+
+    def bindingEnergyLandscape(self):
+        self.landscapes += 1
+
+
+def _readPELEAnalysis(data, calls):
+    def read(pele_folder, data_folder=pele_utils.PELE_DATA_FOLDER, energy_by_residue=False):
+        calls.append(PELEAnalysis(data))
+        return calls[-1]
+
+    return read
+
+
+def test_report_cache_follows_the_reports(pele_folder, monkeypatch):
+    folder, data = pele_folder
+    calls = []
+    monkeypatch.setattr(pele_utils, "readPELEAnalysis", _readPELEAnalysis(data, calls))
+
+    report_cache = pele_utils.getReportCache(folder)
+    assert len(calls) == 1 and report_cache.isUpToDate()
+
+    # Unchanged reports are not read again
+    pele_utils.getReportCache(folder)
+    assert len(calls) == 1
+
+    # A line appended to a report is parsed alone and added to the cache
+    report = os.path.join(folder, "P1-L1", "output", "0", "report_1")
+    with open(report, "a") as f:
+        f.write("1    5    5    -40.0    3.0\n1    6    6    -41.0    2.0")
+    assert not pele_utils.PELEReportCache(folder).isUpToDate()
+    report_cache = pele_utils.getReportCache(folder)
+    assert len(calls) == 1 and len(report_cache) == len(data) + 1
+    row = report_cache.getData(["Binding Energy", "distance_A10OG_L1C1", "Total Energy"])
+    row = row.loc[("P1", "L1", 0, 1, 5)]
+    assert row["Binding Energy"] == -40.0 and row["distance_A10OG_L1C1"] == 3.0
+    assert np.isnan(row["Total Energy"])
+    assert report_cache.getPairRows()[("P1", "L1")].size == len(data.loc["P1"]) + 1
+
+    # The unfinished line is added once it is complete, and a new report is read
+    with open(report, "a") as f:
+        f.write("\n")
+    new_report = os.path.join(folder, "P2-L1", "output", "2", "report_1")
+    os.makedirs(os.path.dirname(new_report))
+    with open(new_report, "w") as f:
+        f.write("#Task    Step    numberOfAcceptedPeleSteps    Binding Energy\n")
+        f.write("1    0    0    -30.0\n")
+    report_cache = pele_utils.getReportCache(folder)
+    assert len(calls) == 1 and len(report_cache) == len(data) + 3
+    assert report_cache.isUpToDate()
+    epochs = report_cache.getData(["Binding Energy"]).reset_index()
+    assert epochs.query("Protein == 'P2' and Epoch == 2")["Binding Energy"].tolist() == [-30.0]
+
+    # A removed or rewritten report needs pele_analysis again
+    os.remove(report)
+    assert not pele_utils.PELEReportCache(folder).isUpToDate()
+    pele_utils.getReportCache(folder)
+    assert len(calls) == 2
+
+    with open(new_report, "w") as f:
+        f.write("#Task    Step    numberOfAcceptedPeleSteps    Binding Energy\n")
+    pele_utils.getReportCache(folder)
+    assert len(calls) == 3
+
+
+def test_analyse_pele_folder(pele_folder, tmp_path, monkeypatch):
+    folder, data = pele_folder
+    rules = tmp_path / "rules.yaml"
+    rules.write_text("- metric: SG_S\n  atom1: OG\n  atom2: C1\n")
+    monkeypatch.setattr(pele_utils, "readPELEAnalysis", _readPELEAnalysis(data, []))
+
+    output = str(tmp_path / "output")
+    report_cache = pele_utils.analysePELEFolder(
+        folder,
+        output_folder=output,
+        rules_path=str(rules),
+        landscape_mode="binned",
+        landscape_bins=5,
+    )
+
+    # The metric combines the distance of each pair, with the pele_analysis column names
+    metric = report_cache.getColumn("metric_SG_S")
+    expected = data["distance_A10OG_L1C1"].fillna(data["distance_A20OG_L1C1"])
+    np.testing.assert_allclose(metric, expected.to_numpy())
+    assert "distance_A10OG_L1C1" in report_cache.columns
+
+    summary = pd.read_csv(os.path.join(output, "pele_summary.csv"))
+    assert list(summary["Protein"]) == ["P1", "P2"]
+    assert np.allclose(summary["Best SG_S"], expected.groupby(level="Protein").min().to_numpy())
+    assert sorted(os.listdir(os.path.join(output, "pele_plots"))) == [
+        "P1-L1.json",
+        "P1-L1.png",
+        "P2-L1.json",
+        "P2-L1.png",
+    ]
+
+
+def test_scatter_landscapes_are_drawn_by_pele_analysis(pele_folder, tmp_path, monkeypatch):
+    folder, data = pele_folder
+    calls = []
+    monkeypatch.setattr(pele_utils, "readPELEAnalysis", _readPELEAnalysis(data, calls))
+
+    output = str(tmp_path / "output")
+    pele_utils.analysePELEFolder(folder, output_folder=output)
+
+    assert calls[0].landscapes == 1
+    assert not os.path.exists(os.path.join(output, "pele_plots"))
+    assert os.path.exists(os.path.join(output, "pele_best_steps.csv"))
+
+
+def test_pele_summary(pele_folder, tmp_path):
+    folder, data = pele_folder
+    data = data.assign(metric_SG_S=data["Total Energy"] % 3)
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    output = str(tmp_path / "output")
+    pele_utils.writePELESummary(report_cache, output, top_k=3)
+
+    summary = pd.read_csv(os.path.join(output, "pele_summary.csv")).set_index("Protein")
+    pairs = data.groupby(level="Protein")
+    assert summary["Steps"].to_dict() == pairs.size().to_dict()
+    assert np.allclose(summary["Best Binding Energy"], pairs["Binding Energy"].min())
+    assert np.allclose(summary["Mean Binding Energy"], pairs["Binding Energy"].mean())
+    assert np.allclose(summary["Best SG_S"], pairs["metric_SG_S"].min())
+
+    # The top_k best binding energy steps of every pair, with the metrics
+    best_steps = pd.read_csv(os.path.join(output, "pele_best_steps.csv"))
+    assert list(best_steps.columns[-2:]) == ["Binding Energy", "metric_SG_S"]
+    for protein, pair in best_steps.groupby("Protein"):
+        expected = pairs.get_group(protein)["Binding Energy"].nsmallest(3)
+        assert np.allclose(np.sort(pair["Binding Energy"]), np.sort(expected))
+
+
+def test_up_to_date_cache_skips_pele_analysis(pele_folder, tmp_path, monkeypatch):
+    folder, data = pele_folder
+    rules = tmp_path / "rules.yaml"
+    rules.write_text("- metric: SG_S\n  atom1: OG\n  atom2: C1\n")
+    calls = []
+    monkeypatch.setattr(pele_utils, "readPELEAnalysis", _readPELEAnalysis(data, calls))
+
+    output = str(tmp_path / "output")
+    first = pele_utils.analysePELEFolder(folder, output_folder=output, rules_path=str(rules))
+    metric = np.array(first.getColumn("metric_SG_S"))
+
+    # The second run reads the cache, and draws the scatter landscapes from it
+    second = pele_utils.analysePELEFolder(folder, output_folder=output, rules_path=str(rules))
+    assert len(calls) == 1 and calls[0].landscapes == 1
+    np.testing.assert_array_equal(second.getColumn("metric_SG_S"), metric)
+    assert sorted(os.listdir(os.path.join(output, "pele_plots"))) == ["P1-L1.png", "P2-L1.png"]
+
+    # Other rules, or the energy by residue columns, need pele_analysis again
+    rules.write_text("- metric: OG\n  atom1: OG\n")
+    report_cache = pele_utils.analysePELEFolder(
+        folder, output_folder=output, rules_path=str(rules)
+    )
+    assert len(calls) == 2
+    assert "metric_OG" in report_cache.columns and "metric_SG_S" not in report_cache.columns
+
+    pele_utils.analysePELEFolder(
+        folder, output_folder=output, rules_path=str(rules), energy_by_residue="best_k"
+    )
+    assert len(calls) == 3
+
+
+def test_report_cache_keeps_the_metrics(pele_folder, tmp_path, monkeypatch):
+    folder, data = pele_folder
+    calls = []
+    monkeypatch.setattr(pele_utils, "readPELEAnalysis", _readPELEAnalysis(data, calls))
+    pele_utils.analysePELEFolder(folder, output_folder=str(tmp_path))
+
+    # The metrics of the steps of a new report are combined with the stored rules
+    os.makedirs(os.path.join(folder, "P1-L1", "output", "2"))
+    with open(os.path.join(folder, "P1-L1", "output", "2", "report_1"), "w") as f:
+        f.write("#Task    Step    numberOfAcceptedPeleSteps    Binding Energy    ")
+        f.write("distance_A10OG_L1C1\n1    0    0    -30.0    2.5\n")
+
+    report_cache = pele_utils.getReportCache(folder)
+    assert len(calls) == 1
+    assert report_cache.isUpToDate(pele_utils.readDistanceRules())
+    metrics = report_cache.getData(["metric_SER-L"])["metric_SER-L"].sort_index()
+    assert metrics.loc[("P1", "L1", 2, 1, 0)] == 2.5
+    np.testing.assert_array_equal(
+        metrics.loc[("P1", "L1", 0)].to_numpy(),
+        data.loc[("P1", "L1", 0)]["distance_A10OG_L1C1"].to_numpy(),
+    )
+
+    # A distance a pair did not have before is combined into the metric of all its steps
+    os.makedirs(os.path.join(folder, "P2-L1", "output", "2"))
+    with open(os.path.join(folder, "P2-L1", "output", "2", "report_1"), "w") as f:
+        f.write("#Task    Step    numberOfAcceptedPeleSteps    Binding Energy    ")
+        f.write(
+            "distance_A20OG_L1C1    distance_A21OG_L1C1\n1    0    0    -30.0    4.0    1.5\n"
+        )
+
+    report_cache = pele_utils.getReportCache(folder)
+    assert len(calls) == 1
+    metrics = report_cache.getData(["metric_SER-L"])["metric_SER-L"].sort_index()
+    assert metrics.loc[("P2", "L1", 2, 1, 0)] == 1.5
+    np.testing.assert_array_equal(
+        metrics.loc[("P2", "L1", 0)].to_numpy(),
+        data.loc[("P2", "L1", 0)]["distance_A20OG_L1C1"].to_numpy(),
+    )
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_report_cache_update_processes(pele_folder, monkeypatch, processes):
+    folder, data = pele_folder
+    monkeypatch.setattr(pele_utils, "readPELEAnalysis", _readPELEAnalysis(data, []))
+    report_cache = pele_utils.PELEReportCache(folder, separator="-")
+    pele_utils.storePELEAnalysis(report_cache, rules=pele_utils.readDistanceRules())
+
+    # The reports of both pairs grow, each pair is parsed by its own process
+    for pair, distance in (("P1-L1", 1.0), ("P2-L1", 2.0)):
+        with open(os.path.join(folder, pair, "output", "1", "report_2"), "a") as f:
+            f.write(f"1    5    5    -60.0    {distance}\n")
+
+    report_cache = pele_utils.PELEReportCache(folder, separator="-")
+    assert report_cache.update(processes=processes) == 2
+    distances = report_cache.getData(["distance_A10OG_L1C1", "distance_A20OG_L1C1"])
+    assert distances.loc[("P1", "L1", 1, 2, 5), "distance_A10OG_L1C1"] == 1.0
+    assert distances.loc[("P2", "L1", 1, 2, 5), "distance_A20OG_L1C1"] == 2.0
+    metrics = report_cache.getData(["metric_SER-L"])["metric_SER-L"]
+    assert metrics.loc[("P2", "L1", 1, 2, 5)] == 2.0
@@ -0,0 +1,60 @@
+"""
+Tests of the clustering of the PELE ligand poses
+"""
+
+import os
+
+import mdtraj as md
+import numpy as np
+
+import pele_utils
+from conftest import writePELETrajectories
+
+
+def test_cluster_ligand_poses(pele_folder, tmp_path):
+    folder, data = pele_folder
+    sites = writePELETrajectories(folder)
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    output = str(tmp_path / "clusters")
+    clusters = pele_utils.clusterLigandPoses(
+        report_cache, "P1", "L1", output, threshold=1.0, chunk_size=3
+    )
+
+    # One cluster per ligand site, with the frames of the site
+    pair_sites = np.concatenate(
+        [s for (pair, _, _), s in sorted(sites.items()) if pair == "P1-L1"]
+    )
+    assert len(clusters) == 2
+    assert sorted(clusters["Size"]) == sorted(np.bincount(pair_sites))
+
+    pair = data.xs(("P1", "L1"), level=["Protein", "Ligand"])
+    assert clusters["Binding Energy"].iloc[0] == pair["Binding Energy"].min()
+    assert clusters["Binding Energy"].is_monotonic_increasing
+
+    # The representative is the best frame of its cluster
+    best = clusters.iloc[0]
+    representative = md.load(best["Representative"])
+    frame = md.load_frame(
+        os.path.join(
+            folder, "P1-L1", "output", str(best["Epoch"]), f"trajectory_{best['Trajectory']}.pdb"
+        ),
+        int(best["Accepted Pele Steps"]),
+    )
+    assert np.allclose(
+        representative.xyz[0, 4:] - representative.xyz[0, :4].mean(0),
+        frame.xyz[0, 4:] - frame.xyz[0, :4].mean(0),
+        atol=1e-3,
+    )
+    assert os.path.exists(os.path.join(output, "P1-L1", "clusters.csv"))
+
+
+def test_assign_leaders():
+    coordinates = np.array([[0.0, 0.0, 0.0], [0.5, 0.0, 0.0], [3.0, 0.0, 0.0], [0.2, 0.0, 0.0]])
+    leaders = np.empty((0, 3))
+
+    labels, leaders = pele_utils._assignLeaders(coordinates, leaders, 1, threshold=1.0)
+
+    assert list(labels) == [0, 0, 1, 0]
+    assert len(leaders) == 2
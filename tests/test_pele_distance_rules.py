@@ -0,0 +1,52 @@
+"""
+Tests of the rules grouping PELE distances into metrics
+"""
+
+import pytest
+
+import pele_utils
+
+
+def test_default_rules():
+    rules = pele_utils.readDistanceRules()
+    labels = pele_utils.classifyDistances(
+        [
+            "distance_A145OG_L1C1",
+            "distance_A145OG_A220NE2",
+            "distance_A220ND1_A190OD2",
+            "distance_A145CA_A220CA",
+            "Binding Energy",
+        ],
+        rules,
+    )
+
+    assert labels == {
+        "distance_A145OG_L1C1": "SER-L",
+        "distance_A145OG_A220NE2": "SER-HIS",
+        "distance_A220ND1_A190OD2": "HIS-ASP",
+    }
+
+
+def test_first_matching_rule_wins(tmp_path):
+    path = tmp_path / "rules.yaml"
+    path.write_text(
+        "- metric: any_ser\n  atom1: OG$\n"
+        "- metric: ser_ligand\n  atom1: OG$\n  atom2: ^L\n"
+        "- metric: by_column\n  column: CA_\n"
+    )
+    labels = pele_utils.classifyDistances(
+        ["distance_A1OG_L1C1", "distance_A1CA_A2CA"], pele_utils.readDistanceRules(str(path))
+    )
+
+    assert labels == {"distance_A1OG_L1C1": "any_ser", "distance_A1CA_A2CA": "by_column"}
+
+
+@pytest.mark.parametrize(
+    "content", ["metric: SER-L\n", "- atom1: OG$\n", "- metric: SER-L\n  other: x\n"]
+)
+def test_invalid_rules(tmp_path, content):
+    path = tmp_path / "rules.yaml"
+    path.write_text(content)
+
+    with pytest.raises(ValueError):
+        pele_utils.readDistanceRules(str(path))
@@ -0,0 +1,77 @@
+"""
+Tests of the energy by residue aggregation of the PELE report cache
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import pele_utils
+
+
+@pytest.fixture
+def report_cache(pele_folder):
+    folder, data = pele_folder
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+    return report_cache, data
+
+
+def test_energy_by_residue_columns():
+    columns = ["A:10_all", "A:11_lennard_jones", "B:-2A_all", "Binding Energy", "A:10_allx"]
+
+    assert pele_utils.getEnergyByResidueColumns(columns) == {
+        "A:10_all": "A:10",
+        "B:-2A_all": "B:-2A",
+    }
+    with pytest.raises(ValueError):
+        pele_utils.getEnergyByResidueColumns(columns, "unknown")
+
+
+def test_boltzmann_energy_by_residue(report_cache, tmp_path):
+    report_cache, data = report_cache
+    output = str(tmp_path / "energy")
+
+    means = pele_utils.aggregateEnergyByResidue(report_cache, output, chunk_size=3)
+
+    kt = pele_utils.BOLTZMANN_CONSTANT * 298.15
+    for (protein, ligand), pair in data.groupby(level=["Protein", "Ligand"]):
+        weights = np.exp(-(pair["Binding Energy"] - pair["Binding Energy"].min()) / kt)
+        values = pair[["A:10_all", "A:11_all"]].to_numpy()
+        mean = np.average(values, axis=0, weights=weights)
+        std = np.sqrt(np.average((values - mean) ** 2, axis=0, weights=weights))
+
+        assert np.allclose(means.loc[(protein, ligand)].to_numpy(), mean)
+        matrix = np.load(os.path.join(output, f"{protein}-{ligand}_all.npz"))
+        assert list(matrix["residues"]) == ["A:10", "A:11"]
+        assert list(matrix["statistics"]) == ["mean", "std", "min"]
+        assert np.allclose(matrix["matrix"][:, 0], mean)
+        assert np.allclose(matrix["matrix"][:, 1], std)
+        assert np.allclose(matrix["matrix"][:, 2], values.min(axis=0))
+
+    assert os.path.exists(os.path.join(output, "energy_by_residue_all.csv"))
+
+
+def test_best_k_energy_by_residue(report_cache, tmp_path):
+    report_cache, data = report_cache
+
+    means = pele_utils.aggregateEnergyByResidue(
+        report_cache, str(tmp_path / "energy"), mode="best_k", top_k=4
+    )
+
+    for (protein, ligand), pair in data.groupby(level=["Protein", "Ligand"]):
+        best = pair.sort_values("Binding Energy", kind="stable").head(4)
+        assert np.allclose(
+            means.loc[(protein, ligand)].to_numpy(), best[["A:10_all", "A:11_all"]].mean()
+        )
+
+
+def test_energy_by_residue_errors(report_cache, tmp_path):
+    report_cache, _ = report_cache
+
+    with pytest.raises(ValueError):
+        pele_utils.aggregateEnergyByResidue(report_cache, str(tmp_path), mode="mean")
+    assert pele_utils.aggregateEnergyByResidue(
+        report_cache, str(tmp_path), energy_type="sgb"
+    ).empty
@@ -0,0 +1,70 @@
+"""
+Tests of the binned binding energy landscapes
+"""
+
+import json
+import os
+
+import numpy as np
+
+import pele_utils
+
+
+def _reportCache(pele_folder):
+    folder, data = pele_folder
+    data = data.copy()
+    data["metric_SG_S"] = data["distance_A10OG_L1C1"].fillna(data["distance_A20OG_L1C1"])
+    # A step without metric is left out of the histogram
+    data.iloc[0, data.columns.get_loc("metric_SG_S")] = np.nan
+
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+    return report_cache, data
+
+
+def test_bin_landscape(pele_folder):
+    report_cache, data = _reportCache(pele_folder)
+    rows = report_cache.getPairRows()[("P1", "L1")]
+
+    x_edges, y_edges, counts, top_rows = pele_utils.binLandscape(
+        report_cache, rows, "metric_SG_S", bins=4, top_k=3
+    )
+    _, small_chunks_y, small_chunks_counts, small_chunks_top = pele_utils.binLandscape(
+        report_cache, rows, "metric_SG_S", bins=4, top_k=3, chunk_size=3
+    )
+
+    pair = data.xs(("P1", "L1"), level=["Protein", "Ligand"]).dropna(subset=["metric_SG_S"])
+    expected, _, _ = np.histogram2d(
+        pair["metric_SG_S"], pair["Binding Energy"], bins=[x_edges, y_edges]
+    )
+    np.testing.assert_array_equal(counts, expected)
+    assert counts.sum() == len(pair)
+    np.testing.assert_array_equal(small_chunks_counts, counts)
+    np.testing.assert_array_equal(small_chunks_y, y_edges)
+
+    energies = report_cache.getColumn("Binding Energy")
+    np.testing.assert_allclose(energies[top_rows], np.sort(pair["Binding Energy"])[:3])
+    np.testing.assert_array_equal(small_chunks_top, top_rows)
+
+
+def test_plot_landscapes(pele_folder, tmp_path):
+    report_cache, _ = _reportCache(pele_folder)
+    output = str(tmp_path / "plots")
+
+    plots = pele_utils.plotBindingEnergyLandscape(report_cache, output, bins=4, top_k=2)
+
+    assert plots == [os.path.join(output, "P1-L1.png"), os.path.join(output, "P2-L1.png")]
+    with open(os.path.join(output, "P2-L1.json")) as f:
+        tile = json.load(f)
+    landscape = tile["metrics"]["metric_SG_S"]
+    assert np.array(landscape["counts"]).shape == (4, 4)
+    assert len(landscape["top"]) == 2
+    assert landscape["top"][0]["binding_energy"] <= landscape["top"][1]["binding_energy"]
+
+
+def test_no_metrics(pele_folder, tmp_path):
+    folder, data = pele_folder
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    assert pele_utils.plotBindingEnergyLandscape(report_cache, str(tmp_path / "plots")) == []
@@ -0,0 +1,108 @@
+"""
+Tests of the Markov state models built from the PELE report cache
+"""
+
+import json
+import os
+
+import mdtraj as md
+import numpy as np
+
+import pele_utils
+from conftest import writePELETrajectories
+
+
+def referenceCounts(states, segments, lag, n_states):
+    counts = np.zeros((n_states, n_states), dtype=np.int64)
+    for i in range(len(states) - lag):
+        if segments[i] == segments[i + lag] and states[i] >= 0 and states[i + lag] >= 0:
+            counts[states[i], states[i + lag]] += 1
+    return counts
+
+
+def test_count_transitions():
+    rng = np.random.default_rng(0)
+    states = rng.integers(-1, 4, 200)
+    segments = np.repeat(np.arange(8), 25)
+
+    for lag in (1, 3, 10, 250):
+        assert np.array_equal(
+            pele_utils.countTransitions(states, segments, lag, 4),
+            referenceCounts(states, segments, lag, 4),
+        )
+
+
+def test_estimate_stationary():
+    counts = np.array([[8, 2], [2, 28]])
+
+    stationary, timescales = pele_utils._estimateStationary(counts, lag=2)
+
+    assert np.allclose(stationary, [0.25, 0.75])
+    # The second eigenvalue of the row normalised symmetric counts
+    eigenvalue = 1 - 4 / 20 - 4 / 60
+    assert np.allclose(timescales, [-2 / np.log(eigenvalue)])
+
+
+def test_build_markov_state_models(pele_folder, tmp_path):
+    folder, data = pele_folder
+    sites = writePELETrajectories(folder)
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    features = pele_utils.featuriseLigandCOM(report_cache, chunk_size=3)
+    output = str(tmp_path / "msm")
+    populations = pele_utils.buildMarkovStateModels(
+        report_cache, features, output, n_states=2, lag_times=(1, 2), chunk_size=7
+    )
+
+    for protein, ligand in (("P1", "L1"), ("P2", "L1")):
+        pair = f"{protein}-{ligand}"
+        rows = pele_utils.sortTrajectoryRows(
+            report_cache, report_cache.getPairRows()[(protein, ligand)]
+        )
+        expected = np.concatenate([s for (p, _, _), s in sorted(sites.items()) if p == pair])
+        states = report_cache.getColumn("msm_state")[rows].astype(int)
+
+        # The states are the ligand sites, up to the label order
+        if states[0] != expected[0]:
+            states = 1 - states
+        assert np.array_equal(states, expected)
+
+        segments = np.repeat(np.arange(4), 5)
+        with open(os.path.join(output, f"{pair}.json"), encoding="utf-8") as f:
+            model = json.load(f)
+        for lag in (1, 2):
+            counts = np.array(model["lag_times"][str(lag)]["counts"])
+            reference = referenceCounts(
+                report_cache.getColumn("msm_state")[rows].astype(int), segments, lag, 2
+            )
+            assert np.array_equal(counts, reference)
+
+        pair_populations = populations[(populations["Protein"] == protein)]
+        assert np.allclose(pair_populations.groupby("Lag")["Population"].sum(), 1.0)
+
+    assert os.path.exists(os.path.join(output, "stationary_populations.csv"))
+
+
+def test_featurise_ligand_com(pele_folder):
+    folder, data = pele_folder
+    writePELETrajectories(folder, pairs=(("P1", "L1"),))
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    columns = pele_utils.featuriseLigandCOM(report_cache, chunk_size=4)
+
+    rows = pele_utils.sortTrajectoryRows(report_cache, report_cache.getPairRows()[("P1", "L1")])
+    com = np.stack([report_cache.getColumn(column)[rows] for column in columns], axis=1)
+    frames = [
+        md.load(os.path.join(folder, "P1-L1", "output", str(epoch), f"trajectory_{t}.pdb"))
+        for epoch in range(2)
+        for t in (1, 2)
+    ]
+    # The receptor barely moves, so the superposition keeps the raw coordinates
+    expected = np.concatenate([frame.xyz[:, 4:].mean(axis=1) * 10 for frame in frames])
+    assert np.allclose(com, expected, atol=0.1)
+
+    # No trajectories for the other pair
+    other = report_cache.getPairRows()[("P2", "L1")]
+    assert np.isnan(report_cache.getColumn("ligand_com_x")[other]).all()
@@ -0,0 +1,83 @@
+"""
+Tests of the columnar cache of the PELE data
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import pele_utils
+
+
+def test_store_and_read(pele_folder):
+    folder, data = pele_folder
+
+    report_cache = pele_utils.PELEReportCache(folder)
+    assert report_cache.store(data) == len(data)
+
+    # The stored data is read back from disk
+    report_cache = pele_utils.PELEReportCache(folder)
+    assert len(report_cache) == len(data)
+    assert report_cache.proteins == ["P1", "P2"]
+    assert isinstance(report_cache.getColumn("Binding Energy"), np.memmap)
+    np.testing.assert_array_equal(
+        report_cache.getColumn("Binding Energy"), data["Binding Energy"].to_numpy()
+    )
+
+    stored = report_cache.getData()
+    pd.testing.assert_frame_equal(
+        stored.reset_index().astype({"Protein": str, "Ligand": str}),
+        data.reset_index(),
+        check_dtype=False,
+    )
+
+
+def test_read_a_pair(pele_folder):
+    folder, data = pele_folder
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    stored = report_cache.getData(["Binding Energy"], protein="P2")
+    expected = data.xs("P2", level="Protein", drop_level=False)["Binding Energy"]
+    np.testing.assert_array_equal(stored["Binding Energy"], expected)
+    assert list(stored.columns) == ["Binding Energy"]
+
+    # Single rows, in the order of the cache
+    stored = report_cache.getData(["Binding Energy"], protein="P2", rows=[len(data) - 1, 0, 1])
+    np.testing.assert_array_equal(stored["Binding Energy"], expected.iloc[-1:])
+
+    rows = report_cache.getPairRows()
+    assert sorted(rows) == [("P1", "L1"), ("P2", "L1")]
+    assert sum(len(r) for r in rows.values()) == len(data)
+    assert set(report_cache.getColumn("Protein")[rows[("P1", "L1")]]) == {0}
+
+    # The rows are computed once, until the data is stored again
+    assert report_cache.getPairRows() is rows
+    report_cache.store(data.loc[["P1"]])
+    assert sorted(report_cache.getPairRows()) == [("P1", "L1")]
+
+    # Only the columns with data of each pair
+    assert "distance_A10OG_L1C1" in report_cache.getPairColumns("P1", "L1")
+    assert "distance_A20OG_L1C1" not in report_cache.getPairColumns("P1", "L1")
+
+
+def test_set_column(pele_folder):
+    folder, data = pele_folder
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+
+    report_cache.setColumn("metric_SG_S", np.arange(len(data)))
+    report_cache = pele_utils.PELEReportCache(folder)
+    np.testing.assert_array_equal(report_cache.getColumn("metric_SG_S"), np.arange(len(data)))
+
+    with pytest.raises(ValueError):
+        report_cache.setColumn("Epoch", np.zeros(len(data)))
+    with pytest.raises(ValueError):
+        report_cache.setColumn("metric_SG_S", np.zeros(3))
+
+
+def test_store_requires_the_pele_analysis_index(pele_folder):
+    folder, data = pele_folder
+
+    with pytest.raises(ValueError, match="Accepted Pele Steps"):
+        pele_utils.PELEReportCache(folder).store(data.reset_index("Accepted Pele Steps"))
@@ -0,0 +1,94 @@
+"""
+Tests of the PELE trajectories left on the remote and fetched on demand
+"""
+
+import json
+import os
+import types
+
+import pytest
+
+import pele_utils
+from conftest import LocalRemote
+
+
+def _writeIndex(pele_folder, remote_folder, trajectories):
+    index = {
+        "remote": LocalRemote.name,
+        "host": LocalRemote.host,
+        "remote_folder": str(remote_folder),
+        "trajectories": {path: 10 for path in trajectories},
+    }
+    with open(os.path.join(pele_folder, pele_utils.TRAJECTORY_INDEX_FILE), "w") as f:
+        json.dump(index, f)
+
+
+@pytest.fixture
+def pele_folders(tmp_path):
+    remote_folder = tmp_path / "remote"
+    pele_folder = tmp_path / "pele"
+    remote_paths = [
+        os.path.join("P1-L1", "output", "output", "0", "trajectory_1.xtc"),
+        os.path.join("P1-L1", "output", "output", "1", "trajectory_2.xtc"),
+    ]
+    for path in remote_paths:
+        os.makedirs(os.path.dirname(remote_folder / path), exist_ok=True)
+        (remote_folder / path).write_text(path)
+
+    # A trajectory already downloaded
+    local = pele_folder / "P2-L1" / "output" / "output" / "0" / "trajectory_1.xtc"
+    local.parent.mkdir(parents=True)
+    local.write_text("local")
+
+    _writeIndex(str(pele_folder), remote_folder, remote_paths)
+    return str(pele_folder), str(remote_folder), remote_paths
+
+
+def test_trajectory_paths(pele_folders):
+    pele_folder, _, remote_paths = pele_folders
+
+    lookup = pele_utils.getTrajectoryLookup(pele_folder)
+    assert lookup[("P1-L1", 1, 2)] == remote_paths[1]
+    assert ("P2-L1", 0, 1) in lookup
+
+    paths = pele_utils.getTrajectoryPaths(
+        pele_folder, [("P1", "L1", 0, 1), ("P1", "L1", 0, 1), ("P2", "L1", 0, 1)]
+    )
+    assert paths == [
+        remote_paths[0],
+        os.path.join("P2-L1", "output", "output", "0", "trajectory_1.xtc"),
+    ]
+
+    with pytest.raises(ValueError):
+        pele_utils.getTrajectoryPaths(pele_folder, [("P1", "L1", 5, 1)])
+
+
+def test_fetch_trajectories(tmp_path, monkeypatch, pele_folders):
+    pele_folder, remote_folder, remote_paths = pele_folders
+    monkeypatch.chdir(tmp_path)
+    block = types.SimpleNamespace(remote=LocalRemote())
+
+    paths = pele_utils.fetchTrajectories(block, pele_folder, [remote_paths[1]])
+
+    assert paths == [os.path.join(pele_folder, remote_paths[1])]
+    with open(paths[0]) as f:
+        assert f.read() == remote_paths[1]
+    assert not os.path.exists(os.path.join(pele_folder, remote_paths[0]))
+    # Only the archive was transferred, and it was removed from the remote
+    assert not any(file.endswith(".tar") for file in os.listdir(remote_folder))
+
+    # Files already downloaded are not fetched again
+    block.remote.commands.clear()
+    pele_utils.fetchTrajectories(block, pele_folder, [remote_paths[1]])
+    assert block.remote.commands == []
+
+
+def test_fetch_trajectories_from_another_remote(pele_folders):
+    pele_folder, _, remote_paths = pele_folders
+    remote = LocalRemote()
+    remote.host = "other.example.org"
+
+    with pytest.raises(ValueError, match="Select that remote"):
+        pele_utils.fetchTrajectories(
+            types.SimpleNamespace(remote=remote), pele_folder, [remote_paths[0]]
+        )
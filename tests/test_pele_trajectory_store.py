@@ -0,0 +1,69 @@
+"""
+Tests of the compressed PELE trajectory store
+"""
+
+import os
+
+import mdtraj as md
+import numpy as np
+import pytest
+
+import pele_utils
+from conftest import writePELETrajectories
+
+
+@pytest.fixture
+def store(pele_folder):
+    folder, data = pele_folder
+    writePELETrajectories(folder, pairs=(("P1", "L1"),))
+    report_cache = pele_utils.PELEReportCache(folder)
+    report_cache.store(data)
+    return folder, report_cache
+
+
+def loadFrame(folder, epoch, trajectory, step):
+    path = os.path.join(folder, "P1-L1", "output", str(epoch), f"trajectory_{trajectory}.pdb")
+    return md.load_frame(path, step)
+
+
+def test_pack_and_get_frames(store):
+    folder, report_cache = store
+    trajectory_store = pele_utils.PELETrajectoryStore(folder)
+
+    # Shards of 3 frames span several trajectories, the pair without them is skipped
+    assert trajectory_store.pack(report_cache, frames_per_shard=3, verbose=False) == 20
+    pair_folder = os.path.join(trajectory_store.store_folder, "P1-L1")
+    assert len([f for f in os.listdir(pair_folder) if f.startswith("shard_")]) == 7
+    assert not os.path.exists(os.path.join(trajectory_store.store_folder, "P2-L1"))
+
+    steps = [(1, 2, 4), (0, 1, 0), (1, 1, 2), (0, 2, 3)]
+    frames = pele_utils.PELETrajectoryStore(folder).getFrames("P1", "L1", steps)
+    assert frames.n_frames == len(steps)
+    for frame, step in zip(frames, steps):
+        expected = loadFrame(folder, *step)
+        assert np.allclose(frame.xyz, expected.xyz, atol=6e-4)
+        assert frame.topology == expected.topology
+
+    assert sorted(trajectory_store.getSteps("P1", "L1")) == sorted(
+        (e, t, s) for e in range(2) for t in (1, 2) for s in range(5)
+    )
+    assert trajectory_store.getSteps("P2", "L1") == []
+
+
+def test_pack_skips_complete_pairs(store):
+    folder, report_cache = store
+    trajectory_store = pele_utils.PELETrajectoryStore(folder)
+    trajectory_store.pack(report_cache, verbose=False)
+
+    assert pele_utils.PELETrajectoryStore(folder).pack(report_cache, verbose=False) == 0
+
+
+def test_missing_frames(store):
+    folder, report_cache = store
+    trajectory_store = pele_utils.PELETrajectoryStore(folder)
+    trajectory_store.pack(report_cache, verbose=False)
+
+    with pytest.raises(ValueError):
+        trajectory_store.getFrame("P1", "L1", 3, 1, 0)
+    with pytest.raises(ValueError):
+        trajectory_store.getFrame("P2", "L1", 0, 1, 0)
@@ -0,0 +1,103 @@
+"""
+Tests of the residue index of a models folder
+"""
+
+import json
+import os
+
+import pytest
+from Bio.PDB import PDBParser
+
+import structure_utils
+
+_PDB = """\
+ATOM      1  N   SER A  10       0.000   0.000   0.000  1.00  0.00           N
+ATOM      2  CA  SER A  10       1.000   0.000   0.000  1.00  0.00           C
+ATOM      3  OG  SER A  10       2.000   0.000   0.000  1.00  0.00           O
+ATOM      4  N   HIS A  11       3.000   0.000   0.000  1.00  0.00           N
+ATOM      5  CA  HIS A  11       4.000   0.000   0.000  1.00  0.00           C
+ATOM      6  N   SER B  10       5.000   0.000   0.000  1.00  0.00           N
+ATOM      7  CA  SER B  10       6.000   0.000   0.000  1.00  0.00           C
+ATOM      8  N   ASP B   9       7.000   0.000   0.000  1.00  0.00           N
+END
+"""
+
+
+class Models(list):
+    """
+    Stand-in of proteinModels: the model names, with their parsed structures and
+    the number of times each structure was walked.
+    """
+
+    def __init__(self, models_folder, names):
+        super().__init__(names)
+        self.walked = {name: 0 for name in names}
+        self.structures = {name: _CountedStructure(self, models_folder, name) for name in names}
+
+
+class _CountedStructure:
+    def __init__(self, models, models_folder, name):
+        self.models = models
+        self.name = name
+        path = os.path.join(models_folder, name + ".pdb")
+        self.structure = PDBParser(QUIET=True).get_structure(name, path)
+
+    def get_residues(self):
+        self.models.walked[self.name] += 1
+        return self.structure.get_residues()
+
+
+@pytest.fixture
+def models_folder(tmp_path):
+    for name in ("M1", "M2"):
+        (tmp_path / f"{name}.pdb").write_text(_PDB)
+    return str(tmp_path)
+
+
+def test_residue_index(models_folder):
+    index = structure_utils.ResidueIndex(models_folder, Models(models_folder, ["M1", "M2"]))
+
+    assert index.findResidues("M1", ["9"]) == [("B", 9, "ASP")]
+
+    # Residues are returned in the order of the structure
+    assert index.findResidues("M2", [9, 10]) == [
+        ("A", 10, "SER"),
+        ("B", 10, "SER"),
+        ("B", 9, "ASP"),
+    ]
+    assert index.findResidues("M2", [11, 9], name="ASP") == [("B", 9, "ASP")]
+    assert index.findResidues("M2", [99]) == []
+
+
+def test_cached_models_are_not_walked(models_folder):
+    structure_utils.ResidueIndex(models_folder, Models(models_folder, ["M1"]))
+
+    models = Models(models_folder, ["M1", "M2"])
+    index = structure_utils.ResidueIndex(models_folder, models)
+    assert models.walked == {"M1": 0, "M2": 1}
+    assert index.findResidues("M1", [11]) == [("A", 11, "HIS")]
+
+    with open(
+        os.path.join(models_folder, structure_utils.RESIDUE_INDEX_FILE), encoding="utf-8"
+    ) as f:
+        assert sorted(json.load(f)) == ["M1", "M2"]
+
+    models = Models(models_folder, ["M1", "M2"])
+    structure_utils.ResidueIndex(models_folder, models)
+    assert models.walked == {"M1": 0, "M2": 0}
+
+
+def test_modified_models_are_walked_again(models_folder):
+    structure_utils.ResidueIndex(models_folder, Models(models_folder, ["M1", "M2"]))
+
+    path = os.path.join(models_folder, "M2.pdb")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(_PDB.replace("ASP B   9", "GLU B   9"))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    models = Models(models_folder, ["M1", "M2"])
+    index = structure_utils.ResidueIndex(models_folder, models)
+    assert models.walked == {"M1": 0, "M2": 1}
+    assert index.findResidues("M2", [9]) == [("B", 9, "GLU")]
+    assert index.findResidues("M1", [9]) == [("B", 9, "ASP")]